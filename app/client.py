@@ -1,65 +1,82 @@
 import logging
 
-from app.redis import REDIS_QUIT, decode_redis, handle_redis, send_handshake
+from app.redis import (
+    RESP_PENDING,
+    RecvBuffer,
+    RedisConnection,
+    RespParser,
+    flush_aof,
+    handle_redis,
+    send_handshake,
+    set_info,
+)
 from lib import curio
 
+MASTER_RETRY_DELAY = 1.0
+
 
 async def run_client(replicaof: str, slave_port: int) -> None:
     master_host, master_port = replicaof.split(" ")
-    logging.info("Connecting to master on %s:%s", master_host, master_port)
+    set_info("replication", "master_host", master_host)
+    set_info("replication", "master_port", int(master_port))
+    # kept across reconnects, so the master can send only what was missed
+    master_id, master_offset = "?", -1
+    while True:
+        set_info("replication", "master_link_status", "down")
+        logging.info("Connecting to master on %s:%s", master_host, master_port)
+        try:
+            sock = await curio.open_connection(master_host, int(master_port))
+        except OSError as e:
+            logging.warning("Cannot connect to master: %s", e)
+            await curio.sleep(MASTER_RETRY_DELAY)
+            continue
 
-    sock = await curio.open_connection(master_host, int(master_port))
-    async with sock:
-        master_id, master_offset, recv_message = await send_handshake(sock, slave_port)
-        logging.info("Connected to master %s:%s", master_id, master_offset)
+        async with sock:
+            try:
+                recv_buffer = RecvBuffer()
+                parser = RespParser()
+                master_id, master_offset = await send_handshake(
+                    sock, slave_port, recv_buffer, master_id, master_offset
+                )
+                logging.info("Connected to master %s:%s", master_id, master_offset)
+                set_info("replication", "master_link_status", "up")
 
-        master_offset = 0
-        multi_state = False
-        while True:
-            if len(recv_message) > 0:
-                logging.info("Master recv  %s", repr(recv_message))
-                send_message = b""
-                while len(recv_message) > 0:
-                    command_line, parsed_length = decode_redis(recv_message)
-                    if parsed_length == 0:
-                        break
-                    logging.info(
-                        "Master command line %s (%d)",
-                        str(command_line),
-                        parsed_length,
-                    )
+                connection = RedisConnection(
+                    sock, is_master=True, recv_buffer=recv_buffer
+                )
+                while True:
+                    if len(recv_buffer) > 0:
+                        logging.info("Master recv %d", len(recv_buffer))
+                        while len(recv_buffer) > 0:
+                            command_line = parser.parse(recv_buffer)
+                            if command_line is RESP_PENDING:
+                                break
+                            logging.info(
+                                "Master command line %s (%d)",
+                                str(command_line),
+                                parser.length,
+                            )
 
-                    (
-                        send_message,
-                        _,
-                        _,
-                        send_master,
-                        multi_state,
-                        _,
-                        _,
-                        _,
-                        _,
-                    ) = await handle_redis(
-                        command_line,
-                        master_offset,
-                        multi_state,
-                    )
+                            connection.master_offset = master_offset
+                            await handle_redis(connection, command_line)
+                            master_offset += parser.length
 
-                    recv_message = recv_message[parsed_length:]
-                    master_offset += parsed_length
+                            if connection.quit:
+                                break
 
-                    if send_master:
-                        logging.info("Master send %s", repr(send_master))
-                        await sock.sendall(send_master)
+                        set_info("replication", "master_repl_offset", master_offset)
+                        await flush_aof()
+                        await connection.flush()
 
-                    if send_message == REDIS_QUIT:
-                        break
+                        if connection.quit:
+                            return
 
-                if send_message == REDIS_QUIT:
-                    break
-
-            recv_message += await sock.recv(100)
-            if not recv_message:
-                break
+                    if await recv_buffer.recv(sock) == 0:
+                        break
+            except (OSError, ValueError) as e:
+                # ConnectionError for an unexpected handshake reply, ValueError
+                # for a reply or RDB payload that does not parse
+                logging.warning("Lost connection to master: %s", e)
 
         logging.info("Closing connection to master")
+        await curio.sleep(MASTER_RETRY_DELAY)
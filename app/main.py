@@ -19,12 +19,23 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--dbfilename")
     parser.add_argument("--replicaof")
     parser.add_argument("--port", type=int, default=REDIS_PORT)
+    parser.add_argument("--appendonly", choices=["yes", "no"])
+    parser.add_argument("--appendfsync", choices=["always", "everysec", "no"])
     return parser.parse_args()
 
 
 def main() -> None:
     args = parse_args()
-    curio.run(run_server(args.dir, args.dbfilename, args.port, args.replicaof))
+    curio.run(
+        run_server(
+            args.dir,
+            args.dbfilename,
+            args.port,
+            args.replicaof,
+            args.appendonly,
+            args.appendfsync,
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -1,20 +1,34 @@
-from .handler import REDIS_QUIT, REDIS_SEPARATOR, handle_redis
+from .aof import flush_aof, run_aof_cycle
+from .buffer import RecvBuffer
+from .connection import RedisConnection
+from .expire import run_expire_cycle
+from .handler import handle_redis
 from .handshake import send_handshake
-from .pubsub import pub_message, sub_channel, unsub_channel
-from .resp import decode_redis
+from .info import set_info
+from .pubsub import pub_message, punsub_pattern, sub_channel, unsub_channel
+from .resp import REDIS_SEPARATOR, RESP_PENDING, RespParser
+from .save import run_save_cycle
 from .setup import setup_redis
-from .slave import register_slave, send_write
+from .slave import send_write, wait_slave_closed
 
 __all__ = [
-    "REDIS_QUIT",
     "REDIS_SEPARATOR",
-    "decode_redis",
+    "RESP_PENDING",
+    "RecvBuffer",
+    "RedisConnection",
+    "RespParser",
+    "flush_aof",
     "handle_redis",
     "pub_message",
-    "register_slave",
+    "punsub_pattern",
+    "run_aof_cycle",
+    "run_expire_cycle",
+    "run_save_cycle",
     "send_handshake",
     "send_write",
+    "set_info",
     "setup_redis",
     "sub_channel",
     "unsub_channel",
+    "wait_slave_closed",
 ]
@@ -0,0 +1,395 @@
+import logging
+import os
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from pathlib import Path
+from time import monotonic
+from typing import Any
+
+from lib import curio
+
+from .buffer import RecvBuffer
+from .command import REDIS_COMMANDS
+from .config import get_config, parse_memory
+from .connection import RedisConnection
+from .database import replace_db, snapshot_db
+from .info import register_info
+from .rdb import RDBReader, iter_rdb
+from .rdb.file.constants import RDB_NAME, DBType
+from .resp import RESP_PENDING, RespParser, encode_redis
+
+AOF_READ_SIZE = 64 * 1024
+AOF_FSYNC_PERIOD = 1
+# the rewrite catches up with the writes made meanwhile until this is left
+AOF_REWRITE_TAIL_SIZE = 64 * 1024
+AOF_REWRITE_RETRY_DELAY = 60
+AOF_REWRITE_RETRY_MAX = 3600
+# elements per command for the types the RDB preamble does not hold
+AOF_REWRITE_ITEMS_PER_CMD = 64
+
+REDIS_AOF_FD: int | None = None
+# commands of the current loop iteration, written before any reply goes out
+REDIS_AOF_BUF = bytearray()
+REDIS_AOF_SIZE = 0
+REDIS_AOF_FSYNCED_SIZE = 0
+REDIS_AOF_LAST_FSYNC = 0.0
+REDIS_AOF_FSYNC_RUNNING = False
+REDIS_AOF_WRITE_OK = True
+# size after the last rewrite, the auto rewrite compares the growth to it
+REDIS_AOF_BASE_SIZE = 0
+# writes made since the rewrite snapshot, appended to the rewritten file
+REDIS_AOF_REWRITE_BUF: bytearray | None = None
+REDIS_AOF_REWRITE_START = 0.0
+REDIS_AOF_REWRITE_FAILS = 0
+REDIS_AOF_LAST_REWRITE_TRY = 0.0
+REDIS_AOF_LAST_REWRITE_TIME = -1
+
+
+def get_aof_path() -> Path:
+    return Path(get_config("dir") or ".") / (
+        get_config("appendfilename") or "appendonly.aof"
+    )
+
+
+def open_aof() -> None:
+    global REDIS_AOF_FD, REDIS_AOF_SIZE, REDIS_AOF_FSYNCED_SIZE, REDIS_AOF_BASE_SIZE
+    aof_fn = get_aof_path()
+    REDIS_AOF_FD = os.open(aof_fn, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    REDIS_AOF_SIZE = os.fstat(REDIS_AOF_FD).st_size
+    REDIS_AOF_FSYNCED_SIZE = REDIS_AOF_BASE_SIZE = REDIS_AOF_SIZE
+    logging.info("Appending to %s from %d", aof_fn, REDIS_AOF_SIZE)
+
+
+def create_aof(aof_fn: Path) -> None:
+    """Start the AOF with the keys loaded from the RDB"""
+    with aof_fn.open("wb") as f:
+        for chunk in iter_rewrite_aof(*snapshot_db()):
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def iter_rewrite_aof(
+    meta: dict[str, str | int],
+    data: dict[int, dict[bytes, dict[str, Any]]],
+    dexp: dict[int, dict[bytes, int]],
+) -> Iterator[bytes]:
+    """An RDB preamble with the strings, then commands for the other types"""
+    strings = {
+        num: {key: entry for key, entry in db.items() if entry["type"] == DBType.STR}
+        for num, db in data.items()
+    }
+    yield from iter_rdb(
+        meta,
+        strings,
+        {
+            num: {key: exp for key, exp in db.items() if key in strings.get(num, {})}
+            for num, db in dexp.items()
+        },
+    )
+
+    # only the served database holds other types, commands replay into it
+    chunk = bytearray()
+    for num, db in data.items():
+        for key, entry in db.items():
+            if key in strings[num]:
+                continue
+            # a whole key between yields, copy_on_write only swaps the
+            # snapshot entry and would not stop a change to this one
+            for command_line in iter_value_commands(key, entry):
+                chunk += encode_redis(command_line)
+            if len(chunk) >= AOF_READ_SIZE:
+                yield bytes(chunk)
+                chunk.clear()
+    yield bytes(chunk)
+
+
+def iter_value_commands(key: bytes, entry: dict[str, Any]) -> Iterator[list[bytes]]:
+    value = entry["value"]
+    match entry["type"]:
+        case DBType.LIST:
+            for items in iter_batches(value):
+                yield [b"RPUSH", key, *items]
+        case DBType.ZSET:
+            for pairs in iter_batches(value.items()):
+                command_line = [b"ZADD", key]
+                for member, score in pairs:
+                    command_line.extend([str(score).encode(), member])
+                yield command_line
+        case DBType.STREAM:
+            for sid, fields in value.range((0, 0), value.last_id):
+                yield [b"XADD", key, b"%d-%d" % sid, *fields]
+            if not value:
+                # an emptied stream keeps its last ID for the next XADD
+                yield [b"XADD", key, b"%d-%d" % value.last_id, b"x", b"y"]
+                yield [b"XTRIM", key, b"MAXLEN", b"0"]
+        case dtype:
+            raise TypeError(f"cannot rewrite {dtype} values")
+
+
+def iter_batches(values: Iterable[Any]) -> Iterator[list[Any]]:
+    it = iter(values)
+    while batch := list(islice(it, AOF_REWRITE_ITEMS_PER_CMD)):
+        yield batch
+
+
+def write_aof(fd: int, data: bytes | bytearray) -> int:
+    """Write all of data, returns how much made it when the write fails"""
+    written = 0
+    with memoryview(data) as view:
+        try:
+            while written < len(view):
+                written += os.write(fd, view[written:])
+        except OSError as e:
+            logging.warning("Error writing to the AOF: %s", e)
+    return written
+
+
+def write_rewrite_aof(fd: int, data: bytes | bytearray) -> None:
+    with memoryview(data) as view:
+        written = 0
+        while written < len(view):
+            written += os.write(fd, view[written:])
+
+
+def feed_aof(message: bytes) -> None:
+    if REDIS_AOF_FD is not None:
+        REDIS_AOF_BUF.extend(message)
+    if REDIS_AOF_REWRITE_BUF is not None:
+        REDIS_AOF_REWRITE_BUF.extend(message)
+
+
+async def flush_aof() -> None:
+    """Write the buffered commands in one go, then fsync as appendfsync says
+
+    Every client flushing replies calls this first, so the commands of all
+    clients served since the last write share a single write and fsync.
+    """
+    global REDIS_AOF_SIZE, REDIS_AOF_WRITE_OK
+    if REDIS_AOF_FD is None:
+        return
+
+    if REDIS_AOF_BUF:
+        # the rest stays buffered and is tried again on the next flush
+        written = write_aof(REDIS_AOF_FD, REDIS_AOF_BUF)
+        REDIS_AOF_WRITE_OK = written == len(REDIS_AOF_BUF)
+        del REDIS_AOF_BUF[:written]
+        REDIS_AOF_SIZE += written
+
+    match get_config("appendfsync"):
+        case "always":
+            # also covers commands a rewrite moved to the new file unsynced
+            if REDIS_AOF_FSYNCED_SIZE < REDIS_AOF_SIZE:
+                await fsync_aof()
+        case "everysec":
+            if monotonic() - REDIS_AOF_LAST_FSYNC >= AOF_FSYNC_PERIOD:
+                await spawn_fsync_aof()
+
+
+async def fsync_aof() -> None:
+    global REDIS_AOF_FSYNCED_SIZE, REDIS_AOF_LAST_FSYNC
+    fd = REDIS_AOF_FD
+    if fd is None:
+        return
+    size = REDIS_AOF_SIZE
+    REDIS_AOF_LAST_FSYNC = monotonic()
+    try:
+        await curio.run_in_thread(os.fsync, fd)
+    except OSError as e:
+        # a rewrite may close the file under it
+        logging.warning("Error fsyncing the AOF: %s", e)
+        return
+    if fd == REDIS_AOF_FD:
+        REDIS_AOF_FSYNCED_SIZE = max(REDIS_AOF_FSYNCED_SIZE, size)
+
+
+async def run_fsync_aof() -> None:
+    global REDIS_AOF_FSYNC_RUNNING
+    try:
+        await fsync_aof()
+    finally:
+        REDIS_AOF_FSYNC_RUNNING = False
+
+
+async def spawn_fsync_aof() -> None:
+    """fsync off the loop, at most one at a time, replies do not wait for it"""
+    global REDIS_AOF_FSYNC_RUNNING
+    if REDIS_AOF_FSYNC_RUNNING or REDIS_AOF_FSYNCED_SIZE == REDIS_AOF_SIZE:
+        return
+    REDIS_AOF_FSYNC_RUNNING = True
+    await curio.spawn(run_fsync_aof, daemon=True)
+
+
+async def run_aof_cycle() -> None:
+    """Write commands no reply flushed yet and catch up on the everysec fsync"""
+    while True:
+        await curio.sleep(AOF_FSYNC_PERIOD)
+        if REDIS_AOF_FD is None:
+            continue
+        await flush_aof()
+        if get_config("appendfsync") == "everysec":
+            await spawn_fsync_aof()
+        if is_aof_rewrite_due():
+            await start_rewrite_aof()
+
+
+def is_aof_rewrite_due() -> bool:
+    """auto-aof-rewrite-percentage growth over the base, past the min size"""
+    if REDIS_AOF_REWRITE_BUF is not None:
+        return False
+    if REDIS_AOF_REWRITE_FAILS:
+        # failures back off, a rewrite that cannot finish is not retried hot
+        delay = AOF_REWRITE_RETRY_DELAY * 2 ** (REDIS_AOF_REWRITE_FAILS - 1)
+        if monotonic() - REDIS_AOF_LAST_REWRITE_TRY < min(delay, AOF_REWRITE_RETRY_MAX):
+            return False
+    percentage = int(get_config("auto-aof-rewrite-percentage") or 0)
+    min_size = parse_memory(get_config("auto-aof-rewrite-min-size") or "0")
+    if percentage <= 0 or min_size > REDIS_AOF_SIZE:
+        return False
+    base = max(REDIS_AOF_BASE_SIZE, 1)
+    return (REDIS_AOF_SIZE - base) * 100 >= base * percentage
+
+
+async def start_rewrite_aof() -> str | None:
+    """Rewrite the AOF in a background task, returns an error message on failure"""
+    global REDIS_AOF_REWRITE_BUF, REDIS_AOF_REWRITE_START, REDIS_AOF_LAST_REWRITE_TRY
+    if REDIS_AOF_FD is None:
+        return "ERR Background append only file rewriting needs appendonly yes"
+    if REDIS_AOF_REWRITE_BUF is not None:
+        return "ERR Background append only file rewriting already in progress"
+
+    # the snapshot and the start of the buffering happen at the same point
+    chunks = iter_rewrite_aof(*snapshot_db())
+    REDIS_AOF_REWRITE_BUF = bytearray()
+    REDIS_AOF_REWRITE_START = REDIS_AOF_LAST_REWRITE_TRY = monotonic()
+    await curio.spawn(run_rewrite_aof, chunks, daemon=True)
+    return None
+
+
+async def run_rewrite_aof(chunks: Iterator[bytes]) -> None:
+    global REDIS_AOF_REWRITE_BUF, REDIS_AOF_REWRITE_FAILS, REDIS_AOF_LAST_REWRITE_TIME
+    # the same buffer feed_aof extends, until the rewrite ends
+    rewrite_buf = REDIS_AOF_REWRITE_BUF
+    if rewrite_buf is None:
+        return
+    aof_fn = get_aof_path()
+    aof_tmp = aof_fn.with_name(f"temp-rewriteaof-{os.getpid()}.aof")
+    logging.info("Background append only file rewriting started")
+    fd = None
+    try:
+        fd = os.open(
+            aof_tmp, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_TRUNC, 0o644
+        )
+        for chunk in chunks:
+            write_rewrite_aof(fd, chunk)
+            await curio.sleep(0)
+
+        # fsync in a worker while new writes keep coming, until few are left
+        while True:
+            await curio.run_in_thread(os.fsync, fd)
+            if len(rewrite_buf) <= AOF_REWRITE_TAIL_SIZE:
+                break
+            tail = bytes(rewrite_buf)
+            rewrite_buf.clear()
+            write_rewrite_aof(fd, tail)
+
+        # from here on nothing yields, so no write can fall between the files
+        synced = os.fstat(fd).st_size
+        write_rewrite_aof(fd, rewrite_buf)
+        aof_tmp.replace(aof_fn)
+        swap_aof(fd, synced)
+        fd = None
+        REDIS_AOF_REWRITE_FAILS = 0
+        logging.info("Background AOF rewrite terminated with success")
+    except (OSError, TypeError) as e:
+        logging.warning("Background AOF rewrite error: %s", e)
+        REDIS_AOF_REWRITE_FAILS += 1
+    finally:
+        if fd is not None:
+            os.close(fd)
+            aof_tmp.unlink(missing_ok=True)
+        REDIS_AOF_REWRITE_BUF = None
+        REDIS_AOF_LAST_REWRITE_TIME = round(monotonic() - REDIS_AOF_REWRITE_START)
+
+
+def swap_aof(fd: int, synced: int) -> None:
+    """Append to the rewritten file, which holds every command fed so far"""
+    global REDIS_AOF_FD, REDIS_AOF_SIZE, REDIS_AOF_FSYNCED_SIZE, REDIS_AOF_BASE_SIZE
+    if REDIS_AOF_FD is not None:
+        os.close(REDIS_AOF_FD)
+    REDIS_AOF_FD = fd
+    REDIS_AOF_BUF.clear()
+    REDIS_AOF_SIZE = REDIS_AOF_BASE_SIZE = os.fstat(fd).st_size
+    REDIS_AOF_FSYNCED_SIZE = synced
+
+
+async def load_aof(aof_fn: Path) -> int:
+    """Replay the commands of the AOF, returns how many ran
+
+    A rewritten AOF starts with an RDB preamble, loaded before the commands.
+    A command cut short by a crash is dropped and the file truncated
+    before it, like redis with aof-load-truncated.
+    """
+    # replies and propagation are discarded, handlers run as for the master
+    connection = RedisConnection(None, is_master=True)
+    recv_buffer = RecvBuffer()
+    parser = RespParser()
+    loaded = 0
+    valid_size = 0
+    with aof_fn.open("rb") as f:
+        reader = RDBReader() if f.read(len(RDB_NAME)) == RDB_NAME.encode() else None
+        f.seek(0)
+        while chunk := f.read(AOF_READ_SIZE):
+            recv_buffer.data.extend(chunk)
+            if reader is not None:
+                pos = reader.parse(recv_buffer.data, recv_buffer.start)
+                valid_size += pos - recv_buffer.start
+                recv_buffer.consume(pos - recv_buffer.start)
+                if not reader.done:
+                    continue
+                replace_db(reader.meta, reader.data, reader.dexp)
+                reader = None
+            while len(recv_buffer) > 0:
+                command_line = parser.parse(recv_buffer)
+                if command_line is RESP_PENDING:
+                    break
+                name = command_line[0].upper().decode(errors="replace")
+                cmd = REDIS_COMMANDS.get(name)
+                if cmd is None:
+                    raise ValueError(f"unknown command '{name}' in the AOF")
+                await cmd.handler(connection, command_line[1:])
+                connection.replies.clear()
+                valid_size += parser.length
+                loaded += 1
+        size = f.tell()
+
+    if reader is not None:
+        raise ValueError("AOF ends inside its RDB preamble")
+    if valid_size < size:
+        logging.warning(
+            "AOF ends with a partial command, truncating %d bytes", size - valid_size
+        )
+        os.truncate(aof_fn, valid_size)
+    logging.warning("Loaded %d commands from %s", loaded, aof_fn)
+    return loaded
+
+
+def get_aof_info() -> dict[str, str | int]:
+    info: dict[str, str | int] = {"aof_enabled": int(REDIS_AOF_FD is not None)}
+    if REDIS_AOF_FD is not None:
+        info["aof_last_write_status"] = "ok" if REDIS_AOF_WRITE_OK else "err"
+        info["aof_current_size"] = REDIS_AOF_SIZE
+        info["aof_buffer_length"] = len(REDIS_AOF_BUF)
+        info["aof_pending_fsync"] = REDIS_AOF_SIZE - REDIS_AOF_FSYNCED_SIZE
+        info["aof_base_size"] = REDIS_AOF_BASE_SIZE
+    rewrite_time = -1
+    if REDIS_AOF_REWRITE_BUF is not None:
+        rewrite_time = round(monotonic() - REDIS_AOF_REWRITE_START)
+    info["aof_rewrite_in_progress"] = int(REDIS_AOF_REWRITE_BUF is not None)
+    info["aof_last_rewrite_time_sec"] = REDIS_AOF_LAST_REWRITE_TIME
+    info["aof_current_rewrite_time_sec"] = rewrite_time
+    info["aof_last_bgrewrite_status"] = "err" if REDIS_AOF_REWRITE_FAILS else "ok"
+    return info
+
+
+register_info("persistence", get_aof_info)
@@ -0,0 +1,35 @@
+class ReplBacklog:
+    """Circular buffer holding the tail of the replication stream.
+
+    Positions are derived from the replication offset, so a reconnecting
+    replica can be sent everything after the offset it already has as long
+    as that is still within the last `size` bytes.
+    """
+
+    def __init__(self, size: int, offset: int = 0) -> None:
+        self.data = bytearray(size)
+        self.size = size
+        self.offset = offset
+        self.histlen = 0
+
+    @property
+    def first_offset(self) -> int:
+        return self.offset - self.histlen
+
+    def append(self, data: bytes) -> None:
+        tail = memoryview(data)[-self.size :]
+        pos = (self.offset + len(data) - len(tail)) % self.size
+        first = min(len(tail), self.size - pos)
+        self.data[pos : pos + first] = tail[:first]
+        self.data[: len(tail) - first] = tail[first:]
+        self.offset += len(data)
+        self.histlen = min(self.histlen + len(data), self.size)
+
+    def get_range(self, offset: int) -> bytes | None:
+        """Stream bytes from offset to the end, None if they are not all held"""
+        if not self.first_offset <= offset <= self.offset:
+            return None
+        length = self.offset - offset
+        pos = offset % self.size
+        first = min(length, self.size - pos)
+        return bytes(self.data[pos : pos + first]) + bytes(self.data[: length - first])
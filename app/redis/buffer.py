@@ -0,0 +1,51 @@
+from lib import curio
+
+RECV_BUFFER_SIZE = 64 * 1024
+RECV_COMPACT_SIZE = 1024 * 1024
+
+
+class RecvBuffer:
+    """Per-connection read buffer, consumed by advancing `start`."""
+
+    def __init__(self, read_size: int = RECV_BUFFER_SIZE) -> None:
+        self.data = bytearray()
+        self.start = 0
+        self.read_size = read_size
+
+    def __len__(self) -> int:
+        return len(self.data) - self.start
+
+    async def recv(self, sock: curio.io.Socket, read_size: int | None = None) -> int:
+        if read_size is None:
+            read_size = self.read_size
+        if not self.data:
+            # idle connections wait without holding read_size of padding
+            chunk = await sock.recv(read_size)
+            self.data += chunk
+            return len(chunk)
+
+        end = len(self.data)
+        self.data.extend(bytes(read_size))
+        nbytes = 0
+        # a recv cancelled midway must neither leave the padding behind nor
+        # keep the bytearray exported
+        try:
+            with memoryview(self.data) as view, view[end:] as tail:
+                nbytes = await sock.recv_into(tail)
+        finally:
+            del self.data[end + nbytes :]
+        return nbytes
+
+    def consume(self, length: int) -> None:
+        self.start += length
+        if self.start == len(self.data):
+            self.data.clear()
+            self.start = 0
+        elif self.start >= RECV_COMPACT_SIZE and self.start * 2 >= len(self.data):
+            del self.data[: self.start]
+            self.start = 0
+
+    def take(self, length: int) -> bytes:
+        value = bytes(self.data[self.start : self.start + length])
+        self.consume(length)
+        return value
@@ -0,0 +1,117 @@
+from collections.abc import Awaitable, Callable
+
+from .connection import RedisConnection
+from .info import register_info
+from .rdb.file.constants import DBType
+
+CommandHandler = Callable[[RedisConnection, list[bytes]], Awaitable[None]]
+
+
+class RedisCommand:
+    """Command spec: arity and flags checked by the dispatcher, plus stats."""
+
+    def __init__(
+        self,
+        name: str,
+        arity: int,
+        handler: CommandHandler,
+        write: bool = False,
+        blocking: bool = False,
+        subscribe: bool = False,
+        transaction: bool = False,
+        keys: tuple[int, int, int] = (0, 0, 0),
+        key_type: DBType | None = None,
+    ) -> None:
+        self.name = name
+        self.arity = arity
+        self.handler = handler
+        self.write = write
+        self.blocking = blocking
+        self.subscribe = subscribe
+        self.transaction = transaction
+        self.keys = keys
+        # type the keys must hold when they exist, checked by the dispatcher
+        self.key_type = key_type
+        self.calls = 0
+        self.usec = 0
+        self.rejected_calls = 0
+        self.failed_calls = 0
+
+    def check_arity(self, length: int) -> bool:
+        if self.arity >= 0:
+            return length == self.arity
+        return length >= -self.arity
+
+    def get_keys(self, command_line: list[bytes]) -> list[bytes]:
+        first_key, last_key, step = self.keys
+        if first_key == 0:
+            return []
+        if last_key < 0:
+            last_key += len(command_line)
+        return command_line[first_key : last_key + 1 : step]
+
+    def get_flags(self) -> list[bytes]:
+        flags = [b"write" if self.write else b"readonly"]
+        if self.blocking:
+            flags.append(b"blocking")
+        if self.subscribe:
+            flags.append(b"pubsub")
+        if self.transaction:
+            flags.append(b"no_multi")
+        return flags
+
+    def get_info(self) -> list[bytes | int | list[bytes]]:
+        first_key, last_key, step = self.keys
+        return [
+            self.name.lower().encode(),
+            self.arity,
+            self.get_flags(),
+            first_key,
+            last_key,
+            step,
+        ]
+
+
+REDIS_COMMANDS: dict[str, RedisCommand] = {}
+
+
+def command(
+    name: str,
+    arity: int,
+    write: bool = False,
+    blocking: bool = False,
+    subscribe: bool = False,
+    transaction: bool = False,
+    keys: tuple[int, int, int] = (0, 0, 0),
+    key_type: DBType | None = None,
+) -> Callable[[CommandHandler], CommandHandler]:
+    def register(handler: CommandHandler) -> CommandHandler:
+        REDIS_COMMANDS[name] = RedisCommand(
+            name,
+            arity,
+            handler,
+            write=write,
+            blocking=blocking,
+            subscribe=subscribe,
+            transaction=transaction,
+            keys=keys,
+            key_type=key_type,
+        )
+        return handler
+
+    return register
+
+
+def get_command_stats() -> dict[str, str | int]:
+    return {
+        f"cmdstat_{cmd.name.lower()}": (
+            f"calls={cmd.calls},usec={cmd.usec},"
+            f"usec_per_call={cmd.usec / cmd.calls if cmd.calls else 0:.2f},"
+            f"rejected_calls={cmd.rejected_calls},failed_calls={cmd.failed_calls}"
+        )
+        for cmd in REDIS_COMMANDS.values()
+        if cmd.calls or cmd.rejected_calls
+    }
+
+
+register_info("commandstats", get_command_stats)
@@ -1,4 +1,33 @@
-REDIS_CONFIG = {}
+from functools import lru_cache
+
+REDIS_OUTPUT_BUFFER_LIMITS = {
+    "normal": (0, 0, 0),
+    "replica": (256 * 1024 * 1024, 64 * 1024 * 1024, 60),
+    "pubsub": (32 * 1024 * 1024, 8 * 1024 * 1024, 60),
+}
+
+REDIS_MEMORY_UNITS = {
+    "k": 1000,
+    "kb": 1024,
+    "m": 1000**2,
+    "mb": 1024**2,
+    "g": 1000**3,
+    "gb": 1024**3,
+}
+
+REDIS_CONFIG = {
+    "appendfilename": "appendonly.aof",
+    "appendfsync": "everysec",
+    "appendonly": "no",
+    "auto-aof-rewrite-min-size": "64mb",
+    "auto-aof-rewrite-percentage": "100",
+    "client-output-buffer-limit": " ".join(
+        f"{name} {hard} {soft} {seconds}"
+        for name, (hard, soft, seconds) in REDIS_OUTPUT_BUFFER_LIMITS.items()
+    ),
+    "repl-backlog-size": str(1024 * 1024),
+    "save": "3600 1 300 100 60 10000",
+}
 
 
 def get_config(name: str) -> str | None:
@@ -7,3 +36,45 @@ def get_config(name: str) -> str | None:
 
 def set_config(name: str, value: str) -> None:
     REDIS_CONFIG[name] = value
+
+
+def parse_memory(value: str) -> int:
+    """Bytes in a memory size like 1024, 64mb or 1gb"""
+    value = value.lower()
+    for unit, scale in REDIS_MEMORY_UNITS.items():
+        if value.endswith(unit) and value[: -len(unit)].isdigit():
+            return int(value[: -len(unit)]) * scale
+    return int(value)
+
+
+@lru_cache
+def parse_output_buffer_limits(value: str) -> dict[str, tuple[int, int, int]]:
+    limits = dict(REDIS_OUTPUT_BUFFER_LIMITS)
+    words = value.split()
+    for pos in range(0, len(words) - 3, 4):
+        name = "replica" if words[pos] == "slave" else words[pos]
+        limits[name] = (
+            parse_memory(words[pos + 1]),
+            parse_memory(words[pos + 2]),
+            int(words[pos + 3]),
+        )
+    return limits
+
+
+@lru_cache
+def parse_save_rules(value: str) -> list[tuple[int, int]]:
+    """(seconds, changes) pairs, a snapshot is due once any of them is met"""
+    words = value.split()
+    return [
+        (int(words[pos]), int(words[pos + 1])) for pos in range(0, len(words) - 1, 2)
+    ]
+
+
+def get_save_rules() -> list[tuple[int, int]]:
+    return parse_save_rules(REDIS_CONFIG.get("save", ""))
+
+
+def get_output_buffer_limit(client_class: str) -> tuple[int, int, int]:
+    """(hard bytes, soft bytes, soft seconds) for a client class, 0 is no limit"""
+    value = REDIS_CONFIG.get("client-output-buffer-limit", "")
+    return parse_output_buffer_limits(value)[client_class]
@@ -0,0 +1,200 @@
+import logging
+import os
+import socket
+from collections.abc import AsyncIterator
+from contextlib import suppress
+from time import monotonic
+
+from lib import curio
+
+from .buffer import RecvBuffer
+from .config import get_output_buffer_limit
+from .resp import encode_simple
+
+# encode errors already warned about, a replica retrying the sync repeats them
+REDIS_PAYLOAD_ERRORS: set[str] = set()
+
+
+class RedisConnection:
+    """Per-connection state and reply buffer shared by command handlers.
+
+    Without a socket, as when replaying the AOF, the output is dropped.
+    """
+
+    def __init__(
+        self,
+        sock: curio.io.Socket | None,
+        is_master: bool = False,
+        recv_buffer: RecvBuffer | None = None,
+    ) -> None:
+        self.sock = sock
+        self.is_master = is_master
+        self.recv_buffer = recv_buffer if recv_buffer is not None else RecvBuffer()
+        self.send_lock = curio.Lock()
+        self.replies: list[bytes] = []
+        self.master_replies: list[bytes] = []
+        self.propagate: list[bytes] | None = None
+        self.master_offset = 0
+        self.multi_state = False
+        self.multi_error = False
+        self.multi_commands: list[list[bytes]] = []
+        self.deny_blocking = False
+        self.sub_mode = False
+        self.subbed_channels: set[bytes] = set()
+        self.subbed_patterns: set[bytes] = set()
+        self.subbed_shard_channels: set[bytes] = set()
+        self.client_class = "normal"
+        # pushed messages the socket did not take yet, sent by write_pushes
+        self.push_buffer = bytearray()
+        self.push_event = curio.Event()
+        self.push_soft_since: float | None = None
+        # a payload produced while it is written, sent ahead of push_buffer
+        self.push_chunks: AsyncIterator[bytes] | None = None
+        self.closing = False
+        self.is_replica = False
+        self.replica_capa: set[bytes] = set()
+        self.quit = False
+
+    def reply(self, message: bytes) -> None:
+        self.replies.append(message)
+
+    def error(self, message: str) -> None:
+        self.replies.append(encode_simple(message, True))
+
+    def reply_master(self, message: bytes) -> None:
+        self.master_replies.append(message)
+
+    async def flush(self) -> None:
+        if self.sock is None:
+            self.replies.clear()
+            self.master_replies.clear()
+            return
+        # commands from the master are applied silently, only ACKs go back
+        if self.is_master:
+            self.replies.clear()
+            messages = self.master_replies
+        else:
+            messages = self.replies
+        if messages:
+            send_message = b"".join(messages)
+            messages.clear()
+            # pushes that queued up behind these replies go right after them
+            if self.push_buffer and self.push_chunks is None:
+                send_message += self.push_buffer
+                self.push_buffer.clear()
+            async with self.send_lock:
+                await self.sock.sendall(send_message)
+        # pushes held back for the replies are the writer's again
+        if self.push_buffer:
+            await self.push_event.set()
+
+    async def wait_closed(self) -> None:
+        if self.sock is None:
+            return
+        # read ahead while a command blocks, so a disconnect is noticed
+        while await self.recv_buffer.recv(self.sock) > 0:
+            pass
+
+    async def push(self, message: bytes) -> None:
+        """Write an out-of-band message, buffered when the socket is busy"""
+        if self.closing or self.sock is None:
+            return
+        if not (
+            self.push_buffer
+            or self.replies
+            or self.push_chunks is not None
+            or self.send_lock.locked()
+        ):
+            try:
+                sent = os.write(self.sock.fileno(), message)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self.closing = True
+                return
+            if sent == len(message):
+                return
+            message = message[sent:]
+
+        # with replies pending flush sends them first, then hands the buffer over
+        wake = not self.push_buffer and not self.replies
+        self.push_buffer += message
+        if self.check_output_limit():
+            if wake:
+                await self.push_event.set()
+        else:
+            await self.close_output()
+
+    def check_output_limit(self) -> bool:
+        """False once the pending output is past the hard or soft limit"""
+        hard, soft, soft_seconds = get_output_buffer_limit(self.client_class)
+        size = len(self.push_buffer)
+        if hard and size > hard:
+            return False
+        if not soft or size <= soft:
+            self.push_soft_since = None
+            return True
+        if self.push_soft_since is None:
+            self.push_soft_since = monotonic()
+        return monotonic() - self.push_soft_since <= soft_seconds
+
+    async def close_output(self) -> None:
+        logging.warning(
+            "Closing %s client, output buffer of %d bytes over the limit",
+            self.client_class,
+            len(self.push_buffer),
+        )
+        await self.shutdown()
+
+    async def shutdown(self) -> None:
+        self.closing = True
+        self.push_buffer.clear()
+        await self.push_event.set()
+        # the client loop sees the connection closed and cleans up
+        if self.sock is not None:
+            with suppress(OSError):
+                await self.sock.shutdown(socket.SHUT_RDWR)
+
+    def push_stream(self, chunks: AsyncIterator[bytes]) -> None:
+        """Have the writer send chunks ahead of every push"""
+        self.push_chunks = chunks
+
+    async def write_chunks(self) -> None:
+        if self.push_chunks is None or self.sock is None:
+            return
+        # pushes wait in push_buffer until the whole payload is out
+        try:
+            async with self.send_lock:
+                async for chunk in self.push_chunks:
+                    await self.sock.sendall(chunk)
+        except OSError:
+            self.closing = True
+        except TypeError as e:
+            # a value the payload cannot encode, sending half of it is useless
+            log = logging.info if str(e) in REDIS_PAYLOAD_ERRORS else logging.warning
+            log(
+                "Closing %s client, cannot encode its payload: %s", self.client_class, e
+            )
+            REDIS_PAYLOAD_ERRORS.add(str(e))
+            await self.shutdown()
+        finally:
+            self.push_chunks = None
+
+    async def write_pushes(self) -> None:
+        if self.sock is None:
+            return
+        await self.write_chunks()
+        while not self.closing:
+            await self.push_event.wait()
+            self.push_event.clear()
+            while self.push_buffer and not self.closing:
+                send_message = bytes(self.push_buffer)
+                self.push_buffer.clear()
+                try:
+                    async with self.send_lock:
+                        await self.sock.sendall(send_message)
+                except OSError:
+                    self.closing = True
+                    return
+                if self.push_soft_since is not None:
+                    self.check_output_limit()
@@ -1,49 +1,101 @@
-from .data import get_keys, get_type, load_db, read_db, save_db, write_db
-from .geo import get_geo_closest, get_geo_distance, get_geo_value, set_geo_value
+from .data import (
+    bgsave_db,
+    expire_keys,
+    get_expire,
+    get_keys,
+    get_type,
+    get_volatile_count,
+    is_wrong_type,
+    load_db,
+    replace_db,
+    save_db,
+    scan_keys,
+    set_expire_stale_perc,
+    snapshot_db,
+)
+from .geo import (
+    DISTANCE_UNITS,
+    get_geo_coords,
+    get_geo_distance,
+    get_geo_value,
+    search_geo,
+    set_geo_value,
+)
 from .list import (
     get_list_length,
     get_list_values,
-    pop_block_list_value,
+    move_list_value,
+    pop_first_list_value,
     pop_list_value,
     push_list_value,
+    serve_list_waiters,
+    wait_list_value,
+)
+from .stream import (
+    get_stream_length,
+    get_stream_range,
+    get_stream_values,
+    serve_stream_waiters,
+    set_stream_value,
+    trim_stream,
 )
-from .stream import get_stream_range, get_stream_values, set_stream_value
 from .value import get_value, increase_value, set_value
 from .zset import (
     get_zset_length,
     get_zset_range,
+    get_zset_range_by_lex,
+    get_zset_range_by_score,
     get_zset_rank,
     get_zset_score,
     remove_zset_member,
+    scan_zset,
     set_zset_value,
 )
 
 __all__ = [
-    "get_geo_closest",
+    "DISTANCE_UNITS",
+    "bgsave_db",
+    "expire_keys",
+    "get_expire",
+    "get_geo_coords",
     "get_geo_distance",
     "get_geo_value",
     "get_keys",
     "get_list_length",
     "get_list_values",
+    "get_stream_length",
     "get_stream_range",
     "get_stream_values",
     "get_type",
     "get_value",
+    "get_volatile_count",
     "get_zset_length",
     "get_zset_range",
+    "get_zset_range_by_lex",
+    "get_zset_range_by_score",
     "get_zset_rank",
     "get_zset_score",
     "increase_value",
+    "is_wrong_type",
     "load_db",
-    "pop_block_list_value",
+    "move_list_value",
+    "pop_first_list_value",
     "pop_list_value",
     "push_list_value",
-    "read_db",
     "remove_zset_member",
+    "replace_db",
     "save_db",
+    "scan_keys",
+    "scan_zset",
+    "search_geo",
+    "serve_list_waiters",
+    "serve_stream_waiters",
+    "set_expire_stale_perc",
     "set_geo_value",
     "set_stream_value",
     "set_value",
     "set_zset_value",
-    "write_db",
+    "snapshot_db",
+    "trim_stream",
+    "wait_list_value",
 ]
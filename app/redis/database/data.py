@@ -1,17 +1,42 @@
+import heapq
 import logging
+import os
+import weakref
 from pathlib import Path
 from time import time_ns
+from typing import Any
 
-from app.redis.rdb import read_rdb, write_rdb
+from app.redis.info import register_info
+from app.redis.pattern import compile_pattern
+from app.redis.rdb import iter_rdb, read_rdb
 from app.redis.rdb.file.constants import DBType
+from lib import curio
+
+from .scan import ScanIndex
+from .skiplist import SortedSet
+from .streamnode import Stream
 
 REDIS_DB_NUM = 0
-REDIS_DB_VAL: dict[int, dict[str, dict[str, str | dict[str, str]]]] = {REDIS_DB_NUM: {}}
-REDIS_DB_EXP: dict[int, dict[str, int]] = {REDIS_DB_NUM: {}}
+REDIS_DB_VAL: dict[int, dict[bytes, dict[str, Any]]] = {REDIS_DB_NUM: {}}
+REDIS_DB_EXP: dict[int, dict[bytes, int]] = {REDIS_DB_NUM: {}}
+REDIS_DB_EXP_HEAP: dict[int, list[tuple[int, bytes]]] = {REDIS_DB_NUM: []}
+REDIS_DB_SCAN: dict[int, ScanIndex] = {REDIS_DB_NUM: ScanIndex()}
 REDIS_META: dict[str, str | int] = {}
+REDIS_EXPIRED_KEYS = 0
+REDIS_EXPIRED_STALE_PERC = 0.0
+
+
+class Snapshot(dict[bytes, dict[str, Any]]):
+    """Key map of a database as it was, entries are shared until written"""
+
 
+# snapshots still being encoded by id, dropped with their last reference
+REDIS_SNAPSHOTS: "weakref.WeakValueDictionary[int, Snapshot]" = (
+    weakref.WeakValueDictionary()
+)
 
-def check_key(key: str) -> bool:
+
+def check_key(key: bytes) -> bool:
     return key in REDIS_DB_VAL[REDIS_DB_NUM]
 
 
@@ -20,7 +45,7 @@ def get_current_time() -> int:
     return int(time_ns() / 1e6)
 
 
-def get_data(key: str) -> tuple[dict[str, str | dict[str, str]], int | None]:
+def get_data(key: bytes) -> tuple[dict[str, Any], int | None]:
     if key not in REDIS_DB_VAL[REDIS_DB_NUM]:
         return {}, None
 
@@ -31,25 +56,100 @@ def get_data(key: str) -> tuple[dict[str, str | dict[str, str]], int | None]:
 
     if exp is not None and get_time > exp:
         logging.info("get_data key '%s' expired exp %s time %d", key, exp, get_time)
-        del REDIS_DB_VAL[REDIS_DB_NUM][key]
-        del REDIS_DB_EXP[REDIS_DB_NUM][key]
+        expire_data(key)
         return {}, None
 
     return data, exp
 
 
-def get_keys(pattern: str) -> list[str]:
-    keys = list(REDIS_DB_VAL[REDIS_DB_NUM].keys())
-    # TODO filter keys using pattern
-    return keys
+def delete_data(key: bytes) -> None:
+    logging.debug("delete_data key '%s' time %d", key, get_current_time())
+    del REDIS_DB_VAL[REDIS_DB_NUM][key]
+    REDIS_DB_EXP[REDIS_DB_NUM].pop(key, None)
+    REDIS_DB_SCAN[REDIS_DB_NUM].remove(key)
+
+
+def expire_data(key: bytes) -> None:
+    global REDIS_EXPIRED_KEYS
+    del REDIS_DB_VAL[REDIS_DB_NUM][key]
+    del REDIS_DB_EXP[REDIS_DB_NUM][key]
+    REDIS_DB_SCAN[REDIS_DB_NUM].remove(key)
+    REDIS_EXPIRED_KEYS += 1
+
+
+def expire_keys(max_keys: int) -> tuple[int, bool]:
+    """Pop up to max_keys due entries, returns (expired, more pending)"""
+    heap = REDIS_DB_EXP_HEAP[REDIS_DB_NUM]
+    exps = REDIS_DB_EXP[REDIS_DB_NUM]
+    get_time = get_current_time()
+    expired = 0
+    # entries are never removed on overwrite, so skip those whose key was
+    # deleted or got a new deadline since they were pushed, they count
+    # against max_keys too so a pile of them cannot stall the loop
+    for _ in range(max_keys):
+        if not heap or heap[0][0] >= get_time:
+            break
+        exp, key = heapq.heappop(heap)
+        if exps.get(key) == exp:
+            logging.info(
+                "expire_keys key '%s' expired exp %s time %d", key, exp, get_time
+            )
+            expire_data(key)
+            expired += 1
+    else:
+        return expired, bool(heap) and heap[0][0] < get_time
+
+    compact_expire_index()
+    return expired, False
+
+
+def compact_expire_index() -> None:
+    """Rebuild the heap once stale entries outnumber the live ones"""
+    if (
+        len(REDIS_DB_EXP_HEAP[REDIS_DB_NUM])
+        > 2 * len(REDIS_DB_EXP[REDIS_DB_NUM]) + 1024
+    ):
+        rebuild_expire_index()
+
 
+def get_expire_stats() -> dict[str, str | int]:
+    return {
+        "expired_keys": REDIS_EXPIRED_KEYS,
+        "expired_stale_perc": f"{REDIS_EXPIRED_STALE_PERC * 100:.2f}",
+    }
 
-def get_type(key: str) -> DBType:
+
+def get_keys(pattern: bytes) -> list[bytes]:
+    match = compile_pattern(pattern)
+    exps = REDIS_DB_EXP[REDIS_DB_NUM]
+    get_time = get_current_time()
+    return [
+        key
+        for key in REDIS_DB_VAL[REDIS_DB_NUM]
+        if match(key) and not (key in exps and get_time > exps[key])
+    ]
+
+
+def get_expire(key: bytes) -> int | None:
+    return REDIS_DB_EXP[REDIS_DB_NUM].get(key)
+
+
+def get_type(key: bytes) -> DBType:
     if key not in REDIS_DB_VAL[REDIS_DB_NUM]:
         return DBType.NONE
     return DBType(REDIS_DB_VAL[REDIS_DB_NUM][key]["type"])
 
 
+def is_wrong_type(key: bytes, dtype: DBType) -> bool:
+    """Whether a live key holds another type than dtype"""
+    data, _ = get_data(key)
+    return bool(data) and data["type"] != dtype
+
+
+def get_volatile_count() -> int:
+    return len(REDIS_DB_EXP[REDIS_DB_NUM])
+
+
 def load_db(dirname: str, dbfilename: str) -> None:
     db_fn = Path(dirname) / dbfilename
     if db_fn.is_file():
@@ -57,24 +157,114 @@ def load_db(dirname: str, dbfilename: str) -> None:
 
 
 def read_db(data: bytes) -> None:
+    replace_db(*read_rdb(data))
+
+
+def replace_db(
+    meta: dict[str, str | int],
+    data: dict[int, dict[bytes, dict[str, Any]]],
+    dexp: dict[int, dict[bytes, int]],
+) -> None:
     global REDIS_META, REDIS_DB_VAL, REDIS_DB_EXP
-    REDIS_META, REDIS_DB_VAL, REDIS_DB_EXP = read_rdb(data)
-    if not REDIS_DB_VAL:
+    for db in data.values():
+        for key, entry in db.items():
+            db[key] = load_value(entry)
+    REDIS_META, REDIS_DB_VAL, REDIS_DB_EXP = meta, data, dexp
+    if REDIS_DB_NUM not in REDIS_DB_VAL:
         REDIS_DB_VAL[REDIS_DB_NUM] = {}
         REDIS_DB_EXP[REDIS_DB_NUM] = {}
+    rebuild_expire_index()
+    REDIS_DB_SCAN[REDIS_DB_NUM] = ScanIndex(REDIS_DB_VAL[REDIS_DB_NUM])
     logging.warning("updated db meta %s", repr(REDIS_META))
-    logging.warning("updated db data %s", repr(REDIS_DB_VAL))
-    logging.warning("updated db exp %s", repr(REDIS_DB_EXP))
+    logging.warning(
+        "updated db with %d keys, %d volatile",
+        len(REDIS_DB_VAL[REDIS_DB_NUM]),
+        len(REDIS_DB_EXP[REDIS_DB_NUM]),
+    )
+
+
+def load_value(entry: dict[str, Any]) -> dict[str, Any]:
+    """Build the database types from the plain values an RDB loads as"""
+    value = entry["value"]
+    match entry["type"]:
+        case DBType.ZSET if isinstance(value, dict):
+            zset = SortedSet()
+            zset.update(value)
+            return {"value": zset, "type": entry["type"]}
+        case DBType.STREAM if isinstance(value, tuple):
+            last_id, entries = value
+            stream = Stream()
+            for sid, fields in entries:
+                stream.append(sid, fields)
+            stream.last_id = last_id
+            return {"value": stream, "type": entry["type"]}
+    return entry
+
+
+def rebuild_expire_index() -> None:
+    heap = [(exp, key) for key, exp in REDIS_DB_EXP[REDIS_DB_NUM].items()]
+    heapq.heapify(heap)
+    REDIS_DB_EXP_HEAP[REDIS_DB_NUM] = heap
 
 
 def save_db(dirname: str, dbfilename: str) -> None:
-    db_fn = Path(dirname) / dbfilename
-    db_fn.write_bytes(write_db())
+    """Write the RDB next to the old one and rename it over, never half a file"""
+    db_tmp = Path(dirname) / f"temp-{os.getpid()}.rdb"
+    try:
+        with db_tmp.open("wb") as f:
+            for chunk in iter_rdb(REDIS_META, REDIS_DB_VAL, REDIS_DB_EXP):
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        db_tmp.replace(Path(dirname) / dbfilename)
+    finally:
+        db_tmp.unlink(missing_ok=True)
+
+
+async def bgsave_db(dirname: str, dbfilename: str) -> None:
+    """save_db of the keyspace as it is now, clients are served between chunks"""
+    chunks = iter_rdb(*snapshot_db())
+    db_tmp = Path(dirname) / f"temp-bgsave-{os.getpid()}.rdb"
+    try:
+        with db_tmp.open("wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                await curio.sleep(0)
+            f.flush()
+            await curio.run_in_thread(os.fsync, f.fileno())
+        db_tmp.replace(Path(dirname) / dbfilename)
+    finally:
+        db_tmp.unlink(missing_ok=True)
+
+
+def scan_keys(
+    cursor: int,
+    count: int,
+    pattern: bytes | None = None,
+    dtype: DBType | None = None,
+) -> tuple[int, list[bytes]]:
+    """Visit about count keys from cursor, returns (next cursor, keys)"""
+    db = REDIS_DB_VAL[REDIS_DB_NUM]
+    exps = REDIS_DB_EXP[REDIS_DB_NUM]
+    match = compile_pattern(pattern) if pattern is not None else None
+    get_time = get_current_time()
+
+    next_cursor, visited = REDIS_DB_SCAN[REDIS_DB_NUM].scan(cursor, count)
+    keys = []
+    for key in visited:
+        if key in exps and get_time > exps[key]:
+            continue
+        if match is not None and not match(key):
+            continue
+        if dtype is not None and db[key]["type"] != dtype:
+            continue
+        keys.append(key)
+    return next_cursor, keys
 
 
 def set_data(
-    key: str,
-    value: str | dict[str, str],
+    key: bytes,
+    value: Any,
     exp: int | None = None,
     dtype: DBType = DBType.STR,
 ) -> None:
@@ -85,31 +275,64 @@ def set_data(
         exp,
         get_current_time(),
     )
+    if key not in REDIS_DB_VAL[REDIS_DB_NUM]:
+        REDIS_DB_SCAN[REDIS_DB_NUM].add(key)
     REDIS_DB_VAL[REDIS_DB_NUM][key] = {"value": value, "type": dtype}
     if exp is not None:
         REDIS_DB_EXP[REDIS_DB_NUM][key] = exp
+        heapq.heappush(REDIS_DB_EXP_HEAP[REDIS_DB_NUM], (exp, key))
+        compact_expire_index()
 
 
-def set_stream_data(
-    key: str, millisecondsTime: int, sequenceNumber: int, values: dict[str, str]
-) -> None:
-    logging.debug(
-        "set_stream_data key '%s' millisecondsTime %d sequenceNumber %d values %s time %d",
-        key,
-        millisecondsTime,
-        sequenceNumber,
-        values,
-        get_current_time(),
+def set_expire_stale_perc(perc: float) -> None:
+    global REDIS_EXPIRED_STALE_PERC
+    REDIS_EXPIRED_STALE_PERC = perc * 0.05 + REDIS_EXPIRED_STALE_PERC * 0.95
+
+
+def snapshot_db() -> tuple[
+    dict[str, str | int],
+    dict[int, dict[bytes, dict[str, Any]]],
+    dict[int, dict[bytes, int]],
+]:
+    """Copy of the keyspace, to encode later while the server keeps running
+
+    Only the key maps are copied, the values are shared with the live ones
+    until copy_on_write copies one before it is changed in place.
+    """
+    data: dict[int, dict[bytes, dict[str, Any]]] = {}
+    for num, db in REDIS_DB_VAL.items():
+        data[num] = snapshot = Snapshot(db)
+        REDIS_SNAPSHOTS[id(snapshot)] = snapshot
+    return (
+        dict(REDIS_META),
+        data,
+        {num: dict(db) for num, db in REDIS_DB_EXP.items()},
     )
-    if key not in REDIS_DB_VAL[REDIS_DB_NUM]:
-        set_data(key, {millisecondsTime: {sequenceNumber: values}}, dtype=DBType.STREAM)
-        return
 
-    if millisecondsTime not in REDIS_DB_VAL[REDIS_DB_NUM][key]["value"]:
-        REDIS_DB_VAL[REDIS_DB_NUM][key]["value"][millisecondsTime] = {}
 
-    REDIS_DB_VAL[REDIS_DB_NUM][key]["value"][millisecondsTime][sequenceNumber] = values
+def snapshot_value(entry: dict[str, Any]) -> dict[str, Any]:
+    """Copy of a value changed in place, sorted sets as member to score dict
+
+    Strings are immutable and replaced on write, so they are shared.
+    """
+    match entry["type"]:
+        case DBType.LIST | DBType.STREAM:
+            return {"value": entry["value"].copy(), "type": entry["type"]}
+        case DBType.ZSET:
+            return {"value": dict(entry["value"].items()), "type": entry["type"]}
+    return entry
+
+
+def copy_on_write(key: bytes) -> None:
+    """Give snapshots sharing the value of key their own copy, before a change"""
+    entry = REDIS_DB_VAL[REDIS_DB_NUM].get(key)
+    if entry is None or entry["type"] == DBType.STR:
+        return
+    copy = None
+    for snapshot in REDIS_SNAPSHOTS.values():
+        if snapshot.get(key) is entry:
+            copy = copy or snapshot_value(entry)
+            snapshot[key] = copy
 
 
-def write_db() -> bytes:
-    return write_rdb(REDIS_META, REDIS_DB_VAL, REDIS_DB_EXP)
+register_info("stats", get_expire_stats)
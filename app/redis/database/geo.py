@@ -1,8 +1,23 @@
 import logging
-from math import asin, cos, radians, sin, sqrt
+from collections.abc import Sequence
+from math import asin, cos, degrees, radians, sin, sqrt
+from typing import TYPE_CHECKING, Any, TypeVar
 
-from .data import check_key
-from .zset import get_zset_range, get_zset_score, set_zset_value
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore[assignment]
+
+from .data import check_key, get_data
+from .zset import get_zset_score, set_zset_value
+
+if TYPE_CHECKING:
+    import numpy.typing as npt
+
+    from .skiplist import Score
+
+# one geohash, or an array of them on the NumPy path
+Bits = TypeVar("Bits", int, "npt.NDArray[Any]")
 
 EARTH_RADIUS = 6372797.560856
 
@@ -14,6 +29,11 @@ MAX_LONGITUDE = 180
 LATITUDE_RANGE = MAX_LATITUDE - MIN_LATITUDE
 LONGITUDE_RANGE = MAX_LONGITUDE - MIN_LONGITUDE
 
+GEO_STEP_MAX = 26
+
+# below this many points the NumPy call overhead outweighs the loop
+GEO_BATCH_NUMPY_MIN = 64
+
 DISTANCE_UNITS = {
     "m": 1.0,
     "km": 1000.0,
@@ -22,7 +42,7 @@ DISTANCE_UNITS = {
 }
 
 
-def spread_int32_to_int64(v: int) -> int:
+def spread_int32_to_int64(v: Bits) -> Bits:  # noqa: UP047
     v = v & 0xFFFFFFFF
     v = (v | (v << 16)) & 0x0000FFFF0000FFFF
     v = (v | (v << 8)) & 0x00FF00FF00FF00FF
@@ -32,7 +52,7 @@ def spread_int32_to_int64(v: int) -> int:
     return v  # noqa: RET504
 
 
-def compact_int64_to_int32(v: int) -> int:
+def compact_int64_to_int32(v: Bits) -> Bits:  # noqa: UP047
     v = v & 0x5555555555555555
     v = (v | (v >> 1)) & 0x3333333333333333
     v = (v | (v >> 2)) & 0x0F0F0F0F0F0F0F0F
@@ -50,7 +70,7 @@ def encode_geo(longitude: float, latitude: float) -> int:
     return (inter_longitude << 1) | inter_latitude
 
 
-def decode_geo(score: int) -> tuple[float]:
+def decode_geo(score: int) -> tuple[float, float]:
     normalized_longitude = compact_int64_to_int32(score >> 1) + 0.5
     normalized_latitude = compact_int64_to_int32(score) + 0.5
     longitude = (normalized_longitude / 2**26) * LONGITUDE_RANGE + MIN_LONGITUDE
@@ -68,14 +88,96 @@ def haversine(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
     return 2 * EARTH_RADIUS * asin(sqrt(a))
 
 
-def set_geo_value(key: str, values: dict[str, tuple[float]]) -> int:
-    logging.info("GEOADD key '%s' values %s", key, values)
-    scores = {place: encode_geo(*coords) for place, coords in values.items()}
-    set_zset_value(key, scores)
-    return len(scores)
+def encode_geo_batch(
+    longitudes: Sequence[float], latitudes: Sequence[float]
+) -> list[int]:
+    if np is None or len(longitudes) < GEO_BATCH_NUMPY_MIN:
+        return [
+            encode_geo(lon, lat) for lon, lat in zip(longitudes, latitudes, strict=True)
+        ]
+
+    # same operation order as encode_geo so the cells match bit for bit
+    lons = np.asarray(longitudes, dtype=np.float64)
+    lats = np.asarray(latitudes, dtype=np.float64)
+    normalized_longitude = (2**26 * (lons - MIN_LONGITUDE) / LONGITUDE_RANGE).astype(
+        np.uint64
+    )
+    normalized_latitude = (2**26 * (lats - MIN_LATITUDE) / LATITUDE_RANGE).astype(
+        np.uint64
+    )
+    inter_longitude = spread_int32_to_int64(normalized_longitude)
+    inter_latitude = spread_int32_to_int64(normalized_latitude)
+    scores: list[int] = ((inter_longitude << 1) | inter_latitude).tolist()
+    return scores
+
 
+def decode_geo_batch(scores: Sequence[int]) -> tuple[list[float], list[float]]:
+    if np is None or len(scores) < GEO_BATCH_NUMPY_MIN:
+        coords = [decode_geo(score) for score in scores]
+        return [lon for lon, _ in coords], [lat for _, lat in coords]
+
+    values = np.asarray(scores, dtype=np.uint64)
+    normalized_longitude = compact_int64_to_int32(values >> 1) + 0.5
+    normalized_latitude = compact_int64_to_int32(values) + 0.5
+    longitudes = (normalized_longitude / 2**26) * LONGITUDE_RANGE + MIN_LONGITUDE
+    latitudes = (normalized_latitude / 2**26) * LATITUDE_RANGE + MIN_LATITUDE
+    lons: list[float] = longitudes.tolist()
+    lats: list[float] = latitudes.tolist()
+    return lons, lats
+
+
+def haversine_batch(
+    longitude: float,
+    latitude: float,
+    longitudes: Sequence[float],
+    latitudes: Sequence[float],
+) -> list[float]:
+    """Distances from one point to each of the given points"""
+    if np is None or len(longitudes) < GEO_BATCH_NUMPY_MIN:
+        cos_lat = cos(radians(latitude))
+        return [
+            2
+            * EARTH_RADIUS
+            * asin(
+                sqrt(
+                    sin(radians(lat - latitude) / 2) ** 2
+                    + cos_lat
+                    * cos(radians(lat))
+                    * sin(radians(lon - longitude) / 2) ** 2
+                )
+            )
+            for lon, lat in zip(longitudes, latitudes, strict=True)
+        ]
+
+    lons = np.asarray(longitudes, dtype=np.float64)
+    lats = np.asarray(latitudes, dtype=np.float64)
+    a = (
+        np.sin(np.radians(lats - latitude) / 2) ** 2
+        + cos(radians(latitude))
+        * np.cos(np.radians(lats))
+        * np.sin(np.radians(lons - longitude) / 2) ** 2
+    )
+    distances: list[float] = (2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))).tolist()
+    return distances
+
+
+def set_geo_value(
+    key: bytes,
+    values: dict[bytes, tuple[float, float]],
+    nx: bool = False,
+    xx: bool = False,
+    ch: bool = False,
+) -> int:
+    logging.info("GEOADD key '%s' values %d", key, len(values))
+    longitudes = [lon for lon, _ in values.values()]
+    latitudes = [lat for _, lat in values.values()]
+    scores: dict[bytes, Score] = dict(
+        zip(values, encode_geo_batch(longitudes, latitudes), strict=True)
+    )
+    return set_zset_value(key, scores, nx, xx, ch)
 
-def get_geo_value(key: str, places: list[str]) -> list[tuple[str]]:
+
+def get_geo_value(key: bytes, places: list[bytes]) -> list[list[str]]:
     logging.info("GEOPOS key '%s' places %s", key, places)
     if not check_key(key):
         return [[] for _ in places]
@@ -87,7 +189,7 @@ def get_geo_value(key: str, places: list[str]) -> list[tuple[str]]:
     ]
 
 
-def get_geo_distance(key: str, place1: str, place2: str) -> str:
+def get_geo_distance(key: bytes, place1: bytes, place2: bytes) -> str:
     logging.info("GEODIST key '%s' place1 %s place2 %s", key, place1, place2)
     if not check_key(key):
         return ""
@@ -105,36 +207,149 @@ def get_geo_distance(key: str, place1: str, place2: str) -> str:
     )
 
 
-def get_geo_closest(
-    key: str,
+def get_geo_coords(key: bytes, place: bytes) -> tuple[float, float] | None:
+    data, _ = get_data(key)
+    if not data:
+        return None
+
+    score = data["value"].score(place)
+    return decode_geo(int(score)) if score is not None else None
+
+
+def get_geo_bounding_box(
+    longitude: float, latitude: float, width: float, height: float
+) -> tuple[float, float, float, float]:
+    """(min lon, min lat, max lon, max lat) around a width x height area in m"""
+    lat_delta = degrees(height / 2 / EARTH_RADIUS)
+    lon_delta_top = degrees(
+        width / 2 / EARTH_RADIUS / cos(radians(latitude + lat_delta))
+    )
+    lon_delta_bottom = degrees(
+        width / 2 / EARTH_RADIUS / cos(radians(latitude - lat_delta))
+    )
+    lon_delta = lon_delta_bottom if latitude < 0 else lon_delta_top
+    return (
+        longitude - lon_delta,
+        latitude - lat_delta,
+        longitude + lon_delta,
+        latitude + lat_delta,
+    )
+
+
+def get_geo_step(latitude: float, width: float, height: float) -> int:
+    """Finest geohash step whose cells are at least half the area wide and high"""
+    # cells are narrowest on the edge of the area closest to a pole
+    lat_edge = min(abs(latitude) + degrees(height / 2 / EARTH_RADIUS), MAX_LATITUDE)
+    lat_scale = radians(LATITUDE_RANGE) * EARTH_RADIUS
+    lon_scale = radians(LONGITUDE_RANGE) * EARTH_RADIUS * cos(radians(lat_edge))
+    step = GEO_STEP_MAX
+    while step > 1 and (
+        lat_scale / 2**step < height / 2 or lon_scale / 2**step < width / 2
+    ):
+        step -= 1
+    return step
+
+
+def get_geo_ranges(
+    longitude: float, latitude: float, width: float, height: float
+) -> list[tuple[int, int]]:
+    """Score ranges of the 3x3 geohash cells covering the area around the center"""
+    step = get_geo_step(latitude, width, height)
+    min_lon, min_lat, max_lon, max_lat = get_geo_bounding_box(
+        longitude, latitude, width, height
+    )
+    center = encode_geo(longitude, latitude) >> (2 * (GEO_STEP_MAX - step))
+    center_lon = compact_int64_to_int32(center >> 1)
+    center_lat = compact_int64_to_int32(center)
+    cells = 2**step
+
+    ranges = set()
+    for lon_offset in (-1, 0, 1):
+        for lat_offset in (-1, 0, 1):
+            lon_idx = (center_lon + lon_offset) % cells
+            lat_idx = center_lat + lat_offset
+            if not 0 <= lat_idx < cells:
+                continue
+
+            # skip neighbours entirely outside of the bounding box
+            cell_min_lat = MIN_LATITUDE + lat_idx * LATITUDE_RANGE / cells
+            cell_max_lat = cell_min_lat + LATITUDE_RANGE / cells
+            if cell_max_lat < min_lat or cell_min_lat > max_lat:
+                continue
+            if lon_offset != 0 and step > 1:
+                cell_min_lon = MIN_LONGITUDE + lon_idx * LONGITUDE_RANGE / cells
+                cell_max_lon = cell_min_lon + LONGITUDE_RANGE / cells
+                if (
+                    min_lon >= MIN_LONGITUDE
+                    and max_lon <= MAX_LONGITUDE
+                    and (cell_max_lon < min_lon or cell_min_lon > max_lon)
+                ):
+                    continue
+
+            cell = (spread_int32_to_int64(lon_idx) << 1) | spread_int32_to_int64(
+                lat_idx
+            )
+            shift = 2 * (GEO_STEP_MAX - step)
+            ranges.add((cell << shift, (cell + 1) << shift))
+    return sorted(ranges)
+
+
+def search_geo(
+    key: bytes,
     longitude: float,
     latitude: float,
-    radius: float,
-    unit: str,
-) -> list[str]:
+    radius: float | None = None,
+    box: tuple[float, float] | None = None,
+    count: int | None = None,
+    count_any: bool = False,
+    order: str | None = None,
+) -> list[tuple[bytes, float, int, tuple[float, float]]]:
+    """Members within radius or a width x height box in m, with distance, score and coords"""
     logging.info(
-        "GEOSEARCH key '%s' longitude %s latitude %s radius %s unit '%s'",
+        "GEOSEARCH key '%s' longitude %s latitude %s radius %s box %s",
         key,
         longitude,
         latitude,
         radius,
-        unit,
+        box,
     )
-    if not check_key(key):
+    data, _ = get_data(key)
+    if not data:
         return []
 
-    places = get_zset_range(key, 0, -1)
-    scores = {place: int(float(get_zset_score(key, place))) for place in places}
-    distances = {
-        place: haversine(
-            longitude,
-            latitude,
-            *decode_geo(scores[place]),
-        )
-        for place in places
-    }
+    if box is not None:
+        width, height = box
+    elif radius is not None:
+        width = height = 2 * radius
+    else:
+        raise ValueError("search_geo needs a radius or a box")
+    zset = data["value"]
+    found = []
+    for min_score, max_score in get_geo_ranges(longitude, latitude, width, height):
+        candidates = list(zset.range_by_score(min_score, max_score, max_ex=True))
+        scores = [int(score) for _, score in candidates]
+        place_lons, place_lats = decode_geo_batch(scores)
+        distances = haversine_batch(longitude, latitude, place_lons, place_lats)
+        for (place, _), score, place_lon, place_lat, distance in zip(
+            candidates, scores, place_lons, place_lats, distances, strict=True
+        ):
+            if box is not None:
+                lat_distance = EARTH_RADIUS * abs(radians(place_lat - latitude))
+                if lat_distance > height / 2:
+                    continue
+                if haversine(place_lon, place_lat, longitude, place_lat) > width / 2:
+                    continue
+            elif radius is not None and distance > radius:
+                continue
 
-    distance_limit = radius * DISTANCE_UNITS[unit.lower()]
-    return [
-        place for place, distance in distances.items() if distance <= distance_limit
-    ]
+            found.append((place, distance, score, (place_lon, place_lat)))
+            if count_any and count is not None and len(found) >= count:
+                break
+        if count_any and count is not None and len(found) >= count:
+            break
+
+    if order is None and count is not None and not count_any:
+        order = "ASC"
+    if order is not None:
+        found.sort(key=lambda x: x[1], reverse=order == "DESC")
+    return found[:count] if count is not None else found
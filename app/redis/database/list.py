@@ -1,71 +1,207 @@
 import logging
+from collections import deque
+from itertools import islice
 
 from app.redis.rdb.file.constants import DBType
 from lib import curio
 
-from .data import check_key, get_data, set_data
+from .data import copy_on_write, delete_data, get_data, is_wrong_type, set_data
 
 
-def get_list_length(key: str) -> int:
-    logging.info("LLEN key '%s'", key)
-    if not check_key(key):
-        return 0
+class ListWaiter:
+    """Client blocked on one or more lists, served in FIFO order per key"""
 
-    vlist, _ = get_data(key)
-    return len(vlist["value"])
+    def __init__(
+        self,
+        keys: list[bytes],
+        left: bool = True,
+        destination: bytes | None = None,
+        to_left: bool = True,
+    ) -> None:
+        self.keys = keys
+        self.left = left
+        self.destination = destination
+        self.to_left = to_left
+        self.event = curio.Event()
+        self.value: list[bytes] | None = None
+        # woken without a value, the destination no longer holds a list
+        self.wrong_type = False
 
 
-def get_list_values(key: str, start: int, end: int) -> list[str]:
-    logging.info("LRANGE key '%s' start %d end %d", key, start, end)
-    if not check_key(key):
-        return []
+REDIS_LIST_WAITERS: dict[bytes, deque[ListWaiter]] = {}
+REDIS_LIST_READY: dict[bytes, None] = {}
 
+
+def get_list_length(key: bytes) -> int:
+    logging.info("LLEN key '%s'", key)
     vlist, _ = get_data(key)
-    return vlist["value"][start : end + 1 if end != -1 else None]
+    if not vlist:
+        return 0
 
+    return len(vlist["value"])
 
-async def pop_block_list_value(key: str, block_time: float) -> list[str]:
-    logging.info("BLPOP key '%s' block_time %s", key, block_time)
 
+def get_list_values(key: bytes, start: int, end: int) -> list[bytes]:
+    logging.info("LRANGE key '%s' start %d end %d", key, start, end)
     vlist, _ = get_data(key)
-    while not vlist or len(vlist["value"]) == 0:
-        await curio.sleep(block_time)
-        vlist, _ = get_data(key)
-        if block_time > 0:
-            break
-
-    if not vlist or len(vlist["value"]) == 0:
+    if not vlist:
         return []
 
-    set_data(key, vlist["value"][1:])
-    return [key, vlist["value"][0]]
+    len_vlist = len(vlist["value"])
+    if start < 0:
+        start = max(start + len_vlist, 0)
+    if end < 0:
+        end += len_vlist
+    if start > end or start >= len_vlist:
+        return []
 
+    return list(islice(vlist["value"], start, end + 1))
 
-def pop_list_value(key: str, count: int = 1) -> str:
-    logging.info("LPOP key '%s' count %d", key, count)
-    if not check_key(key):
-        return ""
 
+def pop_list_element(key: bytes, left: bool = True) -> bytes | None:
     vlist, _ = get_data(key)
-    if not vlist["value"]:
+    # a key replaced by another type, as in MULTI RPUSH then SET, has nothing
+    if not vlist or vlist["type"] != DBType.LIST:
+        return None
+
+    copy_on_write(key)
+    values = vlist["value"]
+    value = values.popleft() if left else values.pop()
+    if not values:
+        delete_data(key)
+    return value
+
+
+def pop_first_list_value(keys: list[bytes], left: bool = True) -> list[bytes] | None:
+    logging.info("BPOP keys %s left %s", keys, left)
+    for key in keys:
+        value = pop_list_element(key, left)
+        if value is not None:
+            return [key, value]
+    return None
+
+
+def pop_list_value(
+    key: bytes, count: int | None = None, left: bool = True
+) -> bytes | list[bytes] | str:
+    """One element, or a list of up to count with count, "" when missing"""
+    logging.info("POP key '%s' count %s left %s", key, count, left)
+    vlist, _ = get_data(key)
+    if not vlist:
         return ""
 
-    res = vlist["value"][:count]
-    set_data(key, vlist["value"][count:])
-    return res if len(res) > 1 else res[0]
-
+    copy_on_write(key)
+    values = vlist["value"]
+    pop = values.popleft if left else values.pop
+    res: bytes | list[bytes] = (
+        pop() if count is None else [pop() for _ in range(min(count, len(values)))]
+    )
+    if not values:
+        delete_data(key)
+    return res
 
-def push_list_value(key: str, values: list[str], left: bool = False) -> int:
-    logging.info("RPUSH key '%s' values %s", key, values)
-    if not check_key(key):
-        set_data(key, values, dtype=DBType.LIST)
-        return len(values)
 
+def push_list_value(key: bytes, values: list[bytes], left: bool = False) -> int:
+    logging.info("PUSH key '%s' values %s left %s", key, values, left)
     vlist, _ = get_data(key)
+    if not vlist:
+        vlist = {"value": deque()}
+        set_data(key, vlist["value"], dtype=DBType.LIST)
+
+    copy_on_write(key)
     if left:
-        vlist["value"] = values[::-1] + vlist["value"]
+        vlist["value"].extendleft(values)
     else:
         vlist["value"].extend(values)
 
-    set_data(key, vlist["value"])
+    if key in REDIS_LIST_WAITERS:
+        REDIS_LIST_READY[key] = None
     return len(vlist["value"])
+
+
+def move_list_value(
+    source: bytes, destination: bytes, left: bool = True, to_left: bool = True
+) -> bytes | str:
+    logging.info("LMOVE source '%s' destination '%s'", source, destination)
+    value = pop_list_element(source, left)
+    if value is None:
+        return ""
+
+    push_list_value(destination, [value], left=to_left)
+    return value
+
+
+def remove_list_waiter(waiter: ListWaiter) -> None:
+    for key in waiter.keys:
+        waiters = REDIS_LIST_WAITERS.get(key)
+        if waiters is None or waiter not in waiters:
+            continue
+        waiters.remove(waiter)
+        if not waiters:
+            del REDIS_LIST_WAITERS[key]
+
+
+async def wait_list_value(
+    keys: list[bytes],
+    block_time: float,
+    left: bool = True,
+    destination: bytes | None = None,
+    to_left: bool = True,
+) -> list[bytes] | None:
+    """Block until a push serves this client, returns [key, value] or None on timeout
+
+    Raises TypeError when the destination stopped holding a list meanwhile.
+    """
+    logging.info("BPOP keys %s block_time %s", keys, block_time)
+    waiter = ListWaiter(keys, left, destination, to_left)
+    for key in keys:
+        REDIS_LIST_WAITERS.setdefault(key, deque()).append(waiter)
+
+    try:
+        if block_time > 0:
+            await curio.timeout_after(block_time, waiter.event.wait())
+        else:
+            await waiter.event.wait()
+    except curio.TaskTimeout:
+        pass
+    finally:
+        remove_list_waiter(waiter)
+    if waiter.wrong_type:
+        raise TypeError(f"destination {destination!r} is not a list")
+    return waiter.value
+
+
+async def serve_list_waiters() -> list[list[bytes]]:
+    """Hand pushed elements to blocked clients, returns the pops to propagate"""
+    propagate = []
+    while REDIS_LIST_READY:
+        key = next(iter(REDIS_LIST_READY))
+        del REDIS_LIST_READY[key]
+
+        waiters = REDIS_LIST_WAITERS.get(key)
+        while waiters:
+            waiter = waiters[0]
+            if waiter.destination is not None and is_wrong_type(
+                waiter.destination, DBType.LIST
+            ):
+                # answered WRONGTYPE, the element stays for the next waiter
+                remove_list_waiter(waiter)
+                waiter.wrong_type = True
+                await waiter.event.set()
+                continue
+            value = pop_list_element(key, waiter.left)
+            if value is None:
+                break
+
+            remove_list_waiter(waiter)
+            where = b"LEFT" if waiter.left else b"RIGHT"
+            if waiter.destination is not None:
+                # may mark the destination ready, it is served in this loop
+                push_list_value(waiter.destination, [value], left=waiter.to_left)
+                to_where = b"LEFT" if waiter.to_left else b"RIGHT"
+                propagate.append([b"LMOVE", key, waiter.destination, where, to_where])
+            else:
+                propagate.append([b"LPOP" if waiter.left else b"RPOP", key])
+            waiter.value = [key, value]
+            await waiter.event.set()
+    return propagate
@@ -0,0 +1,110 @@
+from collections.abc import Collection
+
+SCAN_HASH_BITS = 64
+SCAN_HASH_MASK = (1 << SCAN_HASH_BITS) - 1
+SCAN_MIN_BITS = 2
+# average keys per bucket before the table doubles, it halves below 1
+SCAN_BUCKET_LOAD = 8
+# empty buckets one call may skip, per key asked, as redis does
+SCAN_EMPTY_VISITS = 10
+
+
+def reverse_bits(value: int, bits: int) -> int:
+    return int(f"{value:0{bits}b}"[::-1], 2) if bits else 0
+
+
+def get_scan_hash(key: bytes) -> int:
+    return hash(key) & SCAN_HASH_MASK
+
+
+class ScanIndex:
+    """Keys bucketed by the low bits of their hash, for stateless cursors
+
+    In bit-reversed hash order every bucket is a contiguous range, so a
+    cursor is a position in that order, like the redis reverse binary
+    cursor. It stays valid while keys come and go and the table doubles or
+    halves: keys present for the whole scan are returned, some maybe twice.
+    A resize moves one bucket per change instead of the whole table at once.
+    """
+
+    def __init__(self, keys: Collection[bytes] = ()) -> None:
+        self.bits = max(SCAN_MIN_BITS, (len(keys) // SCAN_BUCKET_LOAD).bit_length())
+        self.table: list[dict[bytes, None]] = [{} for _ in range(1 << self.bits)]
+        # table of the previous size, emptied into table one bucket at a time
+        self.old: list[dict[bytes, None]] = []
+        self.old_bits = 0
+        self.moved = 0
+        mask = (1 << self.bits) - 1
+        for key in keys:
+            self.table[get_scan_hash(key) & mask][key] = None
+        self.length = len(keys)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def get_bucket(self, key_hash: int) -> dict[bytes, None]:
+        if self.old:
+            index = key_hash & ((1 << self.old_bits) - 1)
+            if index >= self.moved:
+                return self.old[index]
+        return self.table[key_hash & ((1 << self.bits) - 1)]
+
+    def add(self, key: bytes) -> None:
+        bucket = self.get_bucket(get_scan_hash(key))
+        if key not in bucket:
+            bucket[key] = None
+            self.length += 1
+        self.step()
+
+    def remove(self, key: bytes) -> None:
+        bucket = self.get_bucket(get_scan_hash(key))
+        if key in bucket:
+            del bucket[key]
+            self.length -= 1
+        self.step()
+
+    def step(self) -> None:
+        """Move one bucket of a resize, or start one when the load is off"""
+        if self.old:
+            mask = (1 << self.bits) - 1
+            for key in self.old[self.moved]:
+                self.table[get_scan_hash(key) & mask][key] = None
+            self.old[self.moved] = {}
+            self.moved += 1
+            if self.moved == len(self.old):
+                self.old = []
+            return
+
+        size = len(self.table)
+        if self.length > size * SCAN_BUCKET_LOAD:
+            self.resize(self.bits + 1)
+        elif self.length < size and self.bits > SCAN_MIN_BITS:
+            self.resize(self.bits - 1)
+
+    def resize(self, bits: int) -> None:
+        self.old, self.old_bits, self.moved = self.table, self.bits, 0
+        self.table = [{} for _ in range(1 << bits)]
+        self.bits = bits
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list[bytes]]:
+        """Keys of the buckets from cursor on until count, returns (next, keys)"""
+        tables = [(self.table, self.bits)]
+        if self.old:
+            tables.append((self.old, self.old_bits))
+        # a range of the smaller table covers whole buckets of the larger one
+        bits = min(table_bits for _, table_bits in tables)
+        shift = SCAN_HASH_BITS - bits
+
+        keys: list[bytes] = []
+        cursor &= SCAN_HASH_MASK
+        visits = count * SCAN_EMPTY_VISITS
+        while True:
+            prefix = cursor >> shift
+            for table, table_bits in tables:
+                first = prefix << (table_bits - bits)
+                for position in range(first, first + (1 << (table_bits - bits))):
+                    keys.extend(table[reverse_bits(position, table_bits)])
+            cursor = ((prefix + 1) << shift) & SCAN_HASH_MASK
+            visits -= 1
+            if cursor == 0 or len(keys) >= count or visits <= 0:
+                return cursor, keys
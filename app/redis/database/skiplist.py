@@ -0,0 +1,365 @@
+from collections.abc import Callable, ItemsView, Iterator
+from heapq import merge
+from itertools import islice
+from random import random
+
+from .scan import ScanIndex
+
+ZSKIPLIST_MAXLEVEL = 32
+ZSKIPLIST_P = 0.25
+
+Score = float | int
+
+
+class SkipListNode:
+    __slots__ = ("backward", "forward", "member", "score", "span")
+
+    def __init__(self, level: int, score: Score, member: bytes) -> None:
+        self.member = member
+        self.score = score
+        self.backward: SkipListNode | None = None
+        self.forward: list[SkipListNode | None] = [None] * level
+        self.span = [0] * level
+
+
+def random_level() -> int:
+    level = 1
+    while random() < ZSKIPLIST_P and level < ZSKIPLIST_MAXLEVEL:
+        level += 1
+    return level
+
+
+class SkipList:
+    """Skiplist ordered by (score, member), spans give ranks in O(log n)"""
+
+    def __init__(self) -> None:
+        self.header = SkipListNode(ZSKIPLIST_MAXLEVEL, 0, b"")
+        self.tail: SkipListNode | None = None
+        self.length = 0
+        self.level = 1
+
+    def __len__(self) -> int:
+        return self.length
+
+    def insert(self, score: Score, member: bytes) -> SkipListNode:
+        update: list[SkipListNode] = [self.header] * ZSKIPLIST_MAXLEVEL
+        rank = [0] * ZSKIPLIST_MAXLEVEL
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            rank[i] = 0 if i == self.level - 1 else rank[i + 1]
+            while (node := x.forward[i]) is not None and (
+                node.score < score or (node.score == score and node.member < member)
+            ):
+                rank[i] += x.span[i]
+                x = node
+            update[i] = x
+
+        level = random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.header
+                self.header.span[i] = self.length
+            self.level = level
+
+        x = SkipListNode(level, score, member)
+        for i in range(level):
+            x.forward[i] = update[i].forward[i]
+            update[i].forward[i] = x
+            x.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = rank[0] - rank[i] + 1
+        for i in range(level, self.level):
+            update[i].span[i] += 1
+
+        x.backward = None if update[0] is self.header else update[0]
+        if x.forward[0] is not None:
+            x.forward[0].backward = x
+        else:
+            self.tail = x
+        self.length += 1
+        return x
+
+    def extend(self, items: list[tuple[Score, bytes]]) -> None:
+        """Append items sorted by (score, member), all after the current tail"""
+        # last node and its rank on every level, the append point for each
+        update: list[SkipListNode] = [self.header] * ZSKIPLIST_MAXLEVEL
+        rank = [0] * ZSKIPLIST_MAXLEVEL
+        x = self.header
+        traversed = 0
+        for i in range(self.level - 1, -1, -1):
+            while (node := x.forward[i]) is not None:
+                traversed += x.span[i]
+                x = node
+            update[i] = x
+            rank[i] = traversed
+
+        for score, member in items:
+            level = random_level()
+            if level > self.level:
+                for i in range(self.level, level):
+                    self.header.span[i] = self.length
+                self.level = level
+
+            x = SkipListNode(level, score, member)
+            length = self.length + 1
+            for i in range(level):
+                update[i].forward[i] = x
+                update[i].span[i] = length - rank[i]
+                update[i] = x
+                rank[i] = length
+            for i in range(level, self.level):
+                update[i].span[i] += 1
+
+            x.backward = self.tail
+            self.tail = x
+            self.length = length
+
+    def delete(self, score: Score, member: bytes) -> bool:
+        update: list[SkipListNode] = [self.header] * ZSKIPLIST_MAXLEVEL
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while (node := x.forward[i]) is not None and (
+                node.score < score or (node.score == score and node.member < member)
+            ):
+                x = node
+            update[i] = x
+
+        node = x.forward[0]
+        if node is None or node.score != score or node.member != member:
+            return False
+
+        for i in range(self.level):
+            if update[i].forward[i] is node:
+                update[i].span[i] += node.span[i] - 1
+                update[i].forward[i] = node.forward[i]
+            else:
+                update[i].span[i] -= 1
+        if node.forward[0] is not None:
+            node.forward[0].backward = node.backward
+        else:
+            self.tail = node.backward
+        while self.level > 1 and self.header.forward[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+        return True
+
+    def get_rank(self, score: Score, member: bytes) -> int:
+        """1-based rank of the element, 0 when missing"""
+        rank = 0
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while (node := x.forward[i]) is not None and (
+                node.score < score or (node.score == score and node.member <= member)
+            ):
+                rank += x.span[i]
+                x = node
+            if x is not self.header and x.member == member:
+                return rank
+        return 0
+
+    def get_by_rank(self, rank: int) -> SkipListNode | None:
+        """Node at the 1-based rank"""
+        traversed = 0
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while (node := x.forward[i]) is not None and traversed + x.span[i] <= rank:
+                traversed += x.span[i]
+                x = node
+            if traversed == rank:
+                return x if x is not self.header else None
+        return None
+
+    def find_first(self, below: Callable[[SkipListNode], bool]) -> SkipListNode | None:
+        """First node not below the range, below must hold for a prefix only"""
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while (node := x.forward[i]) is not None and below(node):
+                x = node
+        return x.forward[0]
+
+    def find_last(self, above: Callable[[SkipListNode], bool]) -> SkipListNode | None:
+        """Last node not above the range, above must hold for a suffix only"""
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while (node := x.forward[i]) is not None and not above(node):
+                x = node
+        return x if x is not self.header else None
+
+
+class SortedSet:
+    """Member to score dict plus a skiplist index, like the redis zset"""
+
+    def __init__(self) -> None:
+        self.scores: dict[bytes, Score] = {}
+        self.index = SkipList()
+        # built on the first ZSCAN, then kept up to date
+        self.scan_index: ScanIndex | None = None
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def __iter__(self) -> Iterator[tuple[bytes, Score]]:
+        return self.iter_from(self.index.header.forward[0])
+
+    def items(self) -> ItemsView[bytes, Score]:
+        """Members and scores in no particular order, like a dict of scores"""
+        return self.scores.items()
+
+    def add(self, member: bytes, score: Score) -> bool:
+        """Add or update a member, returns True when it is new"""
+        current = self.scores.get(member)
+        if current is not None:
+            if current == score:
+                return False
+            self.index.delete(current, member)
+        self.scores[member] = score
+        self.index.insert(score, member)
+        if current is None and self.scan_index is not None:
+            self.scan_index.add(member)
+        return current is None
+
+    def update(
+        self,
+        values: dict[bytes, Score],
+        nx: bool = False,
+        xx: bool = False,
+        ch: bool = False,
+    ) -> int:
+        """Add or update many members, returns the added (with ch changed) count"""
+        added: list[tuple[Score, bytes]] = []
+        changed = 0
+        for member, score in values.items():
+            current = self.scores.get(member)
+            if current is None:
+                if not xx:
+                    self.scores[member] = score
+                    added.append((score, member))
+            elif not nx and current != score:
+                self.index.delete(current, member)
+                self.index.insert(score, member)
+                self.scores[member] = score
+                changed += 1
+
+        if added and self.scan_index is not None:
+            for _, member in added:
+                self.scan_index.add(member)
+
+        # new members past the tail, the usual bulk load, are linked in order
+        # and a batch at least as big as the set rebuilds it from one merge
+        added.sort()
+        tail = self.index.tail
+        if added and (tail is None or (tail.score, tail.member) < added[0]):
+            self.index.extend(added)
+        elif len(added) >= len(self.index):
+            index = SkipList()
+            index.extend(
+                list(merge(((score, member) for member, score in self), added))
+            )
+            self.index = index
+        else:
+            for score, member in added:
+                self.index.insert(score, member)
+        return len(added) + changed if ch else len(added)
+
+    def remove(self, member: bytes) -> bool:
+        score = self.scores.pop(member, None)
+        if score is None:
+            return False
+        self.index.delete(score, member)
+        if self.scan_index is not None:
+            self.scan_index.remove(member)
+        return True
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list[bytes]]:
+        if self.scan_index is None:
+            self.scan_index = ScanIndex(self.scores)
+        return self.scan_index.scan(cursor, count)
+
+    def score(self, member: bytes) -> Score | None:
+        return self.scores.get(member)
+
+    def rank(self, member: bytes) -> int | None:
+        """0-based rank of the member"""
+        score = self.scores.get(member)
+        if score is None:
+            return None
+        return self.index.get_rank(score, member) - 1
+
+    def iter_from(
+        self, node: SkipListNode | None, reverse: bool = False
+    ) -> Iterator[tuple[bytes, Score]]:
+        while node is not None:
+            yield node.member, node.score
+            node = node.backward if reverse else node.forward[0]
+
+    def range_by_rank(
+        self, start: int, end: int, reverse: bool = False
+    ) -> Iterator[tuple[bytes, Score]]:
+        """Members between the 0-based ranks start and end, both included"""
+        length = len(self.index)
+        if start < 0:
+            start = max(start + length, 0)
+        if end < 0:
+            end += length
+        end = min(end, length - 1)
+        if start > end:
+            return iter(())
+
+        rank = length - start if reverse else start + 1
+        node = self.index.get_by_rank(rank)
+        return islice(self.iter_from(node, reverse), end - start + 1)
+
+    def range_by_score(
+        self,
+        min_score: Score,
+        max_score: Score,
+        min_ex: bool = False,
+        max_ex: bool = False,
+        reverse: bool = False,
+    ) -> Iterator[tuple[bytes, Score]]:
+        def below(node: SkipListNode) -> bool:
+            return node.score < min_score or (min_ex and node.score == min_score)
+
+        def above(node: SkipListNode) -> bool:
+            return node.score > max_score or (max_ex and node.score == max_score)
+
+        return self.range_by(below, above, reverse)
+
+    def range_by_lex(
+        self,
+        min_member: bytes | None,
+        max_member: bytes | None,
+        min_ex: bool = False,
+        max_ex: bool = False,
+        reverse: bool = False,
+    ) -> Iterator[tuple[bytes, Score]]:
+        """Members between min and max, None is unbounded, scores must be equal"""
+
+        def below(node: SkipListNode) -> bool:
+            if min_member is None:
+                return False
+            return node.member < min_member or (min_ex and node.member == min_member)
+
+        def above(node: SkipListNode) -> bool:
+            if max_member is None:
+                return False
+            return node.member > max_member or (max_ex and node.member == max_member)
+
+        return self.range_by(below, above, reverse)
+
+    def range_by(
+        self,
+        below: Callable[[SkipListNode], bool],
+        above: Callable[[SkipListNode], bool],
+        reverse: bool = False,
+    ) -> Iterator[tuple[bytes, Score]]:
+        if reverse:
+            node = self.index.find_last(above)
+            while node is not None and not below(node):
+                yield node.member, node.score
+                node = node.backward
+        else:
+            node = self.index.find_first(below)
+            while node is not None and not above(node):
+                yield node.member, node.score
+                node = node.forward[0]
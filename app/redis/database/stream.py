@@ -1,138 +1,230 @@
 import logging
+from collections.abc import Iterator
 
-from app.redis.resp import encode_redis, encode_simple
+from app.redis.rdb.file.constants import DBType
 from lib import curio
 
-from .data import (
-    check_key,
-    get_current_time,
-    get_data,
-    set_stream_data,
-)
+from .data import copy_on_write, get_current_time, get_data, set_data
+from .streamnode import Stream, StreamEntry, StreamID
 
+STREAM_ID_MAX = 2**64 - 1
 
-def get_stream_last(key: str) -> str:
-    logging.info("XRANGE key '%s' $")
+REDIS_STREAM_WAITERS: dict[bytes, set[curio.Event]] = {}
+REDIS_STREAM_READY: dict[bytes, None] = {}
+
+
+def encode_stream_id(sid: StreamID) -> bytes:
+    return b"%d-%d" % sid
+
+
+def parse_stream_id(value: bytes, seq: int = 0) -> StreamID:
+    """Parse 'ms-seq' or 'ms', using seq when it is missing"""
+    if b"-" in value:
+        ms, _, seq_value = value.partition(b"-")
+        sid = int(ms), int(seq_value)
+    else:
+        sid = int(value), seq
+    if not (0 <= sid[0] <= STREAM_ID_MAX and 0 <= sid[1] <= STREAM_ID_MAX):
+        raise ValueError(value)
+    return sid
+
+
+def parse_stream_start(value: bytes) -> StreamID:
+    if value == b"-":
+        return 0, 0
+    if value.startswith(b"("):
+        ms, seq = parse_stream_id(value[1:])
+        return (ms, seq + 1) if seq < STREAM_ID_MAX else (ms + 1, 0)
+    return parse_stream_id(value)
+
+
+def parse_stream_end(value: bytes) -> StreamID:
+    if value == b"+":
+        return STREAM_ID_MAX, STREAM_ID_MAX
+    if value.startswith(b"("):
+        ms, seq = parse_stream_id(value[1:], STREAM_ID_MAX)
+        return (ms, seq - 1) if seq > 0 else (ms - 1, STREAM_ID_MAX)
+    return parse_stream_id(value, STREAM_ID_MAX)
+
+
+def encode_stream_entries(
+    entries: Iterator[StreamEntry], count: int | None = None
+) -> list[list[bytes | list[bytes]]]:
+    res: list[list[bytes | list[bytes]]] = []
+    for sid, fields in entries:
+        if count is not None and len(res) >= count:
+            break
+        res.append([encode_stream_id(sid), fields])
+    return res
+
+
+def get_stream_last(key: bytes) -> StreamID:
+    logging.info("XRANGE key '%s' $", key)
+    data, _ = get_data(key)
+    if not data:
+        return 0, 0
+
+    return data["value"].last_id
+
+
+def get_stream_length(key: bytes) -> int:
+    logging.info("XLEN key '%s'", key)
     data, _ = get_data(key)
     if not data:
-        return ""
+        return 0
 
-    last_time = list(data["value"])[-1]
-    last_seq = list(data["value"][last_time])[-1]
-    return f"{last_time}-{last_seq}"
+    return len(data["value"])
 
 
 def get_stream_range(
-    key: str, start: str, end: str, left_closed: bool = True
-) -> list[list[str | list[str]]]:
+    key: bytes,
+    start: bytes,
+    end: bytes,
+    count: int | None = None,
+    reverse: bool = False,
+) -> list[list[bytes | list[bytes]]]:
     logging.info(
-        "XRANGE key '%s' start %s end %s left_closed %s", key, start, end, left_closed
+        "XRANGE key '%s' start %s end %s count %s reverse %s",
+        key,
+        start,
+        end,
+        count,
+        reverse,
     )
     data, _ = get_data(key)
     if not data:
-        return ""
-
-    startTime, startSeq = (
-        (0, 1)
-        if start == "-"
-        else map(int, start.split("-", maxsplit=1))
-        if "-" in start
-        else (int(start), 0)
-    )
-    endTime, endSeq = (
-        (2**64 - 1, 2**64 - 1)
-        if end == "+"
-        else map(int, end.split("-", maxsplit=1))
-        if "-" in end
-        else (int(end), 2**64 - 1)
+        return []
+
+    return encode_stream_entries(
+        data["value"].range(parse_stream_start(start), parse_stream_end(end), reverse),
+        count,
     )
 
-    return [
-        [f"{ktime}-{kseq}", [item for kv in kval.items() for item in kv]]
-        for ktime, kdict in data["value"].items()
-        for kseq, kval in kdict.items()
-        if (
-            (ktime > startTime)
-            or (
-                (ktime == startTime)
-                and ((kseq >= startSeq) if left_closed else (kseq > startSeq))
-            )
-        )
-        and ((ktime < endTime) or ((ktime == endTime) and (kseq <= endSeq)))
-    ]
+
+def get_stream_after(
+    key: bytes, sid: StreamID, count: int | None = None
+) -> list[list[bytes | list[bytes]]]:
+    data, _ = get_data(key)
+    # a key replaced by another type leaves the reader blocked
+    if not data or data["type"] != DBType.STREAM:
+        return []
+
+    start = parse_stream_start(b"(" + encode_stream_id(sid))
+    return encode_stream_entries(
+        data["value"].range(start, (STREAM_ID_MAX, STREAM_ID_MAX)), count
+    )
 
 
 async def get_stream_values(
-    args: dict[str, str],
+    args: dict[bytes, bytes],
     block_time: int | None = None,
-) -> list[list[str | list[list[str, list[str]]]]]:
-    logging.info("XREAD keys %s block_time %d", args, block_time)
-    data = []
-    last_id = {}
-    for key, start in args.items():
-        if start == "$":
-            last_id[key] = get_stream_last(key)
-        else:
-            values = get_stream_range(key, start, "+", False)
-            if values:
-                data.append([key, values])
-    if (len(data) > 0) or (block_time is None):
+    count: int | None = None,
+) -> list[list[bytes | list[list[bytes | list[bytes]]]]]:
+    logging.info("XREAD keys %s block_time %s", args, block_time)
+    last_id = {
+        key: get_stream_last(key) if start == b"$" else parse_stream_id(start)
+        for key, start in args.items()
+    }
+
+    data = read_stream_values(last_id, count)
+    if data or block_time is None:
         return data
 
-    while len(data) == 0:
-        await curio.sleep(block_time / 1000.0)
-        for key, start in args.items():
-            if start == "$":
-                values = get_stream_range(key, last_id[key], "+", False)
-            else:
-                values = get_stream_range(key, start, "+", False)
-            if values:
-                data.append([key, values])
+    # XADD sets the event, the timeout sits in the kernel timer queue
+    event = curio.Event()
+    for key in last_id:
+        REDIS_STREAM_WAITERS.setdefault(key, set()).add(event)
+    try:
         if block_time > 0:
-            break
+            data = await curio.ignore_after(
+                block_time / 1000.0, wait_stream_values(event, last_id, count)
+            )
+        else:
+            data = await wait_stream_values(event, last_id, count)
+    finally:
+        for key in last_id:
+            waiters = REDIS_STREAM_WAITERS.get(key)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del REDIS_STREAM_WAITERS[key]
+    return data or []
+
+
+def read_stream_values(
+    last_id: dict[bytes, StreamID], count: int | None = None
+) -> list[list[bytes | list[list[bytes | list[bytes]]]]]:
+    data = []
+    for key, sid in last_id.items():
+        values = get_stream_after(key, sid, count)
+        if values:
+            data.append([key, values])
+    return data
+
 
+async def wait_stream_values(
+    event: curio.Event, last_id: dict[bytes, StreamID], count: int | None = None
+) -> list[list[bytes | list[list[bytes | list[bytes]]]]]:
+    data = []
+    while not data:
+        await event.wait()
+        event.clear()
+        data = read_stream_values(last_id, count)
     return data
 
 
-def set_stream_value(key: str, kid: str, values: dict[str, str]) -> bytes:
+async def serve_stream_waiters() -> None:
+    """Wake XREAD callers blocked on streams that got new entries"""
+    while REDIS_STREAM_READY:
+        key = next(iter(REDIS_STREAM_READY))
+        del REDIS_STREAM_READY[key]
+        for event in list(REDIS_STREAM_WAITERS.get(key, ())):
+            await event.set()
+
+
+def set_stream_value(key: bytes, kid: bytes, values: list[bytes]) -> bytes | str:
+    """Append an entry, returns its ID or an error message"""
     logging.info("XADD key '%s' id '%s' values %s", key, kid, values)
+    data, _ = get_data(key)
+    stream = data["value"] if data else Stream()
+    last_ms, last_seq = stream.last_id
 
-    if kid == "*":
-        millisecondsTime = get_current_time()
-        sequenceNumber = 0
-    elif "-" in kid:
-        millisecondsTime, sequenceNumber = kid.split("-", maxsplit=1)
-        millisecondsTime = int(millisecondsTime)
-        if sequenceNumber == "*":
-            sequenceNumber = -1 if check_key(key) else 1 if millisecondsTime == 0 else 0
+    error_id = "ERR The ID specified in XADD is equal or smaller than the target stream top item"
+    try:
+        if kid == b"*":
+            ms = max(get_current_time(), last_ms)
+            sid = (ms, last_seq + 1) if ms == last_ms else (ms, 0)
+        elif kid.endswith(b"-*"):
+            ms = parse_stream_id(kid[:-2])[0]
+            if ms < last_ms:
+                return error_id
+            sid = (ms, last_seq + 1) if ms == last_ms else (ms, 0)
         else:
-            sequenceNumber = int(sequenceNumber)
-            if (millisecondsTime == 0) and (sequenceNumber == 0):
-                return encode_simple(
-                    "ERR The ID specified in XADD must be greater than 0-0", True
-                )
-    else:
-        return encode_simple("ERR invalid id format", True)
+            sid = parse_stream_id(kid)
+    except ValueError:
+        return "ERR Invalid stream ID specified as stream command argument"
 
-    if not check_key(key):
-        set_stream_data(key, millisecondsTime, sequenceNumber, values)
-        return encode_redis(f"{millisecondsTime}-{sequenceNumber}")
+    if sid == (0, 0):
+        return "ERR The ID specified in XADD must be greater than 0-0"
+    if sid <= stream.last_id:
+        return error_id
 
+    if not data:
+        set_data(key, stream, dtype=DBType.STREAM)
+    copy_on_write(key)
+    stream.append(sid, values)
+    if key in REDIS_STREAM_WAITERS:
+        REDIS_STREAM_READY[key] = None
+    return encode_stream_id(sid)
+
+
+def trim_stream(key: bytes, strategy: bytes, threshold: bytes, approx: bool) -> int:
+    logging.info("XTRIM key '%s' %s %s approx %s", key, strategy, threshold, approx)
     data, _ = get_data(key)
-    latestTime = max(data["value"].keys())
+    if not data:
+        return 0
 
-    error_id = "ERR The ID specified in XADD is equal or smaller than the target stream top item"
-    if millisecondsTime < latestTime:
-        return encode_simple(error_id, True)
-
-    if millisecondsTime == latestTime:
-        latestSeq = max(data["value"][millisecondsTime].keys())
-        if sequenceNumber == -1:
-            sequenceNumber = latestSeq + 1
-        elif sequenceNumber <= latestSeq:
-            return encode_simple(error_id, True)
-    elif sequenceNumber == -1:
-        sequenceNumber = 0
-
-    set_stream_data(key, millisecondsTime, sequenceNumber, values)
-    return encode_redis(f"{millisecondsTime}-{sequenceNumber}")
+    copy_on_write(key)
+    if strategy == b"MAXLEN":
+        return data["value"].trim_maxlen(int(threshold), approx)
+    return data["value"].trim_minid(parse_stream_id(threshold), approx)
@@ -0,0 +1,131 @@
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterator
+
+STREAM_NODE_MAX_ENTRIES = 100
+
+StreamID = tuple[int, int]
+StreamEntry = tuple[StreamID, list[bytes]]
+
+
+class StreamNode:
+    """Macro node holding up to STREAM_NODE_MAX_ENTRIES consecutive entries"""
+
+    __slots__ = ("fields", "ids")
+
+    def __init__(self) -> None:
+        self.ids: list[StreamID] = []
+        self.fields: list[list[bytes]] = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class Stream:
+    """Append-only list of macro nodes, bisected by their first ID"""
+
+    def __init__(self) -> None:
+        self.nodes: list[StreamNode] = []
+        self.first_ids: list[StreamID] = []
+        self.last_id: StreamID = (0, 0)
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def copy(self) -> "Stream":
+        """Copy of the node lists, entries are shared as they never change"""
+        stream = Stream()
+        for node in self.nodes:
+            copy = StreamNode()
+            copy.ids = node.ids.copy()
+            copy.fields = node.fields.copy()
+            stream.nodes.append(copy)
+        stream.first_ids = self.first_ids.copy()
+        stream.last_id = self.last_id
+        stream.length = self.length
+        return stream
+
+    def append(self, sid: StreamID, fields: list[bytes]) -> None:
+        if not self.nodes or len(self.nodes[-1]) >= STREAM_NODE_MAX_ENTRIES:
+            self.nodes.append(StreamNode())
+            self.first_ids.append(sid)
+        node = self.nodes[-1]
+        node.ids.append(sid)
+        node.fields.append(fields)
+        self.last_id = sid
+        self.length += 1
+
+    def range(
+        self, start: StreamID, end: StreamID, reverse: bool = False
+    ) -> Iterator[StreamEntry]:
+        """Entries with start <= id <= end, in id order unless reverse"""
+        if start > end or not self.nodes:
+            return
+        if reverse:
+            nid = max(bisect_right(self.first_ids, end) - 1, 0)
+            pos = bisect_right(self.nodes[nid].ids, end) - 1
+            while nid >= 0:
+                node = self.nodes[nid]
+                while pos >= 0:
+                    if node.ids[pos] < start:
+                        return
+                    yield node.ids[pos], node.fields[pos]
+                    pos -= 1
+                nid -= 1
+                if nid >= 0:
+                    pos = len(self.nodes[nid]) - 1
+        else:
+            nid = max(bisect_right(self.first_ids, start) - 1, 0)
+            pos = bisect_left(self.nodes[nid].ids, start)
+            while nid < len(self.nodes):
+                node = self.nodes[nid]
+                while pos < len(node):
+                    if node.ids[pos] > end:
+                        return
+                    yield node.ids[pos], node.fields[pos]
+                    pos += 1
+                nid += 1
+                pos = 0
+
+    def trim_nodes(self, count: int) -> int:
+        removed = sum(len(node) for node in self.nodes[:count])
+        del self.nodes[:count]
+        del self.first_ids[:count]
+        self.length -= removed
+        return removed
+
+    def trim_entries(self, count: int) -> int:
+        """Drop count entries from the first node, which must hold more"""
+        node = self.nodes[0]
+        del node.ids[:count]
+        del node.fields[:count]
+        self.first_ids[0] = node.ids[0]
+        self.length -= count
+        return count
+
+    def trim_maxlen(self, maxlen: int, approx: bool = False) -> int:
+        """Keep the newest maxlen entries, only whole nodes when approx"""
+        count = 0
+        extra = self.length - maxlen
+        while count < len(self.nodes) and len(self.nodes[count]) <= extra:
+            extra -= len(self.nodes[count])
+            count += 1
+        removed = self.trim_nodes(count)
+        if extra > 0 and not approx:
+            removed += self.trim_entries(extra)
+        return removed
+
+    def trim_minid(self, minid: StreamID, approx: bool = False) -> int:
+        """Drop entries older than minid, only whole nodes when approx"""
+        # a node can go when the next one starts at or before minid
+        count = max(bisect_right(self.first_ids, minid) - 1, 0)
+        if count == len(self.nodes) - 1 and self.last_id < minid:
+            count += 1
+        removed = self.trim_nodes(count)
+        if self.nodes and not approx:
+            extra = bisect_left(self.nodes[0].ids, minid)
+            if extra == len(self.nodes[0]):
+                removed += self.trim_nodes(1)
+            elif extra > 0:
+                removed += self.trim_entries(extra)
+        return removed
@@ -1,22 +1,22 @@
 import logging
 
-from app.redis.resp import encode_redis, encode_simple
+from app.redis.resp import REPLY_OK, encode_integer, encode_simple
 
 from .data import get_current_time, get_data, set_data
 
 
-def get_value(key: str) -> str | dict[str, str]:
+def get_value(key: bytes) -> bytes | str:
     logging.info("GET key '%s'", key)
     data, _ = get_data(key)
     return data.get("value", "")
 
 
-def increase_value(key: str) -> bytes:
+def increase_value(key: bytes) -> bytes:
     logging.info("INCR key '%s'")
     data, _ = get_data(key)
     if not data:
-        set_value(key, "1")
-        return encode_redis(1)
+        set_value(key, b"1")
+        return encode_integer(1)
 
     value = get_value(key)
     try:
@@ -24,27 +24,27 @@ def increase_value(key: str) -> bytes:
     except ValueError:
         return encode_simple("ERR value is not an integer or out of range", True)
 
-    set_data(key, str(res))
-    return encode_redis(res)
+    set_data(key, str(res).encode())
+    return encode_integer(res)
 
 
-def set_value(key: str, value: str, options: list[str] | None = None) -> bytes:
+def set_value(key: bytes, value: bytes, options: list[bytes] | None = None) -> bytes:
     logging.info("SET key '%s' value %s options %s", key, value, options)
     if options is None:
         options = []
 
     exp = None
     for opt in options:
-        if opt in ["EX", "EXAT", "PX", "PXAT"]:
+        if opt in [b"EX", b"EXAT", b"PX", b"PXAT"]:
             idx = options.index(opt)
             if idx + 1 >= len(options):
                 return encode_simple("ERR missing arguments for 'set' command", True)
             exp = int(options[idx + 1])
-            if opt.startswith("EX"):
+            if opt.startswith(b"EX"):
                 exp *= 1000
-            if not opt.endswith("AT"):
+            if not opt.endswith(b"AT"):
                 exp += get_current_time()
             break
 
     set_data(key, value, exp)
-    return encode_simple("OK")
+    return REPLY_OK
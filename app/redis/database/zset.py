@@ -1,95 +1,166 @@
 import logging
+from collections.abc import Iterator
+from itertools import islice
 
+from app.redis.pattern import compile_pattern
 from app.redis.rdb.file.constants import DBType
 
-from .data import check_key, get_data, set_data
+from .data import copy_on_write, delete_data, get_data, set_data
+from .skiplist import Score, SortedSet
 
+ZSCAN_SMALL_SIZE = 128
 
-def set_zset_value(key: str, values: dict[str, float]) -> int:
-    logging.info("ZADD key '%s' values %s", key, values)
-    if not check_key(key):
-        sorted_values = sorted(
-            sorted(values.items(), key=lambda x: x[0]), key=lambda x: x[1]
-        )
-        set_data(key, sorted_values, dtype=DBType.ZSET)
-        return len(sorted_values)
 
+def encode_zset_range(
+    values: Iterator[tuple[bytes, Score]],
+    offset: int = 0,
+    count: int = -1,
+    withscores: bool = False,
+) -> list[bytes]:
+    if offset < 0:
+        return []
+    values = islice(values, offset, offset + count if count >= 0 else None)
+    if not withscores:
+        return [member for member, _ in values]
+
+    res = []
+    for member, score in values:
+        res.extend([member, str(score).encode()])
+    return res
+
+
+def set_zset_value(
+    key: bytes,
+    values: dict[bytes, Score],
+    nx: bool = False,
+    xx: bool = False,
+    ch: bool = False,
+) -> int:
+    logging.info(
+        "ZADD key '%s' values %d nx %s xx %s ch %s", key, len(values), nx, xx, ch
+    )
     vzset, _ = get_data(key)
-    vdict = dict(vzset["value"])
-    vdict.update(values)
+    if not vzset:
+        if xx or not values:
+            return 0
+        vzset = {"value": SortedSet()}
+        set_data(key, vzset["value"], dtype=DBType.ZSET)
 
-    sorted_values = sorted(
-        sorted(vdict.items(), key=lambda x: x[0]), key=lambda x: x[1]
-    )
-    set_data(key, sorted_values, dtype=DBType.ZSET)
-    return len(sorted_values) - len(vzset["value"])
+    copy_on_write(key)
+    return vzset["value"].update(values, nx, xx, ch)
 
 
-def get_zset_rank(key: str, member: str) -> int | str:
+def get_zset_rank(key: bytes, member: bytes) -> int | str:
     logging.info("ZRANK key '%s' member %s", key, member)
-    if not check_key(key):
-        return ""
-
     vzset, _ = get_data(key)
-    vdict = dict(vzset["value"])
-    if member not in vdict:
+    if not vzset:
         return ""
 
-    return list(vdict).index(member)
+    rank = vzset["value"].rank(member)
+    return rank if rank is not None else ""
 
 
-def get_zset_range(key: str, start: int, end: int) -> list[str]:
+def get_zset_range(
+    key: bytes, start: int, end: int, withscores: bool = False
+) -> list[bytes]:
     logging.info("ZRANGE key '%s' start %d end %d", key, start, end)
-    if not check_key(key):
+    vzset, _ = get_data(key)
+    if not vzset:
         return []
 
+    return encode_zset_range(
+        vzset["value"].range_by_rank(start, end), withscores=withscores
+    )
+
+
+def get_zset_range_by_score(
+    key: bytes,
+    min_score: tuple[float, bool],
+    max_score: tuple[float, bool],
+    reverse: bool = False,
+    offset: int = 0,
+    count: int = -1,
+    withscores: bool = False,
+) -> list[bytes]:
+    logging.info("ZRANGEBYSCORE key '%s' min %s max %s", key, min_score, max_score)
     vzset, _ = get_data(key)
-    len_vzset = len(vzset["value"])
-    if start >= len_vzset or (end >= 0 and start > end):
+    if not vzset:
         return []
 
-    if end > len_vzset:
-        end = len_vzset
-    elif end == -1:
-        end = None
-    else:
-        end += 1
+    values = vzset["value"].range_by_score(
+        min_score[0], max_score[0], min_score[1], max_score[1], reverse
+    )
+    return encode_zset_range(values, offset, count, withscores)
+
+
+def get_zset_range_by_lex(
+    key: bytes,
+    min_member: tuple[bytes | None, bool],
+    max_member: tuple[bytes | None, bool],
+    reverse: bool = False,
+    offset: int = 0,
+    count: int = -1,
+) -> list[bytes]:
+    logging.info("ZRANGEBYLEX key '%s' min %s max %s", key, min_member, max_member)
+    vzset, _ = get_data(key)
+    if not vzset:
+        return []
 
-    return [v[0] for v in vzset["value"][start:end]]
+    values = vzset["value"].range_by_lex(
+        min_member[0], max_member[0], min_member[1], max_member[1], reverse
+    )
+    return encode_zset_range(values, offset, count)
 
 
-def get_zset_length(key: str) -> int:
+def get_zset_length(key: bytes) -> int:
     logging.info("ZCARD key '%s'", key)
-    if not check_key(key):
+    vzset, _ = get_data(key)
+    if not vzset:
         return 0
 
-    vzset, _ = get_data(key)
     return len(vzset["value"])
 
 
-def get_zset_score(key: str, member: str) -> str:
+def get_zset_score(key: bytes, member: bytes) -> str:
     logging.info("ZSCORE key '%s' member %s", key, member)
-    if not check_key(key):
-        return ""
-
     vzset, _ = get_data(key)
-    vdict = dict(vzset["value"])
-    if member not in vdict:
+    if not vzset:
         return ""
 
-    return str(vdict[member])
+    score = vzset["value"].score(member)
+    return str(score) if score is not None else ""
 
 
-def remove_zset_member(key: str, member: str) -> int:
+def remove_zset_member(key: bytes, member: bytes) -> int:
     logging.info("ZREM key '%s' member %s", key, member)
-    if not check_key(key):
-        return 0
-
     vzset, _ = get_data(key)
-    vdict = dict(vzset["value"])
-    if member not in vdict:
+    copy_on_write(key)
+    if not vzset or not vzset["value"].remove(member):
         return 0
 
-    del vdict[member]
-    set_data(key, list(vdict.items()), dtype=DBType.ZSET)
+    if not vzset["value"]:
+        delete_data(key)
     return 1
+
+
+def scan_zset(
+    key: bytes, cursor: int, count: int, pattern: bytes | None = None
+) -> tuple[int, list[bytes]]:
+    logging.info("ZSCAN key '%s' cursor %d count %d", key, cursor, count)
+    vzset, _ = get_data(key)
+    if not vzset:
+        return 0, []
+
+    zset = vzset["value"]
+    match = compile_pattern(pattern) if pattern is not None else None
+    # small sets come whole in one reply, as redis does for listpacks
+    if len(zset) <= ZSCAN_SMALL_SIZE:
+        next_cursor, visited = 0, [member for member, _ in zset]
+    else:
+        next_cursor, visited = zset.scan(cursor, count)
+
+    members = []
+    for member in visited:
+        if match is None or match(member):
+            members.extend([member, str(zset.scores[member]).encode()])
+    return next_cursor, members
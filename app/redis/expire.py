@@ -0,0 +1,35 @@
+import logging
+from time import monotonic
+
+from lib import curio
+
+from .database import expire_keys, get_volatile_count, set_expire_stale_perc
+
+REDIS_HZ = 10
+ACTIVE_EXPIRE_CYCLE_KEYS = 20
+ACTIVE_EXPIRE_CYCLE_SLOW_TIME_PERC = 25
+
+
+async def run_expire_cycle() -> None:
+    """Reclaim expired keys in the background, a bounded slice per tick"""
+    period = 1 / REDIS_HZ
+    time_limit = period * ACTIVE_EXPIRE_CYCLE_SLOW_TIME_PERC / 100
+    while True:
+        await curio.sleep(period)
+
+        volatile = get_volatile_count()
+        if volatile == 0:
+            set_expire_stale_perc(0)
+            continue
+
+        start = monotonic()
+        total = 0
+        while True:
+            expired, more = expire_keys(ACTIVE_EXPIRE_CYCLE_KEYS)
+            total += expired
+            if not more or monotonic() - start > time_limit:
+                break
+
+        set_expire_stale_perc(total / volatile)
+        if total:
+            logging.info("Expire cycle %d/%d keys %s", total, volatile, more)
@@ -1,707 +1,1404 @@
 import logging
+import math
+from collections.abc import Awaitable, Callable
+from time import perf_counter_ns
 
+from lib import curio
+
+from .aof import feed_aof, flush_aof, start_rewrite_aof
+from .command import REDIS_COMMANDS, RedisCommand, command
 from .config import get_config, set_config
+from .connection import RedisConnection
 from .database import (
-    get_geo_closest,
+    DISTANCE_UNITS,
+    get_expire,
+    get_geo_coords,
     get_geo_distance,
     get_geo_value,
     get_keys,
     get_list_length,
     get_list_values,
+    get_stream_length,
     get_stream_range,
     get_stream_values,
     get_type,
     get_value,
     get_zset_length,
     get_zset_range,
+    get_zset_range_by_lex,
+    get_zset_range_by_score,
     get_zset_rank,
     get_zset_score,
     increase_value,
-    pop_block_list_value,
+    is_wrong_type,
+    move_list_value,
+    pop_first_list_value,
     pop_list_value,
     push_list_value,
     remove_zset_member,
-    save_db,
+    scan_keys,
+    scan_zset,
+    search_geo,
+    serve_list_waiters,
+    serve_stream_waiters,
     set_geo_value,
     set_stream_value,
     set_value,
     set_zset_value,
+    trim_stream,
+    wait_list_value,
 )
 from .info import get_info, get_info_str, isin_info
-from .pubsub import get_clients
-from .resp import REDIS_SEPARATOR, IDAggregate, encode_redis, encode_simple
-from .slave import wait_slaves
-
-REDIS_QUIT = REDIS_SEPARATOR + REDIS_SEPARATOR
-
-
-async def handle_redis(
-    command_line: list[str],
-    master_offset: int = 0,
-    multi_state: bool = False,
-    multi_commands: list[list[str]] | None = None,
-    sub_mode: bool = False,
-    subbed_channels: set[str] | None = None,
-) -> tuple[
-    bytes,
-    bool,
-    bytes,
-    bytes,
-    bool,
-    list[list[str]] | None,
-    bool,
-    set[str] | None,
-    tuple[str, bytes] | None,
-]:
-    command = command_line[0].upper()
-    arguments = command_line[1:] if len(command_line) > 1 else []
-
-    is_replica = False
-    send_message = b""
-    send_replica = b""
-    send_master = b""
-    new_channels: set[str] | None = None
-    send_pub = None
-
-    if sub_mode and command not in [
-        "SUBSCRIBE",
-        "UNSUBSCRIBE",
-        "PSUBSCRIBE",
-        "PUNSUBSCRIBE",
-        "PING",
-        "QUIT",
-        "RESET",
-    ]:
-        send_message = encode_simple(
-            f"ERR Can't execute '{command}' in subscribe mode; only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING / QUIT / RESET are allowed",
-            True,
+from .pubsub import (
+    get_channels,
+    get_clients,
+    get_pattern_count,
+    psub_pattern,
+    pub_message,
+    punsub_pattern,
+    sub_channel,
+    unsub_channel,
+)
+from .rdb.file.constants import DBType
+from .resp import (
+    REPLY_EMPTY_ARRAY,
+    REPLY_NIL,
+    REPLY_NIL_ARRAY,
+    REPLY_OK,
+    REPLY_PONG,
+    REPLY_QUEUED,
+    encode_array_header,
+    encode_bulk,
+    encode_bulk_array,
+    encode_integer,
+    encode_redis,
+    encode_simple,
+)
+from .save import (
+    add_dirty,
+    get_lastsave,
+    is_bgsave_running,
+    save,
+    schedule_bgsave,
+    start_bgsave,
+)
+from .slave import register_slave, send_write, wait_slaves
+
+ERROR_WRONGTYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+
+def parse_scan_arguments(
+    connection: RedisConnection, arguments: list[bytes], with_type: bool = False
+) -> tuple[int, int, bytes | None, DBType | None] | None:
+    """Parse 'cursor [MATCH pattern] [COUNT count] [TYPE type]' or reply an error"""
+    try:
+        cursor = int(arguments[0])
+    except ValueError:
+        connection.error("ERR invalid cursor")
+        return None
+
+    count = 10
+    pattern = None
+    dtype = None
+    options = arguments[1:]
+    if len(options) % 2 != 0:
+        connection.error("ERR syntax error")
+        return None
+    for name, value in zip(options[::2], options[1::2], strict=True):
+        option = name.upper()
+        if option == b"COUNT":
+            try:
+                count = int(value)
+            except ValueError:
+                connection.error("ERR value is not an integer or out of range")
+                return None
+            if count < 1:
+                connection.error("ERR syntax error")
+                return None
+        elif option == b"MATCH":
+            pattern = value
+        elif option == b"TYPE" and with_type:
+            try:
+                dtype = DBType(value.lower().decode(errors="replace"))
+            except ValueError:
+                connection.error(
+                    f"ERR unknown type name '{value.decode(errors='replace')}'"
+                )
+                return None
+        else:
+            connection.error("ERR syntax error")
+            return None
+    return cursor, count, pattern, dtype
+
+
+async def call_redis(
+    connection: RedisConnection, cmd: RedisCommand, command_line: list[bytes]
+) -> None:
+    reply_count = len(connection.replies)
+    if cmd.key_type is not None and any(
+        is_wrong_type(key, cmd.key_type) for key in cmd.get_keys(command_line)
+    ):
+        cmd.calls += 1
+        cmd.failed_calls += 1
+        connection.error(ERROR_WRONGTYPE)
+        return
+    connection.propagate = command_line if cmd.write else None
+
+    start = perf_counter_ns()
+    try:
+        await cmd.handler(connection, command_line[1:])
+    except Exception as error:
+        # a handler bug answers this command only, the connection goes on
+        logging.exception("command %s failed", cmd.name)
+        del connection.replies[reply_count:]
+        connection.propagate = None
+        message = " ".join(str(error).split()) or type(error).__name__
+        connection.error(f"ERR {message}")
+    cmd.usec += (perf_counter_ns() - start) // 1000
+    cmd.calls += 1
+
+    replies = connection.replies
+    if len(replies) > reply_count and replies[-1][:1] == b"-":
+        cmd.failed_calls += 1
+    elif connection.propagate is not None:
+        await propagate_write(connection.propagate)
+
+
+async def propagate_write(command_line: list[bytes]) -> None:
+    message = encode_redis(command_line)
+    add_dirty()
+    feed_aof(message)
+    await send_write(message)
+
+
+async def call_blocking(
+    connection: RedisConnection, cmd: RedisCommand, command_line: list[bytes]
+) -> None:
+    """Run a blocking command, cancelled if the client disconnects meanwhile"""
+    async with curio.TaskGroup(wait=any) as group:
+        await group.spawn(call_redis, connection, cmd, command_line)
+        await group.spawn(connection.wait_closed)
+    _ = group.result
+
+
+async def handle_redis(connection: RedisConnection, command_line: list[bytes]) -> None:
+    name = command_line[0].upper().decode(errors="replace")
+    cmd = REDIS_COMMANDS.get(name)
+    if cmd is None:
+        logging.info("unhandled command %s", name)
+        connection.multi_error = connection.multi_state
+        connection.error(f"ERR unknown command '{name.lower()}'")
+        return
+
+    if not cmd.check_arity(len(command_line)):
+        cmd.rejected_calls += 1
+        connection.multi_error = connection.multi_state
+        connection.error(f"ERR wrong number of arguments for '{name.lower()}' command")
+        return
+
+    if connection.sub_mode and not cmd.subscribe:
+        cmd.rejected_calls += 1
+        connection.error(
+            f"ERR Can't execute '{name}' in subscribe mode; only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING / QUIT / RESET are allowed"
+        )
+        return
+
+    if connection.multi_state and not cmd.transaction:
+        connection.multi_commands.append(command_line)
+        connection.reply(REPLY_QUEUED)
+        return
+
+    if cmd.blocking:
+        # do not hold back replies of earlier pipelined commands
+        await flush_aof()
+        await connection.flush()
+        await call_blocking(connection, cmd, command_line)
+    else:
+        await call_redis(connection, cmd, command_line)
+
+    # blocked clients are served once the whole command, or EXEC, is done
+    try:
+        for propagate in await serve_list_waiters():
+            await propagate_write(propagate)
+        await serve_stream_waiters()
+    except Exception:
+        # the reply of the command is already queued, keep the connection
+        logging.exception("serving blocked clients after %s failed", cmd.name)
+
+
+async def block_list_pop(
+    connection: RedisConnection, arguments: list[bytes], left: bool
+) -> None:
+    block_time = parse_block_time(connection, arguments[-1])
+    if block_time is None:
+        return
+
+    keys = arguments[:-1]
+    value = pop_first_list_value(keys, left)
+    if value is not None:
+        connection.propagate = [b"LPOP" if left else b"RPOP", value[0]]
+    else:
+        # the push that serves this client propagates the pop
+        connection.propagate = None
+        if not connection.deny_blocking:
+            value = await wait_list_value(keys, block_time, left)
+    connection.reply(encode_bulk_array(value) if value else REPLY_NIL_ARRAY)
+
+
+def parse_block_time(connection: RedisConnection, argument: bytes) -> float | None:
+    try:
+        block_time = float(argument)
+    except ValueError:
+        connection.error("ERR timeout is not a float or out of range")
+        return None
+    if block_time < 0:
+        connection.error("ERR timeout is negative")
+        return None
+    return block_time
+
+
+def parse_list_direction(connection: RedisConnection, argument: bytes) -> bool | None:
+    direction = argument.upper()
+    if direction not in (b"LEFT", b"RIGHT"):
+        connection.error("ERR syntax error")
+        return None
+    return direction == b"LEFT"
+
+
+@command("COMMAND", -1)
+async def command_command(connection: RedisConnection, arguments: list[bytes]) -> None:
+    option = arguments[0].upper() if arguments else b""
+    if not arguments:
+        connection.reply(
+            encode_redis([cmd.get_info() for cmd in REDIS_COMMANDS.values()])
         )
-        return (
-            send_message,
-            is_replica,
-            send_replica,
-            send_master,
-            multi_state,
-            multi_commands,
-            sub_mode,
-            new_channels,
-            send_pub,
+    elif option == b"COUNT":
+        connection.reply(encode_integer(len(REDIS_COMMANDS)))
+    elif option == b"INFO":
+        names = [arg.upper().decode(errors="replace") for arg in arguments[1:]]
+        if not names:
+            names = list(REDIS_COMMANDS)
+        connection.reply(
+            encode_redis(
+                [
+                    REDIS_COMMANDS[name].get_info() if name in REDIS_COMMANDS else ""
+                    for name in names
+                ]
+            )
         )
+    elif option == b"DOCS":
+        connection.reply(encode_redis([], nil=False))
+    else:
+        connection.error("ERR unknown subcommand for 'COMMAND' command")
 
-    match command:
-        case "QUIT":
-            send_message = REDIS_QUIT
-        case "PING":
-            if sub_mode:
-                send_message = encode_redis(["pong", ""], nil=False)
-            elif arguments:
-                if len(arguments) == 1:
-                    send_message = encode_redis(arguments[0])
-                else:
-                    send_message = encode_simple(
-                        "ERR wrong number of arguments for 'ping' command", True
-                    )
-            else:
-                send_message = encode_simple("PONG")
-        case "ECHO":
-            if len(arguments) == 1:
-                send_message = encode_redis(arguments[0])
-            else:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'echo' command", True
-                )
-        case "SET":
-            if len(arguments) < 2:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'set' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-                send_replica = encode_redis(command_line)
-            else:
-                send_message = set_value(
-                    arguments[0],
-                    arguments[1],
-                    [arg.upper() for arg in arguments[2:]],
-                )
-                send_replica = encode_redis(command_line)
-        case "GET":
-            if len(arguments) != 1:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'get' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                res = get_value(arguments[0])
-                send_message = encode_redis(res)
-        case "INCR":
-            if len(arguments) != 1:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'INCR' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                send_message = increase_value(arguments[0])
-        case "RPUSH":
-            if len(arguments) < 2:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'RPUSH' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                send_message = encode_redis(
-                    push_list_value(arguments[0], arguments[1:])
-                )
-        case "LPUSH":
-            if len(arguments) < 2:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'LPUSH' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                send_message = encode_redis(
-                    push_list_value(arguments[0], arguments[1:], left=True)
-                )
-        case "LPOP":
-            if len(arguments) < 1:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'LPOP' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                try:
-                    count = int(arguments[1]) if len(arguments) > 1 else 1
-                except ValueError:
-                    send_message = encode_simple(
-                        "ERR invalid argument for 'LPOP' command", True
-                    )
-                else:
-                    send_message = encode_redis(pop_list_value(arguments[0], count))
-        case "BLPOP":
-            if len(arguments) < 2:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'BLPOP' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                try:
-                    block_time = float(arguments[1])
-                except ValueError:
-                    send_message = encode_simple(
-                        "ERR invalid argument for 'BLPOP' command", True
-                    )
-                else:
-                    send_message = encode_redis(
-                        await pop_block_list_value(arguments[0], block_time)
-                    )
-        case "LRANGE":
-            if len(arguments) != 3:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'LRANGE' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                try:
-                    start = int(arguments[1])
-                    end = int(arguments[2])
-                except ValueError:
-                    send_message = encode_simple(
-                        "ERR invalid argument for 'LRANGE' command", True
-                    )
-                else:
-                    send_message = encode_redis(
-                        get_list_values(arguments[0], start, end), nil=False
-                    )
-        case "LLEN":
-            if len(arguments) != 1:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'LLEN' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                send_message = encode_redis(get_list_length(arguments[0]))
-        case "TYPE":
-            if len(arguments) != 1:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'TYPE' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                send_message = encode_simple(get_type(arguments[0]))
-        case "MULTI":
-            if len(arguments) != 0:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'MULTI' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                multi_state = True
-                multi_commands = []
-                send_message = encode_simple("OK")
-        case "DISCARD":
-            if len(arguments) != 0:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'DISCARD' command", True
-                )
-            elif multi_state:
-                multi_state = False
-                multi_commands = None
-                send_message = encode_simple("OK")
-            else:
-                send_message = encode_simple("ERR DISCARD without MULTI", True)
-        case "EXEC":
-            if len(arguments) != 0:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'EXEC' command", True
-                )
-            elif multi_state:
-                # TODO run transaction
-                send_messages = []
-                send_replicas = []
-                for command_line_single in multi_commands:
-                    (
-                        send_message_single,
-                        _,
-                        send_replica_single,
-                        _,
-                        _,
-                        _,
-                        _,
-                        _,
-                        _,
-                    ) = await handle_redis(command_line_single, 0)
-                    send_messages.append(send_message_single)
-                    send_replicas.append(send_replica_single)
-
-                multi_state = False
-                multi_commands = None
-                header = (
-                    IDAggregate.ARRAY + str(len(send_messages))
-                ).encode() + REDIS_SEPARATOR
-                send_message = b"".join([header, *send_messages])
-                send_replica = b"".join(send_replicas)
-            else:
-                send_message = encode_simple("ERR EXEC without MULTI", True)
-        case "XADD":
-            if (len(arguments) < 2) or (len(arguments) % 2 != 0):
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'XADD' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-                send_replica = encode_redis(command_line)
-            else:
-                values = dict(zip(arguments[2::2], arguments[3::2], strict=True))
-                send_message = set_stream_value(arguments[0], arguments[1], values)
-                send_replica = encode_redis(command_line)
-        case "XRANGE":
-            if len(arguments) < 3:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'XRANGE' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                send_message = encode_redis(
-                    get_stream_range(arguments[0], arguments[1], arguments[2])
-                )
-        case "XREAD":
-            if len(arguments) < 2:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'XREAD' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                block_time = None
-                if arguments[0].upper() == "BLOCK":
-                    block_time = int(arguments[1])
-                    arguments = arguments[2:]
-
-                if arguments[0].upper() == "STREAMS":
-                    arguments = arguments[1:]
-                    if len(arguments) % 2 == 0:
-                        middle = int(len(arguments) / 2)
-                        args = dict(
-                            zip(
-                                arguments[:middle],
-                                arguments[middle:],
-                                strict=True,
-                            )
-                        )
-                        send_message = encode_redis(
-                            await get_stream_values(args, block_time)
-                        )
-                    else:
-                        send_message = encode_simple(
-                            "ERR odd number of key/id pairs", True
-                        )
-                else:
-                    send_message = encode_simple(
-                        f"ERR unhandled option {arguments[0]}", True
-                    )
-        case "ZADD":
-            if (len(arguments) < 3) or (len(arguments) % 2 != 1):
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'ZADD' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-                send_replica = encode_redis(command_line)
-            else:
-                values = dict(
-                    zip(arguments[2::2], map(float, arguments[1::2]), strict=True)
-                )
-                send_message = encode_redis(set_zset_value(arguments[0], values))
-                send_replica = encode_redis(command_line)
-        case "ZRANK":
-            if len(arguments) != 2:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'ZRANK' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-                send_replica = encode_redis(command_line)
-            else:
-                send_message = encode_redis(get_zset_rank(arguments[0], arguments[1]))
-                send_replica = encode_redis(command_line)
-        case "ZRANGE":
-            if len(arguments) < 3:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'ZRANGE' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                try:
-                    start = int(arguments[1])
-                    end = int(arguments[2])
-                except ValueError:
-                    send_message = encode_simple(
-                        "ERR invalid argument for 'ZRANGE' command", True
-                    )
-                else:
-                    send_message = encode_redis(
-                        get_zset_range(arguments[0], start, end), nil=False
-                    )
-        case "ZSCORE":
-            if len(arguments) != 2:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'ZSCORE' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-                send_replica = encode_redis(command_line)
-            else:
-                send_message = encode_redis(get_zset_score(arguments[0], arguments[1]))
-                send_replica = encode_redis(command_line)
-        case "ZCARD":
-            if len(arguments) != 1:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'ZCARD' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-                send_replica = encode_redis(command_line)
-            else:
-                send_message = encode_redis(get_zset_length(arguments[0]))
-                send_replica = encode_redis(command_line)
-        case "ZREM":
-            if len(arguments) != 2:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'ZREM' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-                send_replica = encode_redis(command_line)
-            else:
-                send_message = encode_redis(
-                    remove_zset_member(arguments[0], arguments[1])
-                )
-                send_replica = encode_redis(command_line)
-        case "GEOADD":
-            if len(arguments) != 4:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'GEOADD' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-                send_replica = encode_redis(command_line)
-            else:
-                try:
-                    longitude = float(arguments[1])
-                    latitude = float(arguments[2])
-                except ValueError:
-                    send_message = encode_simple(
-                        "ERR invalid argument type for 'GEOADD' command", True
-                    )
-                else:
-                    if abs(longitude) > 180.0:
-                        send_message = encode_simple(
-                            "ERR invalid longitude argument for 'GEOADD' command", True
-                        )
-                    elif abs(latitude) > 85.05112878:
-                        send_message = encode_simple(
-                            "ERR invalid latitude argument for 'GEOADD' command", True
-                        )
-                    else:
-                        send_message = encode_redis(
-                            set_geo_value(
-                                arguments[0], {arguments[3]: (longitude, latitude)}
-                            )
-                        )
-                        send_replica = encode_redis(command_line)
-        case "GEOPOS":
-            if len(arguments) < 2:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'GEOPOS' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-                send_replica = encode_redis(command_line)
-            else:
-                send_message = encode_redis(get_geo_value(arguments[0], arguments[1:]))
-                send_replica = encode_redis(command_line)
-        case "GEODIST":
-            if len(arguments) != 3:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'GEODIST' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-                send_replica = encode_redis(command_line)
-            else:
-                send_message = encode_redis(
-                    get_geo_distance(arguments[0], arguments[1], arguments[2])
-                )
-                send_replica = encode_redis(command_line)
-        case "GEOSEARCH":
-            if len(arguments) < 7:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'GEOSEARCH' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-                send_replica = encode_redis(command_line)
-            elif arguments[1].upper() != "FROMLONLAT":
-                send_message = encode_simple(
-                    f"ERR unsupported option '{arguments[1].upper()}' for 'GEOSEARCH' command",
-                    True,
-                )
-            elif arguments[4].upper() != "BYRADIUS":
-                send_message = encode_simple(
-                    f"ERR unsupported option '{arguments[4].upper()}' for 'GEOSEARCH' command",
-                    True,
-                )
-            else:
-                try:
-                    longitude = float(arguments[2])
-                    latitude = float(arguments[3])
-                    radius = float(arguments[5])
-                except ValueError:
-                    send_message = encode_simple(
-                        "ERR invalid argument type for 'GEOSEARCH' command",
-                        True,
-                    )
-                else:
-                    key = arguments[0]
-                    unit = arguments[6]
-                    send_message = encode_redis(
-                        get_geo_closest(key, longitude, latitude, radius, unit),
-                        nil=False,
-                    )
-                    send_replica = encode_redis(command_line)
-        case "CONFIG":
-            if len(arguments) < 1:
-                send_message = encode_simple(
-                    "ERR missing arguments for 'CONFIG' command", True
-                )
-            else:
-                option = arguments[0].upper()
-                if option == "GET":
-                    if len(arguments) < 2:
-                        send_message = encode_simple(
-                            "ERR missing parameters for 'CONFIG GET' command", True
-                        )
-                    else:
-                        name = arguments[1]
-                        value = get_config(name)
-                        if value is not None:
-                            send_message = encode_redis([name, value])
-                        else:
-                            send_message = encode_simple(
-                                "ERR unknown 'CONFIG' parameter", True
-                            )
-                elif option == "SET":
-                    if len(arguments) < 3:
-                        send_message = encode_simple(
-                            "ERR missing parameters for 'CONFIG SET' command", True
-                        )
-                    else:
-                        name = arguments[1]
-                        value = arguments[2]
-                        set_config(name, value)
-                        send_message = encode_redis("OK")
-                else:
-                    send_message = encode_simple("ERR unhandled 'CONFIG' option", True)
-        case "SAVE":
-            if multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                save_db(get_config("dir"), get_config("dbfilename"))
-                send_message = encode_redis("OK")
-        case "KEYS":
-            if len(arguments) != 1:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'KEYS' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                res = get_keys(arguments[0])
-                send_message = encode_redis(res)
-        case "INFO":
-            if len(arguments) == 0:
-                send_message = encode_redis(get_info_str())
-            elif all(isin_info(section) for section in arguments):
-                send_message = encode_redis(
-                    "\n\n".join([get_info_str(section) for section in arguments])
-                )
-            else:
-                send_message = encode_simple(
-                    "ERR unknown section for 'INFO' command", True
-                )
-        case "REPLCONF":
-            if len(arguments) < 1:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'REPLCONF' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            elif arguments[0].upper() == "GETACK":
-                send_master = encode_redis(["REPLCONF", "ACK", str(master_offset)])
-            else:
-                send_message = encode_simple("OK")
-        case "PSYNC":
-            if multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                repl_id = get_info("replication", "master_replid")
-                if repl_id == "":
-                    send_message = encode_simple("ERR not master", True)
-                send_message = encode_simple(f"FULLRESYNC {repl_id} 0")
-                is_replica = True
-        case "WAIT":
-            if len(arguments) < 2:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'WAIT' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                exp_slaves = int(arguments[0])
-                timeout_ms = int(arguments[1])
-                num_slaves = await wait_slaves(exp_slaves, timeout_ms)
-                send_message = encode_redis(num_slaves)
-        case "SUBSCRIBE":
-            if len(arguments) < 1:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'SUBSCRIBE' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                if not sub_mode:
-                    sub_mode = True
-                new_channels = set(
-                    subbed_channels if subbed_channels is not None else []
-                )
-                for ch in arguments:
-                    new_channels.add(ch)
-                    send_message += encode_redis(["subscribe", ch, len(new_channels)])
-        case "UNSUBSCRIBE":
-            if len(arguments) < 1:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'UNSUBSCRIBE' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                if not sub_mode:
-                    sub_mode = True
-                    subbed_channels = set()
-                new_channels = set(
-                    subbed_channels if subbed_channels is not None else []
-                )
-                for ch in arguments:
-                    new_channels.discard(ch)
-                    send_message += encode_redis(["unsubscribe", ch, len(new_channels)])
-        case "PUBLISH":
-            if len(arguments) < 2:
-                send_message = encode_simple(
-                    "ERR wrong number of arguments for 'PUBLISH' command", True
-                )
-            elif multi_state:
-                multi_commands.append(command_line)
-                send_message = encode_simple("QUEUED")
-            else:
-                send_message = encode_redis(await get_clients(arguments[0]))
-                send_pub = (
-                    arguments[0],
-                    encode_redis(["message", arguments[0], " ".join(arguments[1:])]),
-                )
-        case _:
-            logging.info("unhandled command %s", command)
-
-    return (
-        send_message,
-        is_replica,
-        send_replica,
-        send_master,
-        multi_state,
-        multi_commands,
-        sub_mode,
-        new_channels,
-        send_pub,
+
+@command("QUIT", -1, subscribe=True, transaction=True)
+async def command_quit(connection: RedisConnection, _arguments: list[bytes]) -> None:
+    connection.quit = True
+    connection.reply(REPLY_OK)
+
+
+@command("PING", -1, subscribe=True)
+async def command_ping(connection: RedisConnection, arguments: list[bytes]) -> None:
+    if len(arguments) > 1:
+        connection.error("ERR wrong number of arguments for 'ping' command")
+    elif connection.sub_mode:
+        connection.reply(encode_redis([b"pong", arguments[0] if arguments else b""]))
+    elif arguments:
+        connection.reply(encode_redis(arguments[0]))
+    else:
+        connection.reply(REPLY_PONG)
+
+
+@command("ECHO", 2)
+async def command_echo(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_redis(arguments[0]))
+
+
+@command("SET", -3, write=True, keys=(1, 1, 1))
+async def command_set(connection: RedisConnection, arguments: list[bytes]) -> None:
+    reply = set_value(
+        arguments[0], arguments[1], [arg.upper() for arg in arguments[2:]]
+    )
+    connection.reply(reply)
+    # relative expires would restart when replicas or the AOF replay them
+    exp = get_expire(arguments[0])
+    if reply == REPLY_OK and exp is not None:
+        connection.propagate = [b"SET", *arguments[:2], b"PXAT", str(exp).encode()]
+
+
+@command("GET", 2, keys=(1, 1, 1), key_type=DBType.STR)
+async def command_get(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_redis(get_value(arguments[0])))
+
+
+@command("INCR", 2, write=True, keys=(1, 1, 1), key_type=DBType.STR)
+async def command_incr(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(increase_value(arguments[0]))
+
+
+@command("RPUSH", -3, write=True, keys=(1, 1, 1), key_type=DBType.LIST)
+async def command_rpush(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_integer(push_list_value(arguments[0], arguments[1:])))
+
+
+@command("LPUSH", -3, write=True, keys=(1, 1, 1), key_type=DBType.LIST)
+async def command_lpush(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(
+        encode_integer(push_list_value(arguments[0], arguments[1:], left=True))
+    )
+
+
+async def list_pop(
+    connection: RedisConnection, arguments: list[bytes], left: bool
+) -> None:
+    count = None
+    if len(arguments) > 2:
+        name = "lpop" if left else "rpop"
+        connection.error(f"ERR wrong number of arguments for '{name}' command")
+        return
+    if len(arguments) == 2:
+        try:
+            count = int(arguments[1])
+        except ValueError:
+            count = -1
+        if count < 0:
+            connection.error("ERR value is out of range, must be positive")
+            return
+
+    value = pop_list_value(arguments[0], count, left)
+    if not value:
+        connection.propagate = None
+    if isinstance(value, list):
+        connection.reply(encode_bulk_array(value))
+    elif value == "" and count is not None:
+        connection.reply(REPLY_NIL_ARRAY)
+    else:
+        connection.reply(encode_redis(value))
+
+
+@command("LPOP", -2, write=True, keys=(1, 1, 1), key_type=DBType.LIST)
+async def command_lpop(connection: RedisConnection, arguments: list[bytes]) -> None:
+    await list_pop(connection, arguments, left=True)
+
+
+@command("RPOP", -2, write=True, keys=(1, 1, 1), key_type=DBType.LIST)
+async def command_rpop(connection: RedisConnection, arguments: list[bytes]) -> None:
+    await list_pop(connection, arguments, left=False)
+
+
+@command("LMOVE", 5, write=True, keys=(1, 2, 1), key_type=DBType.LIST)
+async def command_lmove(connection: RedisConnection, arguments: list[bytes]) -> None:
+    left = parse_list_direction(connection, arguments[2])
+    to_left = parse_list_direction(connection, arguments[3])
+    if left is None or to_left is None:
+        return
+    connection.reply(
+        encode_redis(move_list_value(arguments[0], arguments[1], left, to_left))
+    )
+
+
+@command("BLPOP", -3, write=True, blocking=True, keys=(1, -2, 1), key_type=DBType.LIST)
+async def command_blpop(connection: RedisConnection, arguments: list[bytes]) -> None:
+    await block_list_pop(connection, arguments, left=True)
+
+
+@command("BRPOP", -3, write=True, blocking=True, keys=(1, -2, 1), key_type=DBType.LIST)
+async def command_brpop(connection: RedisConnection, arguments: list[bytes]) -> None:
+    await block_list_pop(connection, arguments, left=False)
+
+
+@command("BLMOVE", 6, write=True, blocking=True, keys=(1, 2, 1), key_type=DBType.LIST)
+async def command_blmove(connection: RedisConnection, arguments: list[bytes]) -> None:
+    source, destination = arguments[0], arguments[1]
+    left = parse_list_direction(connection, arguments[2])
+    to_left = parse_list_direction(connection, arguments[3])
+    block_time = parse_block_time(connection, arguments[4])
+    if left is None or to_left is None or block_time is None:
+        return
+
+    value = move_list_value(source, destination, left, to_left)
+    if value != "":
+        connection.propagate = [b"LMOVE", *arguments[:4]]
+        connection.reply(encode_bulk(value))
+        return
+
+    connection.propagate = None
+    if connection.deny_blocking:
+        connection.reply(REPLY_NIL)
+        return
+    try:
+        waited = await wait_list_value([source], block_time, left, destination, to_left)
+    except TypeError:
+        connection.error(ERROR_WRONGTYPE)
+        return
+    connection.reply(encode_bulk(waited[1]) if waited else REPLY_NIL)
+
+
+@command("LRANGE", 4, keys=(1, 1, 1), key_type=DBType.LIST)
+async def command_lrange(connection: RedisConnection, arguments: list[bytes]) -> None:
+    try:
+        start = int(arguments[1])
+        end = int(arguments[2])
+    except ValueError:
+        connection.error("ERR invalid argument for 'LRANGE' command")
+    else:
+        connection.reply(encode_bulk_array(get_list_values(arguments[0], start, end)))
+
+
+@command("LLEN", 2, keys=(1, 1, 1), key_type=DBType.LIST)
+async def command_llen(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_integer(get_list_length(arguments[0])))
+
+
+@command("TYPE", 2, keys=(1, 1, 1))
+async def command_type(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_simple(get_type(arguments[0])))
+
+
+@command("MULTI", 1, transaction=True)
+async def command_multi(connection: RedisConnection, _arguments: list[bytes]) -> None:
+    if connection.multi_state:
+        connection.error("ERR MULTI calls can not be nested")
+        return
+    connection.multi_state = True
+    connection.multi_error = False
+    connection.multi_commands = []
+    connection.reply(REPLY_OK)
+
+
+@command("DISCARD", 1, transaction=True)
+async def command_discard(connection: RedisConnection, _arguments: list[bytes]) -> None:
+    if not connection.multi_state:
+        connection.error("ERR DISCARD without MULTI")
+        return
+    connection.multi_state = False
+    connection.multi_commands = []
+    connection.reply(REPLY_OK)
+
+
+@command("EXEC", 1, transaction=True)
+async def command_exec(connection: RedisConnection, _arguments: list[bytes]) -> None:
+    if not connection.multi_state:
+        connection.error("ERR EXEC without MULTI")
+        return
+
+    multi_commands = connection.multi_commands
+    connection.multi_state = False
+    connection.multi_commands = []
+    if connection.multi_error:
+        connection.error("EXECABORT Transaction discarded because of previous errors.")
+        return
+
+    connection.reply(encode_array_header(len(multi_commands)))
+    # blocking commands answer as if timed out instead of stalling EXEC
+    connection.deny_blocking = True
+    try:
+        for command_line in multi_commands:
+            cmd = REDIS_COMMANDS[command_line[0].upper().decode(errors="replace")]
+            await call_redis(connection, cmd, command_line)
+    finally:
+        connection.deny_blocking = False
+    connection.propagate = None
+
+
+def parse_stream_trim(
+    connection: RedisConnection, arguments: list[bytes]
+) -> tuple[bytes, bytes, bool, int] | None:
+    """Parse 'MAXLEN|MINID [=|~] threshold' or reply an error"""
+    strategy = arguments[0].upper()
+    approx = False
+    pos = 1
+    if pos < len(arguments) and arguments[pos] in (b"=", b"~"):
+        approx = arguments[pos] == b"~"
+        pos += 1
+    if pos >= len(arguments):
+        connection.error("ERR syntax error")
+        return None
+    threshold = arguments[pos]
+    if strategy == b"MAXLEN" and not threshold.isdigit():
+        connection.error("ERR The MAXLEN argument must be >= 0.")
+        return None
+    return strategy, threshold, approx, pos + 1
+
+
+@command("XADD", -5, write=True, keys=(1, 1, 1), key_type=DBType.STREAM)
+async def command_xadd(connection: RedisConnection, arguments: list[bytes]) -> None:
+    key = arguments[0]
+    trim = None
+    pos = 1
+    if arguments[pos].upper() in (b"MAXLEN", b"MINID"):
+        trim = parse_stream_trim(connection, arguments[pos:])
+        if trim is None:
+            return
+        pos += trim[3]
+
+    kid, fields = arguments[pos], arguments[pos + 1 :]
+    if not fields or len(fields) % 2 != 0:
+        connection.error("ERR wrong number of arguments for 'xadd' command")
+        return
+
+    sid = set_stream_value(key, kid, fields)
+    if isinstance(sid, str):
+        connection.error(sid)
+        return
+
+    if trim is not None:
+        try:
+            trim_stream(key, trim[0], trim[1], trim[2])
+        except ValueError:
+            connection.error(
+                "ERR Invalid stream ID specified as stream command argument"
+            )
+            return
+    # replicas must store the ID generated here, not generate their own
+    connection.propagate = [b"XADD", *arguments[:pos], sid, *fields]
+    connection.reply(encode_bulk(sid))
+
+
+@command("XTRIM", -4, write=True, keys=(1, 1, 1), key_type=DBType.STREAM)
+async def command_xtrim(connection: RedisConnection, arguments: list[bytes]) -> None:
+    if arguments[1].upper() not in (b"MAXLEN", b"MINID"):
+        connection.error("ERR syntax error")
+        return
+    trim = parse_stream_trim(connection, arguments[1:])
+    if trim is None:
+        return
+    if trim[3] != len(arguments) - 1:
+        connection.error("ERR syntax error")
+        return
+
+    try:
+        removed = trim_stream(arguments[0], trim[0], trim[1], trim[2])
+    except ValueError:
+        connection.error("ERR Invalid stream ID specified as stream command argument")
+    else:
+        connection.reply(encode_integer(removed))
+
+
+@command("XLEN", 2, keys=(1, 1, 1), key_type=DBType.STREAM)
+async def command_xlen(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_integer(get_stream_length(arguments[0])))
+
+
+async def stream_range(
+    connection: RedisConnection, arguments: list[bytes], reverse: bool
+) -> None:
+    key, start, end = arguments[0], arguments[1], arguments[2]
+    if reverse:
+        start, end = end, start
+
+    count = None
+    if len(arguments) > 3:
+        if len(arguments) != 5 or arguments[3].upper() != b"COUNT":
+            connection.error("ERR syntax error")
+            return
+        try:
+            count = int(arguments[4])
+        except ValueError:
+            connection.error("ERR value is not an integer or out of range")
+            return
+
+    try:
+        entries = get_stream_range(key, start, end, count, reverse)
+    except ValueError:
+        connection.error("ERR Invalid stream ID specified as stream command argument")
+    else:
+        connection.reply(encode_redis(entries, nil=False))
+
+
+@command("XRANGE", -4, keys=(1, 1, 1), key_type=DBType.STREAM)
+async def command_xrange(connection: RedisConnection, arguments: list[bytes]) -> None:
+    await stream_range(connection, arguments, reverse=False)
+
+
+@command("XREVRANGE", -4, keys=(1, 1, 1), key_type=DBType.STREAM)
+async def command_xrevrange(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    await stream_range(connection, arguments, reverse=True)
+
+
+@command("XREAD", -4, blocking=True, keys=(0, 0, 0))
+async def command_xread(connection: RedisConnection, arguments: list[bytes]) -> None:
+    block_time = None
+    count = None
+    while arguments and arguments[0].upper() in (b"BLOCK", b"COUNT"):
+        option = arguments[0].upper()
+        try:
+            value = int(arguments[1])
+        except (ValueError, IndexError):
+            connection.error("ERR value is not an integer or out of range")
+            return
+        if option == b"BLOCK":
+            block_time = value
+        else:
+            count = value
+        arguments = arguments[2:]
+
+    if not arguments or arguments[0].upper() != b"STREAMS":
+        connection.error("ERR syntax error")
+        return
+
+    arguments = arguments[1:]
+    if len(arguments) % 2 != 0:
+        connection.error(
+            "ERR Unbalanced 'xread' list of streams: for each stream key an ID or '$' must be specified."
+        )
+        return
+
+    middle = len(arguments) // 2
+    if any(is_wrong_type(key, DBType.STREAM) for key in arguments[:middle]):
+        connection.error(ERROR_WRONGTYPE)
+        return
+    args = dict(zip(arguments[:middle], arguments[middle:], strict=True))
+    if connection.deny_blocking:
+        block_time = None
+    try:
+        entries = await get_stream_values(args, block_time, count)
+    except ValueError:
+        connection.error("ERR Invalid stream ID specified as stream command argument")
+    else:
+        connection.reply(encode_redis(entries) if entries else REPLY_NIL_ARRAY)
+
+
+def parse_score(argument: bytes) -> float:
+    """A float score, float() also takes 'nan' which is none"""
+    score = float(argument)
+    if math.isnan(score):
+        raise ValueError(argument)
+    return score
+
+
+def parse_zadd_flags(
+    connection: RedisConnection, arguments: list[bytes]
+) -> tuple[bool, bool, bool, list[bytes]] | None:
+    """Leading NX, XX and CH flags, then the remaining arguments"""
+    flags = {b"NX": False, b"XX": False, b"CH": False}
+    pos = 0
+    while pos < len(arguments) and arguments[pos].upper() in flags:
+        flags[arguments[pos].upper()] = True
+        pos += 1
+    if flags[b"NX"] and flags[b"XX"]:
+        connection.error("ERR XX and NX options at the same time are not compatible")
+        return None
+    return flags[b"NX"], flags[b"XX"], flags[b"CH"], arguments[pos:]
+
+
+@command("ZADD", -4, write=True, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_zadd(connection: RedisConnection, arguments: list[bytes]) -> None:
+    flags = parse_zadd_flags(connection, arguments[1:])
+    if flags is None:
+        return
+    nx, xx, ch, pairs = flags
+    if not pairs or len(pairs) % 2 != 0:
+        connection.error("ERR syntax error")
+        return
+    try:
+        values = dict(zip(pairs[1::2], map(parse_score, pairs[0::2]), strict=True))
+    except ValueError:
+        connection.error("ERR value is not a valid float")
+        return
+    connection.reply(encode_integer(set_zset_value(arguments[0], values, nx, xx, ch)))
+
+
+@command("ZRANK", 3, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_zrank(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_redis(get_zset_rank(arguments[0], arguments[1])))
+
+
+@command("ZRANGE", -4, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_zrange(connection: RedisConnection, arguments: list[bytes]) -> None:
+    try:
+        start = int(arguments[1])
+        end = int(arguments[2])
+    except ValueError:
+        connection.error("ERR invalid argument for 'ZRANGE' command")
+        return
+
+    options = [option.upper() for option in arguments[3:]]
+    if options not in ([], [b"WITHSCORES"]):
+        connection.error("ERR syntax error")
+        return
+    withscores = bool(options)
+    connection.reply(
+        encode_bulk_array(get_zset_range(arguments[0], start, end, withscores))
+    )
+
+
+def parse_range_options(
+    connection: RedisConnection, options: list[bytes], with_scores: bool = True
+) -> tuple[int, int, bool] | None:
+    """Parse '[WITHSCORES] [LIMIT offset count]' or reply an error"""
+    offset, count, withscores = 0, -1, False
+    pos = 0
+    while pos < len(options):
+        option = options[pos].upper()
+        if option == b"WITHSCORES" and with_scores:
+            withscores = True
+            pos += 1
+        elif option == b"LIMIT" and pos + 2 < len(options):
+            try:
+                offset = int(options[pos + 1])
+                count = int(options[pos + 2])
+            except ValueError:
+                connection.error("ERR value is not an integer or out of range")
+                return None
+            pos += 3
+        else:
+            connection.error("ERR syntax error")
+            return None
+    return offset, count, withscores
+
+
+def parse_score_bound(argument: bytes) -> tuple[float, bool]:
+    if argument.startswith(b"("):
+        return parse_score(argument[1:]), True
+    return parse_score(argument), False
+
+
+def parse_lex_bound(argument: bytes) -> tuple[bytes | None, bool]:
+    if argument in (b"-", b"+"):
+        return None, False
+    if argument[:1] not in (b"[", b"("):
+        raise ValueError(argument)
+    return argument[1:], argument.startswith(b"(")
+
+
+async def zset_range_by_score(
+    connection: RedisConnection, arguments: list[bytes], reverse: bool
+) -> None:
+    key, min_arg, max_arg = arguments[0], arguments[1], arguments[2]
+    if reverse:
+        min_arg, max_arg = max_arg, min_arg
+    try:
+        min_score = parse_score_bound(min_arg)
+        max_score = parse_score_bound(max_arg)
+    except ValueError:
+        connection.error("ERR min or max is not a float")
+        return
+
+    range_options = parse_range_options(connection, arguments[3:])
+    if range_options is None:
+        return
+    offset, count, withscores = range_options
+    connection.reply(
+        encode_bulk_array(
+            get_zset_range_by_score(
+                key, min_score, max_score, reverse, offset, count, withscores
+            )
+        )
+    )
+
+
+async def zset_range_by_lex(
+    connection: RedisConnection, arguments: list[bytes], reverse: bool
+) -> None:
+    key, min_arg, max_arg = arguments[0], arguments[1], arguments[2]
+    if reverse:
+        min_arg, max_arg = max_arg, min_arg
+    try:
+        min_member = parse_lex_bound(min_arg)
+        max_member = parse_lex_bound(max_arg)
+    except ValueError:
+        connection.error("ERR min or max not valid string range item")
+        return
+
+    range_options = parse_range_options(connection, arguments[3:], with_scores=False)
+    if range_options is None:
+        return
+    offset, count, _ = range_options
+    if min_arg == b"+" or max_arg == b"-":
+        connection.reply(REPLY_EMPTY_ARRAY)
+        return
+    connection.reply(
+        encode_bulk_array(
+            get_zset_range_by_lex(key, min_member, max_member, reverse, offset, count)
+        )
+    )
+
+
+@command("ZRANGEBYSCORE", -4, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_zrangebyscore(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    await zset_range_by_score(connection, arguments, reverse=False)
+
+
+@command("ZREVRANGEBYSCORE", -4, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_zrevrangebyscore(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    await zset_range_by_score(connection, arguments, reverse=True)
+
+
+@command("ZRANGEBYLEX", -4, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_zrangebylex(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    await zset_range_by_lex(connection, arguments, reverse=False)
+
+
+@command("ZREVRANGEBYLEX", -4, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_zrevrangebylex(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    await zset_range_by_lex(connection, arguments, reverse=True)
+
+
+@command("ZSCORE", 3, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_zscore(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_redis(get_zset_score(arguments[0], arguments[1])))
+
+
+@command("ZCARD", 2, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_zcard(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_integer(get_zset_length(arguments[0])))
+
+
+@command("ZREM", 3, write=True, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_zrem(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_integer(remove_zset_member(arguments[0], arguments[1])))
+
+
+@command("ZSCAN", -3, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_zscan(connection: RedisConnection, arguments: list[bytes]) -> None:
+    scan_arguments = parse_scan_arguments(connection, arguments[1:])
+    if scan_arguments is None:
+        return
+    cursor, count, pattern, _ = scan_arguments
+    next_cursor, members = scan_zset(arguments[0], cursor, count, pattern)
+    connection.reply(encode_array_header(2))
+    connection.reply(encode_bulk(str(next_cursor).encode()))
+    connection.reply(encode_bulk_array(members))
+
+
+@command("GEOADD", -5, write=True, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_geoadd(connection: RedisConnection, arguments: list[bytes]) -> None:
+    flags = parse_zadd_flags(connection, arguments[1:])
+    if flags is None:
+        return
+    nx, xx, ch, triplets = flags
+    if not triplets or len(triplets) % 3 != 0:
+        connection.error("ERR syntax error")
+        return
+
+    # validate every triplet before touching the key
+    values = {}
+    for pos in range(0, len(triplets), 3):
+        try:
+            longitude = parse_score(triplets[pos])
+            latitude = parse_score(triplets[pos + 1])
+        except ValueError:
+            connection.error("ERR invalid argument type for 'GEOADD' command")
+            return
+
+        if abs(longitude) > 180.0:
+            connection.error("ERR invalid longitude argument for 'GEOADD' command")
+            return
+        if abs(latitude) > 85.05112878:
+            connection.error("ERR invalid latitude argument for 'GEOADD' command")
+            return
+        values[triplets[pos + 2]] = (longitude, latitude)
+
+    connection.reply(encode_integer(set_geo_value(arguments[0], values, nx, xx, ch)))
+
+
+@command("GEOPOS", -2, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_geopos(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_redis(get_geo_value(arguments[0], arguments[1:])))
+
+
+@command("GEODIST", 4, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_geodist(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(
+        encode_redis(get_geo_distance(arguments[0], arguments[1], arguments[2]))
+    )
+
+
+def parse_geo_shape(
+    connection: RedisConnection, arguments: list[bytes]
+) -> tuple[float | None, tuple[float, float] | None, float] | None:
+    """Parse 'radius unit' or 'width height unit' to meters or reply an error"""
+    unit = DISTANCE_UNITS.get(arguments[-1].lower().decode(errors="replace"))
+    if unit is None:
+        connection.error("ERR unsupported unit provided. please use M, KM, FT, MI")
+        return None
+    try:
+        sizes = [parse_score(argument) * unit for argument in arguments[:-1]]
+    except ValueError:
+        connection.error("ERR need numeric radius")
+        return None
+    # inf, or a size that overflows in meters, would match every member
+    if not all(map(math.isfinite, sizes)):
+        connection.error("ERR radius must be finite")
+        return None
+    if any(size < 0 for size in sizes):
+        connection.error("ERR radius cannot be negative")
+        return None
+    if len(sizes) == 1:
+        return sizes[0], None, unit
+    return None, (sizes[0], sizes[1]), unit
+
+
+async def geo_search(
+    connection: RedisConnection,
+    key: bytes,
+    center: bytes | tuple[float, float] | None,
+    shape: tuple[float | None, tuple[float, float] | None, float] | None,
+    options: list[bytes],
+) -> None:
+    count = None
+    count_any = False
+    order = None
+    withdist = withhash = withcoord = False
+    pos = 0
+    while pos < len(options):
+        option = options[pos].upper()
+        pos += 1
+        if option in (b"ASC", b"DESC"):
+            order = option.decode()
+        elif option == b"WITHDIST":
+            withdist = True
+        elif option == b"WITHHASH":
+            withhash = True
+        elif option == b"WITHCOORD":
+            withcoord = True
+        elif option == b"COUNT" and pos < len(options):
+            try:
+                count = int(options[pos])
+            except ValueError:
+                connection.error("ERR value is not an integer or out of range")
+                return
+            if count <= 0:
+                connection.error("ERR COUNT must be > 0")
+                return
+            pos += 1
+            if pos < len(options) and options[pos].upper() == b"ANY":
+                count_any = True
+                pos += 1
+        else:
+            connection.error("ERR syntax error")
+            return
+
+    if center is None or shape is None:
+        connection.error(
+            "ERR exactly one of FROMMEMBER or FROMLONLAT and one of BYRADIUS or BYBOX must be provided"
+        )
+        return
+    if isinstance(center, bytes):
+        coords = get_geo_coords(key, center)
+        if coords is None:
+            connection.error("ERR could not decode requested zset member")
+            return
+        center = coords
+
+    radius, box, unit = shape
+    found = search_geo(key, center[0], center[1], radius, box, count, count_any, order)
+    if not (withdist or withhash or withcoord):
+        connection.reply(encode_bulk_array([place for place, *_ in found]))
+        return
+
+    items = []
+    for place, distance, score, (longitude, latitude) in found:
+        item: list[bytes | int | list[bytes]] = [place]
+        if withdist:
+            item.append(f"{distance / unit:.4f}".encode())
+        if withhash:
+            item.append(score)
+        if withcoord:
+            item.append([str(longitude).encode(), str(latitude).encode()])
+        items.append(item)
+    connection.reply(encode_redis(items, nil=False))
+
+
+def parse_geo_lonlat(
+    connection: RedisConnection, arguments: list[bytes]
+) -> tuple[float, float] | None:
+    try:
+        longitude = float(arguments[0])
+        latitude = float(arguments[1])
+    except ValueError:
+        connection.error("ERR value is not a valid float")
+        return None
+    if abs(longitude) > 180.0 or abs(latitude) > 85.05112878:
+        connection.error(
+            f"ERR invalid longitude,latitude pair {longitude:.6f},{latitude:.6f}"
+        )
+        return None
+    return longitude, latitude
+
+
+@command("GEOSEARCH", -7, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_geosearch(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    key = arguments[0]
+    center = None
+    shape = None
+    options = []
+    pos = 1
+    while pos < len(arguments):
+        option = arguments[pos].upper()
+        if option == b"FROMMEMBER" and pos + 1 < len(arguments):
+            center = arguments[pos + 1]
+            pos += 2
+        elif option == b"FROMLONLAT" and pos + 2 < len(arguments):
+            center = parse_geo_lonlat(connection, arguments[pos + 1 : pos + 3])
+            if center is None:
+                return
+            pos += 3
+        elif option == b"BYRADIUS" and pos + 2 < len(arguments):
+            shape = parse_geo_shape(connection, arguments[pos + 1 : pos + 3])
+            if shape is None:
+                return
+            pos += 3
+        elif option == b"BYBOX" and pos + 3 < len(arguments):
+            shape = parse_geo_shape(connection, arguments[pos + 1 : pos + 4])
+            if shape is None:
+                return
+            pos += 4
+        else:
+            options.append(arguments[pos])
+            pos += 1
+    await geo_search(connection, key, center, shape, options)
+
+
+@command("GEORADIUS", -6, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_georadius(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    center = parse_geo_lonlat(connection, arguments[1:3])
+    if center is None:
+        return
+    shape = parse_geo_shape(connection, arguments[3:5])
+    if shape is None:
+        return
+    await geo_search(connection, arguments[0], center, shape, arguments[5:])
+
+
+@command("GEORADIUSBYMEMBER", -5, keys=(1, 1, 1), key_type=DBType.ZSET)
+async def command_georadiusbymember(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    shape = parse_geo_shape(connection, arguments[2:4])
+    if shape is None:
+        return
+    await geo_search(connection, arguments[0], arguments[1], shape, arguments[4:])
+
+
+@command("CONFIG", -2)
+async def command_config(connection: RedisConnection, arguments: list[bytes]) -> None:
+    option = arguments[0].upper()
+    if option == b"GET":
+        if len(arguments) < 2:
+            connection.error("ERR missing parameters for 'CONFIG GET' command")
+            return
+        name = arguments[1].decode(errors="replace")
+        value = get_config(name)
+        if value is not None:
+            connection.reply(encode_redis([name, value]))
+        else:
+            connection.error("ERR unknown 'CONFIG' parameter")
+    elif option == b"SET":
+        if len(arguments) < 3:
+            connection.error("ERR missing parameters for 'CONFIG SET' command")
+            return
+        name = arguments[1].decode(errors="replace")
+        value = arguments[2].decode(errors="replace")
+        set_config(name, value)
+        connection.reply(REPLY_OK)
+    else:
+        connection.error("ERR unhandled 'CONFIG' option")
+
+
+@command("SAVE", 1)
+async def command_save(connection: RedisConnection, _arguments: list[bytes]) -> None:
+    error = save()
+    if error is not None:
+        connection.error(error)
+        return
+    connection.reply(REPLY_OK)
+
+
+@command("BGSAVE", -1)
+async def command_bgsave(connection: RedisConnection, arguments: list[bytes]) -> None:
+    schedule = False
+    if arguments:
+        if len(arguments) > 1 or arguments[0].upper() != b"SCHEDULE":
+            connection.error("ERR syntax error")
+            return
+        schedule = True
+
+    if schedule and is_bgsave_running():
+        schedule_bgsave()
+        connection.reply(encode_simple("Background saving scheduled"))
+        return
+    error = await start_bgsave()
+    if error is not None:
+        connection.error(error)
+        return
+    connection.reply(encode_simple("Background saving started"))
+
+
+@command("BGREWRITEAOF", 1)
+async def command_bgrewriteaof(
+    connection: RedisConnection, _arguments: list[bytes]
+) -> None:
+    error = await start_rewrite_aof()
+    if error is not None:
+        connection.error(error)
+        return
+    connection.reply(encode_simple("Background append only file rewriting started"))
+
+
+@command("LASTSAVE", 1)
+async def command_lastsave(
+    connection: RedisConnection, _arguments: list[bytes]
+) -> None:
+    connection.reply(encode_integer(get_lastsave()))
+
+
+@command("KEYS", 2)
+async def command_keys(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_bulk_array(get_keys(arguments[0])))
+
+
+@command("SCAN", -2)
+async def command_scan(connection: RedisConnection, arguments: list[bytes]) -> None:
+    scan_arguments = parse_scan_arguments(connection, arguments, with_type=True)
+    if scan_arguments is None:
+        return
+    cursor, count, pattern, dtype = scan_arguments
+    next_cursor, keys = scan_keys(cursor, count, pattern, dtype)
+    connection.reply(encode_array_header(2))
+    connection.reply(encode_bulk(str(next_cursor).encode()))
+    connection.reply(encode_bulk_array(keys))
+
+
+@command("INFO", -1)
+async def command_info(connection: RedisConnection, arguments: list[bytes]) -> None:
+    sections = [arg.decode(errors="replace") for arg in arguments]
+    if len(sections) == 0:
+        connection.reply(encode_redis(get_info_str()))
+    elif all(isin_info(section) for section in sections):
+        connection.reply(
+            encode_redis("\n\n".join([get_info_str(section) for section in sections]))
+        )
+    else:
+        connection.error("ERR unknown section for 'INFO' command")
+
+
+@command("REPLCONF", -2)
+async def command_replconf(connection: RedisConnection, arguments: list[bytes]) -> None:
+    if arguments[0].upper() == b"GETACK":
+        connection.reply_master(
+            encode_redis(["REPLCONF", "ACK", str(connection.master_offset)])
+        )
+        return
+
+    for option, value in zip(arguments[::2], arguments[1::2], strict=False):
+        if option.lower() == b"capa":
+            connection.replica_capa.add(value.lower())
+    connection.reply(REPLY_OK)
+
+
+@command("PSYNC", -3)
+async def command_psync(connection: RedisConnection, arguments: list[bytes]) -> None:
+    if get_info("replication", "master_replid") == "":
+        connection.error("ERR not master")
+        return
+    try:
+        offset = int(arguments[1])
+    except ValueError:
+        connection.error("ERR value is not an integer or out of range")
+        return
+    replid = arguments[0].decode(errors="replace")
+    connection.reply(register_slave(connection, replid, offset))
+    connection.is_replica = True
+
+
+@command("WAIT", 3, blocking=True)
+async def command_wait(connection: RedisConnection, arguments: list[bytes]) -> None:
+    try:
+        exp_slaves = int(arguments[0])
+        timeout_ms = int(arguments[1])
+    except ValueError:
+        connection.error("ERR value is not an integer or out of range")
+        return
+    if timeout_ms < 0:
+        connection.error("ERR timeout is negative")
+        return
+    num_slaves = await wait_slaves(
+        exp_slaves, timeout_ms, block=not connection.deny_blocking
     )
+    connection.reply(encode_integer(num_slaves))
+
+
+def get_sub_count(connection: RedisConnection) -> int:
+    return len(connection.subbed_channels) + len(connection.subbed_patterns)
+
+
+def get_ssub_count(connection: RedisConnection) -> int:
+    return len(connection.subbed_shard_channels)
+
+
+async def subscribe(
+    connection: RedisConnection,
+    arguments: list[bytes],
+    kind: bytes,
+    subbed: set[bytes],
+    sub: Callable[[bytes, RedisConnection], Awaitable[None]],
+    get_count: Callable[[RedisConnection], int],
+) -> None:
+    connection.sub_mode = True
+    for name in arguments:
+        if name not in subbed:
+            subbed.add(name)
+            await sub(name, connection)
+        connection.reply(encode_redis([kind, name, get_count(connection)]))
+
+
+async def unsubscribe(
+    connection: RedisConnection,
+    arguments: list[bytes],
+    kind: bytes,
+    subbed: set[bytes],
+    unsub: Callable[[bytes, RedisConnection], Awaitable[None]],
+    get_count: Callable[[RedisConnection], int],
+) -> None:
+    connection.sub_mode = True
+    names = arguments or list(subbed)
+    if not names:
+        # nothing to leave, still one reply with a nil name like redis
+        connection.reply(encode_redis([kind, "", get_count(connection)]))
+    for name in names:
+        if name in subbed:
+            subbed.discard(name)
+            await unsub(name, connection)
+        connection.reply(encode_redis([kind, name, get_count(connection)]))
+
+
+@command("SUBSCRIBE", -2, subscribe=True)
+async def command_subscribe(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    await subscribe(
+        connection,
+        arguments,
+        b"subscribe",
+        connection.subbed_channels,
+        sub_channel,
+        get_sub_count,
+    )
+
+
+@command("UNSUBSCRIBE", -1, subscribe=True)
+async def command_unsubscribe(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    await unsubscribe(
+        connection,
+        arguments,
+        b"unsubscribe",
+        connection.subbed_channels,
+        unsub_channel,
+        get_sub_count,
+    )
+
+
+@command("PSUBSCRIBE", -2, subscribe=True)
+async def command_psubscribe(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    await subscribe(
+        connection,
+        arguments,
+        b"psubscribe",
+        connection.subbed_patterns,
+        psub_pattern,
+        get_sub_count,
+    )
+
+
+@command("PUNSUBSCRIBE", -1, subscribe=True)
+async def command_punsubscribe(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    await unsubscribe(
+        connection,
+        arguments,
+        b"punsubscribe",
+        connection.subbed_patterns,
+        punsub_pattern,
+        get_sub_count,
+    )
+
+
+async def ssub_channel(channel: bytes, connection: RedisConnection) -> None:
+    await sub_channel(channel, connection, shard=True)
+
+
+async def sunsub_channel(channel: bytes, connection: RedisConnection) -> None:
+    await unsub_channel(channel, connection, shard=True)
+
+
+@command("SSUBSCRIBE", -2, subscribe=True, keys=(1, -1, 1))
+async def command_ssubscribe(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    await subscribe(
+        connection,
+        arguments,
+        b"ssubscribe",
+        connection.subbed_shard_channels,
+        ssub_channel,
+        get_ssub_count,
+    )
+
+
+@command("SUNSUBSCRIBE", -1, subscribe=True, keys=(1, -1, 1))
+async def command_sunsubscribe(
+    connection: RedisConnection, arguments: list[bytes]
+) -> None:
+    await unsubscribe(
+        connection,
+        arguments,
+        b"sunsubscribe",
+        connection.subbed_shard_channels,
+        sunsub_channel,
+        get_ssub_count,
+    )
+
+
+@command("PUBLISH", 3)
+async def command_publish(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(encode_integer(await pub_message(arguments[0], arguments[1])))
+
+
+@command("SPUBLISH", 3, keys=(1, 1, 1))
+async def command_spublish(connection: RedisConnection, arguments: list[bytes]) -> None:
+    connection.reply(
+        encode_integer(await pub_message(arguments[0], arguments[1], shard=True))
+    )
+
+
+@command("PUBSUB", -2)
+async def command_pubsub(connection: RedisConnection, arguments: list[bytes]) -> None:
+    option = arguments[0].upper()
+    if option in (b"CHANNELS", b"SHARDCHANNELS") and len(arguments) <= 2:
+        pattern = arguments[1] if len(arguments) == 2 else None
+        channels = get_channels(pattern, shard=option == b"SHARDCHANNELS")
+        connection.reply(encode_redis(channels, nil=False))
+    elif option in (b"NUMSUB", b"SHARDNUMSUB"):
+        shard = option == b"SHARDNUMSUB"
+        counts: list[bytes | int] = []
+        for channel in arguments[1:]:
+            counts.extend([channel, get_clients(channel, shard)])
+        connection.reply(encode_redis(counts, nil=False))
+    elif option == b"NUMPAT" and len(arguments) == 1:
+        connection.reply(encode_integer(get_pattern_count()))
+    else:
+        connection.error(
+            f"ERR unknown subcommand or wrong number of arguments for '{arguments[0].decode(errors='replace')}'"
+        )
@@ -1,73 +1,112 @@
 import logging
+from typing import Any
 
 from lib import curio
 
-from .database import read_db
-from .rdb.data import decode_data
-from .resp import decode_redis, encode_redis
+from .buffer import RecvBuffer
+from .database import replace_db
+from .rdb import RDBReader
+from .rdb.data import decode_data_header
+from .resp import RESP_PENDING, RespParser, encode_redis
+
+
+async def recv_reply(sock: curio.io.Socket, recv_buffer: RecvBuffer) -> Any:
+    parser = RespParser()
+    while True:
+        recv_message = parser.parse(recv_buffer)
+        if recv_message is not RESP_PENDING:
+            return recv_message
+        if await recv_buffer.recv(sock) == 0:
+            raise ConnectionError("connection closed by master")
+
+
+def expect_reply(recv_message: Any, expected: str) -> None:
+    if recv_message != expected:
+        raise ConnectionError(f"unexpected reply {recv_message!r}, not {expected}")
 
 
 async def send_handshake(
-    sock: curio.io.Socket, slave_port: int
-) -> tuple[str, int, bytes]:
+    sock: curio.io.Socket,
+    slave_port: int,
+    recv_buffer: RecvBuffer,
+    master_id: str = "?",
+    master_offset: int = -1,
+) -> tuple[str, int]:
+    """Sync with the master, returns its replid and the offset to go on from"""
     message = encode_redis(["PING"])
     logging.info("Sending %s", repr(message))
     await sock.sendall(message)
 
-    data = await sock.recv(100)
-    logging.info("Received %s", repr(data))
-    recv_message, pos = decode_redis(data)
-    assert pos > 0, data
-    assert recv_message == "PONG", recv_message
-    data = data[pos:]
+    recv_message = await recv_reply(sock, recv_buffer)
+    logging.info("Received %s", repr(recv_message))
+    expect_reply(recv_message, "PONG")
 
     message = encode_redis(["REPLCONF", "listening-port", str(slave_port)])
     logging.info("Sending %s", repr(message))
     await sock.sendall(message)
 
-    data += await sock.recv(100)
-    logging.info("Received %s", repr(data))
-    recv_message, pos = decode_redis(data)
-    assert pos > 0, data
-    assert recv_message == "OK", recv_message
-    data = data[pos:]
+    recv_message = await recv_reply(sock, recv_buffer)
+    logging.info("Received %s", repr(recv_message))
+    expect_reply(recv_message, "OK")
 
-    message = encode_redis(["REPLCONF", "capa", "psync2"])
+    message = encode_redis(["REPLCONF", "capa", "eof", "capa", "psync2"])
     logging.info("Sending %s", repr(message))
     await sock.sendall(message)
 
-    data += await sock.recv(100)
-    logging.info("Received %s", repr(data))
-    recv_message, pos = decode_redis(data)
-    assert pos > 0, data
-    assert recv_message == "OK", recv_message
-    data = data[pos:]
+    recv_message = await recv_reply(sock, recv_buffer)
+    logging.info("Received %s", repr(recv_message))
+    expect_reply(recv_message, "OK")
 
-    message = encode_redis(["PSYNC", "?", "-1"])
+    # a known master is asked for the stream after what was processed
+    psync_offset = master_offset + 1 if master_id != "?" else -1
+    message = encode_redis(["PSYNC", master_id, str(psync_offset)])
     logging.info("Sending %s", repr(message))
     await sock.sendall(message)
 
-    data += await sock.recv(100)
-    logging.info("Received %s", repr(data))
-    recv_message, pos = decode_redis(data)
-    assert pos > 0, data
-    command = recv_message.split(" ")
-    assert len(command) == 3, recv_message
-    assert command[0] == "FULLRESYNC", recv_message
-    data = data[pos:]
+    recv_message = await recv_reply(sock, recv_buffer)
+    logging.info("Received %s", repr(recv_message))
+    command = recv_message.split(" ") if isinstance(recv_message, str) else []
+    if command[:1] == ["CONTINUE"]:
+        return command[1] if len(command) > 1 else master_id, master_offset
+    if len(command) != 3 or command[0] != "FULLRESYNC":
+        raise ConnectionError(f"unexpected reply {recv_message!r} to PSYNC")
     master_id, master_offset = command[1], int(command[2])
 
-    data += await sock.recv(100)
-    logging.info("Received %d %s", len(data), repr(data))
+    await recv_rdb(sock, recv_buffer)
+
+    return master_id, master_offset
+
+
+async def recv_rdb(sock: curio.io.Socket, recv_buffer: RecvBuffer) -> None:
+    """Load the snapshot record by record as it arrives"""
+    while True:
+        size, pos = decode_data_header(recv_buffer.data, recv_buffer.start)
+        if size is not None:
+            recv_buffer.consume(pos - recv_buffer.start)
+            break
+        if await recv_buffer.recv(sock) == 0:
+            raise ConnectionError("connection closed by master")
 
-    rdb_data = b""
+    reader = RDBReader()
+    received = 0
     while True:
-        rdb_data, pos = decode_data(data)
-        if pos > 0:
-            data = data[pos:]
+        pos = reader.parse(recv_buffer.data, recv_buffer.start)
+        received += pos - recv_buffer.start
+        recv_buffer.consume(pos - recv_buffer.start)
+        if reader.done:
             break
-        data += await sock.recv(100)
+        if await recv_buffer.recv(sock) == 0:
+            raise ConnectionError("connection closed by master")
 
-    read_db(rdb_data)
+    if isinstance(size, bytes):
+        # with capa eof the payload ends with the mark sent ahead of it
+        while len(recv_buffer) < len(size):
+            if await recv_buffer.recv(sock) == 0:
+                raise ConnectionError("connection closed by master")
+        if recv_buffer.take(len(size)) != size:
+            raise ConnectionError("RDB payload does not end with its EOF mark")
+    elif received != size:
+        raise ConnectionError(f"RDB payload of {received} bytes, expected {size}")
+    logging.info("Received RDB %d", received)
 
-    return master_id, master_offset, data
+    replace_db(reader.meta, reader.data, reader.dexp)
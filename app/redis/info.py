@@ -1,31 +1,39 @@
+from collections.abc import Callable
+
 REDIS_INFO: dict[str, dict[str, str | int]] = {"replication": {}}
+REDIS_INFO_PROVIDERS: dict[str, list[Callable[[], dict[str, str | int]]]] = {}
 
 
 def get_info(section: str, key: str) -> str | int:
     return REDIS_INFO.get(section, {}).get(key, "")
 
 
+def get_info_section(section: str) -> dict[str, str | int]:
+    section = section.lower()
+    values = dict(REDIS_INFO.get(section, {}))
+    for provider in REDIS_INFO_PROVIDERS.get(section, []):
+        values.update(provider())
+    return values
+
+
 def get_info_str(section: str | None = None) -> str:
     if section is None:
         return "\n\n".join(
-            [
-                f"# {section.title()}\n"
-                + "\n".join(
-                    [
-                        f"{key}:{value}"
-                        for key, value in REDIS_INFO[section.lower()].items()
-                    ]
-                )
-                for section in REDIS_INFO
-            ]
+            get_info_str(section)
+            for section in dict.fromkeys([*REDIS_INFO, *REDIS_INFO_PROVIDERS])
         )
     return f"# {section.title()}\n" + "\n".join(
-        [f"{key}:{value}" for key, value in REDIS_INFO[section.lower()].items()]
+        [f"{key}:{value}" for key, value in get_info_section(section).items()]
     )
 
 
 def isin_info(section: str) -> bool:
-    return section.lower() in REDIS_INFO
+    return section.lower() in REDIS_INFO or section.lower() in REDIS_INFO_PROVIDERS
+
+
+def register_info(section: str, provider: Callable[[], dict[str, str | int]]) -> None:
+    """Add fields computed when the section is read, after the set ones"""
+    REDIS_INFO_PROVIDERS.setdefault(section, []).append(provider)
 
 
 def set_info(section: str, key: str, value: str | int) -> None:
@@ -0,0 +1,149 @@
+import re
+from collections.abc import Callable
+from functools import lru_cache
+
+REDIS_PATTERN_CACHE_SIZE = 1024
+GLOB_SPECIAL = frozenset(b"*?[\\")
+
+
+def translate_pattern(pattern: bytes) -> bytes:
+    """Translate a redis glob-style pattern into a regular expression"""
+    regex = []
+    pos = 0
+    while pos < len(pattern):
+        char = pattern[pos : pos + 1]
+        pos += 1
+        if char == b"*":
+            regex.append(b".*")
+        elif char == b"?":
+            regex.append(b".")
+        elif char == b"\\" and pos < len(pattern):
+            regex.append(re.escape(pattern[pos : pos + 1]))
+            pos += 1
+        elif char == b"[":
+            negate = pattern[pos : pos + 1] == b"^"
+            if negate:
+                pos += 1
+            items = []
+            # like stringmatchlen, an unterminated class ends with the pattern
+            while pos < len(pattern) and pattern[pos : pos + 1] != b"]":
+                if pattern[pos : pos + 1] == b"\\" and pos + 1 < len(pattern):
+                    pos += 1
+                    items.append(re.escape(pattern[pos : pos + 1]))
+                    pos += 1
+                elif pattern[pos + 1 : pos + 2] == b"-" and pos + 2 < len(pattern):
+                    start, end = pattern[pos], pattern[pos + 2]
+                    if start > end:
+                        start, end = end, start
+                    items.append(
+                        re.escape(bytes([start])) + b"-" + re.escape(bytes([end]))
+                    )
+                    pos += 3
+                else:
+                    items.append(re.escape(pattern[pos : pos + 1]))
+                    pos += 1
+            pos += 1
+            if items:
+                regex.append(b"[" + (b"^" if negate else b"") + b"".join(items) + b"]")
+            elif negate:
+                regex.append(b".")
+            else:
+                regex.append(b"(?!)")
+        else:
+            regex.append(re.escape(char))
+    return b"".join(regex)
+
+
+def make_matcher(pattern: bytes) -> Callable[[bytes], bool]:
+    if pattern == b"*":
+        return lambda _: True
+    if not GLOB_SPECIAL.intersection(pattern):
+        return lambda value: value == pattern
+    if pattern.endswith(b"*") and not GLOB_SPECIAL.intersection(pattern[:-1]):
+        return lambda value: value.startswith(pattern[:-1])
+
+    regex = re.compile(translate_pattern(pattern), re.DOTALL)
+    return lambda value: regex.fullmatch(value) is not None
+
+
+@lru_cache(maxsize=REDIS_PATTERN_CACHE_SIZE)
+def compile_pattern(pattern: bytes) -> Callable[[bytes], bool]:
+    return make_matcher(pattern)
+
+
+def match_pattern(pattern: bytes, value: bytes) -> bool:
+    return compile_pattern(pattern)(value)
+
+
+def get_pattern_prefix(pattern: bytes) -> bytes:
+    """Literal bytes before the first glob special character"""
+    for pos, char in enumerate(pattern):
+        if char in GLOB_SPECIAL:
+            return pattern[:pos]
+    return pattern
+
+
+class PatternTrieNode:
+    __slots__ = ("children", "patterns")
+
+    def __init__(self) -> None:
+        self.children: dict[int, PatternTrieNode] = {}
+        # compiled here, the shared compile cache may be smaller than the trie
+        self.patterns: dict[bytes, Callable[[bytes], bool]] = {}
+
+
+class PatternTrie:
+    """Glob patterns indexed by their literal prefix, byte by byte
+
+    A value is only matched against patterns whose prefix starts it.
+    """
+
+    def __init__(self) -> None:
+        self.root = PatternTrieNode()
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def add(self, pattern: bytes) -> None:
+        node = self.root
+        for char in get_pattern_prefix(pattern):
+            node = node.children.setdefault(char, PatternTrieNode())
+        if pattern not in node.patterns:
+            node.patterns[pattern] = make_matcher(pattern)
+            self.length += 1
+
+    def remove(self, pattern: bytes) -> None:
+        path = [self.root]
+        for char in get_pattern_prefix(pattern):
+            node = path[-1].children.get(char)
+            if node is None:
+                return
+            path.append(node)
+        if pattern not in path[-1].patterns:
+            return
+
+        del path[-1].patterns[pattern]
+        self.length -= 1
+        # prune the branch back to the last node still in use
+        prefix = get_pattern_prefix(pattern)
+        for depth in range(len(prefix), 0, -1):
+            node = path[depth]
+            if node.patterns or node.children:
+                break
+            del path[depth - 1].children[prefix[depth - 1]]
+
+    def match(self, value: bytes) -> list[bytes]:
+        """Patterns matching the value"""
+        matched: list[bytes] = []
+        node: PatternTrieNode | None = self.root
+        pos = 0
+        while node is not None:
+            matched.extend(
+                pattern for pattern, match in node.patterns.items() if match(value)
+            )
+            if pos == len(value):
+                break
+            node = node.children.get(value[pos])
+            pos += 1
+        return matched
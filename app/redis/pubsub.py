@@ -1,29 +1,102 @@
 import logging
 
-from lib import curio
+from .connection import RedisConnection
+from .pattern import PatternTrie, compile_pattern
+from .resp import encode_redis
 
-REDIS_SUBS: dict[str, set[curio.Queue]] = {}
+# only channels with subscribers have an entry, so the dicts double as
+# the index of active channels and their lengths as counters
+REDIS_SUBS: dict[bytes, set[RedisConnection]] = {}
+REDIS_SSUBS: dict[bytes, set[RedisConnection]] = {}
+REDIS_PSUBS: dict[bytes, set[RedisConnection]] = {}
+REDIS_PSUB_PATTERNS = PatternTrie()
 
 
-async def sub_channel(channel: str, sub_queue: curio.Queue) -> None:
-    logging.info("Channel %s: sub %s", channel, sub_queue)
-    if channel not in REDIS_SUBS:
-        REDIS_SUBS[channel] = set()
-    REDIS_SUBS[channel].add(sub_queue)
+def get_subs(shard: bool = False) -> dict[bytes, set[RedisConnection]]:
+    return REDIS_SSUBS if shard else REDIS_SUBS
 
 
-async def unsub_channel(channel: str, sub_queue: curio.Queue) -> None:
-    logging.info("Channel %s: unsub %s", channel, sub_queue)
-    if channel in REDIS_SUBS:
-        REDIS_SUBS[channel].discard(sub_queue)
+async def sub_channel(
+    channel: bytes, connection: RedisConnection, shard: bool = False
+) -> None:
+    logging.info("Channel %s: sub %s shard %s", channel, connection, shard)
+    subs = get_subs(shard)
+    if channel not in subs:
+        subs[channel] = set()
+    subs[channel].add(connection)
+    connection.client_class = "pubsub"
 
 
-async def get_clients(channel: str) -> int:
-    logging.info("Channel %s: %d clients", channel, len(REDIS_SUBS.get(channel, set())))
-    return len(REDIS_SUBS.get(channel, set()))
+async def unsub_channel(
+    channel: bytes, connection: RedisConnection, shard: bool = False
+) -> None:
+    logging.info("Channel %s: unsub %s shard %s", channel, connection, shard)
+    subs = get_subs(shard)
+    channel_subs = subs.get(channel)
+    if channel_subs is None:
+        return
+    channel_subs.discard(connection)
+    if not channel_subs:
+        del subs[channel]
 
 
-async def pub_message(channel: str, message: bytes) -> None:
-    logging.info("Channel %s: pub %s", channel, str(message))
-    for sub_queue in REDIS_SUBS.get(channel, set()):
-        await sub_queue.put(message)
+async def psub_pattern(pattern: bytes, connection: RedisConnection) -> None:
+    logging.info("Pattern %s: sub %s", pattern, connection)
+    if pattern not in REDIS_PSUBS:
+        REDIS_PSUBS[pattern] = set()
+        REDIS_PSUB_PATTERNS.add(pattern)
+    REDIS_PSUBS[pattern].add(connection)
+    connection.client_class = "pubsub"
+
+
+async def punsub_pattern(pattern: bytes, connection: RedisConnection) -> None:
+    logging.info("Pattern %s: unsub %s", pattern, connection)
+    subs = REDIS_PSUBS.get(pattern)
+    if subs is None:
+        return
+    subs.discard(connection)
+    if not subs:
+        del REDIS_PSUBS[pattern]
+        REDIS_PSUB_PATTERNS.remove(pattern)
+
+
+def get_channels(pattern: bytes | None = None, shard: bool = False) -> list[bytes]:
+    """Channels with at least one subscriber, optionally matching a pattern"""
+    if pattern is None:
+        return list(get_subs(shard))
+    match = compile_pattern(pattern)
+    return [channel for channel in get_subs(shard) if match(channel)]
+
+
+def get_clients(channel: bytes, shard: bool = False) -> int:
+    channel_subs = get_subs(shard).get(channel)
+    return len(channel_subs) if channel_subs is not None else 0
+
+
+def get_pattern_count() -> int:
+    return len(REDIS_PSUBS)
+
+
+async def pub_message(channel: bytes, message: bytes, shard: bool = False) -> int:
+    """Encode the message once per channel or pattern and push it to subscribers"""
+    logging.info("Channel %s: pub %s shard %s", channel, str(message), shard)
+    receivers = 0
+    subs = get_subs(shard).get(channel)
+    if subs:
+        frame = encode_redis([b"smessage" if shard else b"message", channel, message])
+        receivers += len(subs)
+        # a subscriber closed over its output limit leaves the set meanwhile
+        for connection in list(subs):
+            await connection.push(frame)
+    if shard:
+        return receivers
+
+    for pattern in REDIS_PSUB_PATTERNS.match(channel):
+        psubs = REDIS_PSUBS.get(pattern)
+        if not psubs:
+            continue
+        frame = encode_redis([b"pmessage", pattern, channel, message])
+        receivers += len(psubs)
+        for connection in list(psubs):
+            await connection.push(frame)
+    return receivers
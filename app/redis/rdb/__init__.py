@@ -1,3 +1,3 @@
-from .rdb import read_rdb, write_rdb
+from .rdb import RDBReader, iter_rdb, read_rdb, write_rdb
 
-__all__ = ["read_rdb", "write_rdb"]
+__all__ = ["RDBReader", "iter_rdb", "read_rdb", "write_rdb"]
@@ -1,26 +1,31 @@
-import logging
-
 from app.redis.resp import REDIS_SEPARATOR, IDAggregate
 
+RDB_EOF_PREFIX = b"EOF:"
+RDB_EOF_MARK_SIZE = 40
+
+
+def decode_data_header(
+    buffer: bytes | bytearray, pos: int = 0
+) -> tuple[int | bytes | None, int]:
+    """Read the '$<length>' or '$EOF:<mark>' line ahead of an RDB payload
 
-def decode_data(buffer: bytes) -> tuple[bytes, int]:
-    logging.info("buffer %d %s", len(buffer), repr(buffer))
-    if len(buffer) < 1:
-        return b"", 0
-    if chr(buffer[0]) != IDAggregate.BSTRING:
-        return b"", 0
+    None while the line is not complete.
+    """
+    rdb_length_end = buffer.find(REDIS_SEPARATOR, pos)
+    if rdb_length_end == -1:
+        return None, pos
+    if chr(buffer[pos]) != IDAggregate.BSTRING:
+        raise ValueError("expected an RDB payload")
 
-    rdb_length_end = buffer.find(REDIS_SEPARATOR)
-    rdb_length = int(buffer[1:rdb_length_end])
-    rdb_data_start = rdb_length_end + len(REDIS_SEPARATOR)
-    if len(buffer) < rdb_data_start + rdb_length:
-        return b"", 0
-    return buffer[
-        rdb_data_start : rdb_data_start + rdb_length
-    ], rdb_data_start + rdb_length
+    value = bytes(buffer[pos + 1 : rdb_length_end])
+    pos = rdb_length_end + len(REDIS_SEPARATOR)
+    if value.startswith(RDB_EOF_PREFIX):
+        return value[len(RDB_EOF_PREFIX) :], pos
+    return int(value), pos
 
 
-def encode_data(data: bytes) -> bytes:
-    if len(data) == 0:
-        return (IDAggregate.BSTRING + "-1").encode()
-    return (IDAggregate.BSTRING + str(len(data))).encode() + REDIS_SEPARATOR + data
+def encode_data_header(size: int | bytes) -> bytes:
+    """Length of the RDB payload, or the mark repeated after it with capa eof"""
+    if isinstance(size, bytes):
+        return IDAggregate.BSTRING.encode() + RDB_EOF_PREFIX + size + REDIS_SEPARATOR
+    return (IDAggregate.BSTRING + str(size)).encode() + REDIS_SEPARATOR
@@ -4,7 +4,7 @@ from .constants import RDBOpCode
 
 
 def read_rdb_checksum(buffer: bytes, pos: int = 0) -> tuple[int, int]:
-    if len(buffer[pos:]) < 9:
+    if len(buffer) < pos + 9:
         return pos, 0
 
     if buffer[pos] != RDBOpCode.EOF:
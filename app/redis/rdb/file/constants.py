@@ -19,12 +19,18 @@ class RDBValue(IntEnum):
     SET = 2
     SORTEDSET = 3
     HASH = 4
+    SORTEDSET_2 = 5
     ZIPMAP = 9
     ZIPLIST = 10
     INTSET = 11
     ZIPLIST_SORTEDSET = 12
     ZIPLIST_HASH = 13
     QUICKLIST_LIST = 14
+    STREAM_LISTPACKS = 15
+    LISTPACK_SORTEDSET = 17
+    QUICKLIST_2_LIST = 18
+    STREAM_LISTPACKS_2 = 19
+    STREAM_LISTPACKS_3 = 21
 
 
 class DBType(StrEnum):
@@ -1,7 +1,5 @@
 from collections.abc import Callable
 
-from .constants import RDBOpCode
-
 # https://github.com/pasztorpisti/py-crc
 # SPDX-License-Identifier: MIT-0
 # SPDX-FileCopyrightText:  2023 Istvan Pasztor
@@ -119,14 +117,19 @@ def specialized_crc(
     return crc_fn
 
 
-def crc64_redis(data: bytes) -> int:
-    return specialized_crc(
-        width=64,
-        poly=0xAD93D23594C935A9,
-        init=0x0000000000000000,
-        refin=True,
-        refout=True,
-        xorout=0x0000000000000000,
-        # check=0xe9c6d914c4b8d9ca
-        # residue=0x0000000000000000
-    )(data + bytes([RDBOpCode.EOF]))
+CRC64_REDIS = specialized_crc(
+    width=64,
+    poly=0xAD93D23594C935A9,
+    init=0x0000000000000000,
+    refin=True,
+    refout=True,
+    xorout=0x0000000000000000,
+    # check=0xe9c6d914c4b8d9ca
+    # residue=0x0000000000000000
+)
+
+
+def crc64_redis(data: bytes, crc: int = 0) -> int:
+    """CRC of data continued from the crc of the bytes before it"""
+    # reflected with no final xor, the running register is the crc itself
+    return CRC64_REDIS(data, crc, interim=True)
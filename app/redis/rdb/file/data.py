@@ -1,15 +1,22 @@
+from collections.abc import Iterator
+from typing import Any
+
 from app.redis.rdb.length import decode_length, encode_length
 
 from .constants import RDBOpCode
 from .value import read_rdb_value, write_rdb_value
 
 
-def read_rdb_size(buffer: bytes) -> tuple[int, int, int]:
-    if buffer[0] == RDBOpCode.RESIZEDB:
-        shash, vhash = decode_length(buffer[1:])
-        sexph, vexph = decode_length(buffer[1 + shash :])
-        return 1 + shash + sexph, vhash, vexph
-    return 0, 0, 0
+def read_rdb_size(buffer: bytes, pos: int = 0) -> tuple[int, int, int]:
+    if buffer[pos] == RDBOpCode.RESIZEDB:
+        shash, vhash = decode_length(buffer[pos + 1 :])
+        if shash == 0:
+            return pos, 0, 0
+        sexph, vexph = decode_length(buffer[pos + 1 + shash :])
+        if sexph == 0:
+            return pos, 0, 0
+        return pos + 1 + shash + sexph, vhash, vexph
+    return pos, 0, 0
 
 
 def write_rdb_size(size_hash: int, size_exph: int) -> bytes:
@@ -21,42 +28,55 @@ def write_rdb_size(size_hash: int, size_exph: int) -> bytes:
 
 
 def read_rdb_data(
-    buffer: bytes, pos: int = 0
-) -> tuple[int, int | None, dict[str, dict[str, str]], dict[str, int]]:
-    num = None
-    data = {}
-    dexp = {}
-
-    if buffer[pos] != RDBOpCode.SELECTDB:
-        return pos, num, data, dexp
-
-    pos += 1
-    num = buffer[pos]
-    pos += 1
-    ssize, _, _ = read_rdb_size(buffer[pos:])
-    pos += ssize
-
-    while True:
-        if buffer[pos] in [RDBOpCode.SELECTDB, RDBOpCode.EOF]:
-            return pos, num, data, dexp
+    buffer: bytes,
+    pos: int,
+    data: dict[int, dict[bytes, dict[str, Any]]],
+    dexp: dict[int, dict[bytes, int]],
+    num: int | None = None,
+) -> tuple[int, int | None]:
+    """Read the records that fully arrived into data and dexp
 
-        sval, vkey, vval, dbtype, vexp = read_rdb_value(buffer[pos:])
-        pos += sval
+    Returns where the first partial record or the EOF starts, and the
+    database the next keys go to.
+    """
+    while pos < len(buffer):
+        match buffer[pos]:
+            case RDBOpCode.EOF:
+                break
+            case RDBOpCode.SELECTDB:
+                snum, num = decode_length(buffer[pos + 1 :])
+                if snum == 0:
+                    break
+                data.setdefault(num, {})
+                dexp.setdefault(num, {})
+                pos += 1 + snum
+            case RDBOpCode.RESIZEDB:
+                ssize, _, _ = read_rdb_size(buffer, pos)
+                if ssize == pos:
+                    break
+                pos = ssize
+            case _:
+                sval, vkey, vval, dbtype, vexp = read_rdb_value(buffer[pos:])
+                if sval == 0:
+                    break
+                if num is None:
+                    raise ValueError("RDB key before any SELECTDB")
+                pos += sval
 
-        data[vkey] = {"value": vval, "type": dbtype}
-        if vexp is not None:
-            dexp[vkey] = vexp
+                data[num][vkey] = {"value": vval, "type": dbtype}
+                if vexp is not None:
+                    dexp[num][vkey] = vexp
+    return pos, num
 
 
 def write_rdb_data(
-    data: dict[int, dict[str, dict[str, str]]],
-    dexp: dict[int, dict[str, int]],
-) -> bytes:
-    buffer = b""
+    data: dict[int, dict[bytes, dict[str, Any]]],
+    dexp: dict[int, dict[bytes, int]],
+) -> Iterator[bytes]:
+    """Encode the databases one record at a time"""
     for db_num, db_data in data.items():
         db_exp = dexp[db_num]
-        buffer += bytes([RDBOpCode.SELECTDB, db_num])
-        buffer += write_rdb_size(len(db_data), len(db_exp))
+        yield bytes([RDBOpCode.SELECTDB]) + encode_length(db_num)
+        yield write_rdb_size(len(db_data), len(db_exp))
         for key, value in db_data.items():
-            buffer += write_rdb_value(key, value["value"], db_exp.get(key))
-    return buffer
+            yield write_rdb_value(key, value["value"], db_exp.get(key), value["type"])
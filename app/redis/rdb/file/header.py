@@ -1,9 +1,11 @@
 from .constants import RDB_NAME, RDB_VERSION
 
 
-def read_rdb_header(buffer: bytes) -> tuple[int, str]:
-    assert buffer[:5].decode() == RDB_NAME
-    return 9, buffer[5:9].decode()
+def read_rdb_header(buffer: bytes, pos: int = 0) -> tuple[int, str]:
+    if len(buffer) < pos + 9:
+        return pos, ""
+    assert bytes(buffer[pos : pos + 5]).decode() == RDB_NAME
+    return pos + 9, bytes(buffer[pos + 5 : pos + 9]).decode()
 
 
 def write_rdb_header(version: str = RDB_VERSION) -> bytes:
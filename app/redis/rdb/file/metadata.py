@@ -4,20 +4,20 @@ from .constants import RDBOpCode
 
 
 def read_rdb_meta(buffer: bytes, pos: int = 0) -> tuple[int, dict[str, str | int]]:
+    """Read the AUX fields that fully arrived, pos stops at a partial one"""
     data = {}
-    while True:
+    while pos < len(buffer):
         if buffer[pos] != RDBOpCode.AUX:
             return pos, data
-        pos += 1
-        skey, vkey = decode_string(buffer[pos:])
+        skey, vkey = decode_string(buffer[pos + 1 :])
         if skey == 0:
-            raise ValueError("error reading RDB AUX name")
-        pos += skey
-        sval, vval = decode_string(buffer[pos:])
+            return pos, data
+        sval, vval = decode_string(buffer[pos + 1 + skey :])
         if sval == 0:
-            raise ValueError("error reading RDB AUX value")
-        pos += sval
-        data[vkey] = vval
+            return pos, data
+        pos += 1 + skey + sval
+        data[vkey.decode()] = vval.decode()
+    return pos, data
 
 
 def write_rdb_meta(meta: dict[str, str | int]) -> bytes:
@@ -1,53 +1,274 @@
+import math
 import struct
+from collections import deque
+from collections.abc import Iterator
 from typing import Any
 
+from app.redis.rdb.length import decode_length, encode_length
+from app.redis.rdb.listpack import decode_listpack, encode_listpack
 from app.redis.rdb.string import decode_string, encode_string
 
 from .constants import DBType, RDBOpCode, RDBValue
 
+# quicklist node containers
+QUICKLIST_NODE_PLAIN = 1
+# stream listpack entry flags
+STREAM_ITEM_DELETED = 1
+STREAM_ITEM_SAME_FIELDS = 2
+# length byte of the special scores in the old sorted set encoding
+RDB_DOUBLE_SPECIAL = {253: math.nan, 254: math.inf, 255: -math.inf}
+
+StreamRecordEntry = tuple[tuple[int, int], list[bytes]]
+# last ID and the (ID, field-value list) entries of a stream record
+StreamRecord = tuple[tuple[int, int], list[StreamRecordEntry]]
+
+
+class RDBIncomplete(Exception):
+    """A record goes on past the end of what arrived so far"""
+
+
+def read_length(buffer: bytes, pos: int) -> tuple[int, int]:
+    size, value = decode_length(buffer[pos:])
+    if size == 0:
+        raise RDBIncomplete
+    return pos + size, value
+
+
+def read_string(buffer: bytes, pos: int) -> tuple[int, bytes]:
+    size, value = decode_string(buffer[pos:])
+    if size == 0:
+        raise RDBIncomplete
+    return pos + size, value
+
+
+def read_raw(buffer: bytes, pos: int, size: int) -> tuple[int, bytes]:
+    if len(buffer) < pos + size:
+        raise RDBIncomplete
+    return pos + size, bytes(buffer[pos : pos + size])
+
+
+def as_bytes(value: bytes | int) -> bytes:
+    """A listpack element as a string, integers are stored as such"""
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+def as_int(value: bytes | int) -> int:
+    return value if isinstance(value, int) else int(value)
+
+
+def read_rdb_list(buffer: bytes, pos: int) -> tuple[int, deque[bytes]]:
+    pos, count = read_length(buffer, pos)
+    values: deque[bytes] = deque()
+    for _ in range(count):
+        pos, value = read_string(buffer, pos)
+        values.append(value)
+    return pos, values
+
+
+def read_rdb_quicklist(buffer: bytes, pos: int) -> tuple[int, deque[bytes]]:
+    pos, count = read_length(buffer, pos)
+    values: deque[bytes] = deque()
+    for _ in range(count):
+        pos, container = read_length(buffer, pos)
+        pos, node = read_string(buffer, pos)
+        if container == QUICKLIST_NODE_PLAIN:
+            values.append(node)
+        else:
+            values.extend(map(as_bytes, decode_listpack(node)))
+    return pos, values
+
+
+def read_rdb_zset(
+    buffer: bytes, pos: int, binary: bool = True
+) -> tuple[int, dict[bytes, float]]:
+    pos, count = read_length(buffer, pos)
+    values: dict[bytes, float] = {}
+    for _ in range(count):
+        pos, member = read_string(buffer, pos)
+        if binary:
+            pos, score = read_raw(buffer, pos, 8)
+            values[member] = struct.unpack("<d", score)[0]
+            continue
+        pos, size = read_raw(buffer, pos, 1)
+        if size[0] in RDB_DOUBLE_SPECIAL:
+            values[member] = RDB_DOUBLE_SPECIAL[size[0]]
+        else:
+            pos, score = read_raw(buffer, pos, size[0])
+            values[member] = float(score)
+    return pos, values
+
+
+def read_rdb_listpack_zset(buffer: bytes, pos: int) -> tuple[int, dict[bytes, float]]:
+    pos, data = read_string(buffer, pos)
+    values = decode_listpack(data)
+    return pos, {
+        as_bytes(member): float(score)
+        for member, score in zip(values[::2], values[1::2], strict=True)
+    }
+
+
+def decode_stream_node(key: bytes, data: bytes) -> Iterator[StreamRecordEntry]:
+    """Entries of a stream listpack, IDs are stored relative to the node key"""
+    master_ms, master_seq = struct.unpack(">QQ", key)
+    values = iter(decode_listpack(data))
+    count, deleted = as_int(next(values)), as_int(next(values))
+    master_fields = [as_bytes(next(values)) for _ in range(as_int(next(values)))]
+    next(values)
+    for _ in range(count + deleted):
+        flags = as_int(next(values))
+        sid = (master_ms + as_int(next(values)), master_seq + as_int(next(values)))
+        if flags & STREAM_ITEM_SAME_FIELDS:
+            fields = []
+            for field in master_fields:
+                fields.extend([field, as_bytes(next(values))])
+        else:
+            fields = [as_bytes(next(values)) for _ in range(2 * as_int(next(values)))]
+        next(values)
+        if not flags & STREAM_ITEM_DELETED:
+            yield sid, fields
+
+
+def read_rdb_stream(buffer: bytes, pos: int, vtype: int) -> tuple[int, StreamRecord]:
+    pos, count = read_length(buffer, pos)
+    entries: list[StreamRecordEntry] = []
+    for _ in range(count):
+        pos, key = read_string(buffer, pos)
+        pos, node = read_string(buffer, pos)
+        entries.extend(decode_stream_node(key, node))
+    pos, _ = read_length(buffer, pos)
+    pos, last_ms = read_length(buffer, pos)
+    pos, last_seq = read_length(buffer, pos)
+    if vtype != RDBValue.STREAM_LISTPACKS:
+        # first ID, max deleted ID and entries added, the entries tell
+        for _ in range(5):
+            pos, _ = read_length(buffer, pos)
+    pos, groups = read_length(buffer, pos)
+    if groups:
+        raise ValueError("unhandled RDB stream consumer groups")
+    return pos, ((last_ms, last_seq), entries)
+
 
 def read_rdb_value(
     buffer: bytes, pos: int = 0
-) -> tuple[int, str, str | int, str, int | None]:
+) -> tuple[int, bytes, Any, str, int | None]:
+    """Read one key, the returned position is 0 when it did not fully arrive
+
+    Lists load as a deque, sorted sets as a member to score dict and streams
+    as a StreamRecord, for the database to build its own types from.
+    """
+    pending = 0, b"", b"", DBType.NONE, None
     vexp = None
+    if len(buffer) <= pos:
+        return pending
     if buffer[pos] == RDBOpCode.EXPIRETIME:
+        if len(buffer) < pos + 5:
+            return pending
         vexp = struct.unpack("<L", buffer[pos + 1 : pos + 5])[0] * 1000
         pos += 5
     elif buffer[pos] == RDBOpCode.EXPIRETIMEMS:
+        if len(buffer) < pos + 9:
+            return pending
         vexp = struct.unpack("<Q", buffer[pos + 1 : pos + 9])[0]
         pos += 9
 
+    if len(buffer) <= pos:
+        return pending
     vtype = buffer[pos]
     pos += 1
-    skey, vkey = decode_string(buffer[pos:])
-    if skey == 0:
-        raise ValueError("error reading RDB key")
-    pos += skey
-    match vtype:
-        case RDBValue.STR:
-            sval, vval = decode_string(buffer[pos:])
-            dbtype = DBType.STR
-            if skey == 0:
-                raise ValueError("error reading RDB string value")
-            pos += sval
-        case _:
-            raise ValueError(f"unhandled RDB type {vtype} {RDBValue(vtype).name}")
+    vval: Any
+    try:
+        pos, vkey = read_string(buffer, pos)
+        match vtype:
+            case RDBValue.STR:
+                pos, vval = read_string(buffer, pos)
+                dbtype = DBType.STR
+            case RDBValue.LIST:
+                pos, vval = read_rdb_list(buffer, pos)
+                dbtype = DBType.LIST
+            case RDBValue.QUICKLIST_2_LIST:
+                pos, vval = read_rdb_quicklist(buffer, pos)
+                dbtype = DBType.LIST
+            case RDBValue.SORTEDSET | RDBValue.SORTEDSET_2:
+                binary = vtype == RDBValue.SORTEDSET_2
+                pos, vval = read_rdb_zset(buffer, pos, binary)
+                dbtype = DBType.ZSET
+            case RDBValue.LISTPACK_SORTEDSET:
+                pos, vval = read_rdb_listpack_zset(buffer, pos)
+                dbtype = DBType.ZSET
+            case (
+                RDBValue.STREAM_LISTPACKS
+                | RDBValue.STREAM_LISTPACKS_2
+                | RDBValue.STREAM_LISTPACKS_3
+            ):
+                pos, vval = read_rdb_stream(buffer, pos, vtype)
+                dbtype = DBType.STREAM
+            case _:
+                raise ValueError(f"unhandled RDB type {vtype} {RDBValue(vtype).name}")
+    except RDBIncomplete:
+        return pending
+
+    return pos, vkey, vval, dbtype, vexp
 
-    return pos, str(vkey), vval, dbtype, vexp
+
+def encode_stream_node(ids: list[Any], fields: list[list[bytes]]) -> bytes:
+    """One stream node as a listpack, fields matching the first are not repeated"""
+    master_ms, master_seq = ids[0]
+    master_fields = fields[0][::2]
+    values: list[bytes | int] = [len(ids), 0, len(master_fields), *master_fields, 0]
+    for (ms, seq), entry in zip(ids, fields, strict=True):
+        names = entry[::2]
+        if names == master_fields:
+            values += [STREAM_ITEM_SAME_FIELDS, ms - master_ms, seq - master_seq]
+            values += [*entry[1::2], len(names) + 3]
+        else:
+            values += [0, ms - master_ms, seq - master_seq, len(names), *entry]
+            values.append(2 * len(names) + 4)
+    return encode_listpack(values)
 
 
-def write_rdb_value(key: str, value: Any, exp: int | None) -> bytes:
-    buffer = b""
+def write_rdb_stream(value: Any) -> list[bytes]:
+    nodes = [node for node in value.nodes if len(node)]
+    parts = [encode_length(len(nodes))]
+    for node in nodes:
+        parts.append(encode_string(struct.pack(">QQ", *node.ids[0])))
+        parts.append(encode_string(encode_stream_node(node.ids, node.fields)))
+    last_ms, last_seq = value.last_id
+    parts += [
+        encode_length(len(value)),
+        encode_length(last_ms),
+        encode_length(last_seq),
+    ]
+    # no consumer groups
+    parts.append(encode_length(0))
+    return parts
+
+
+def write_rdb_value(
+    key: bytes, value: Any, exp: int | None, dtype: str = DBType.STR
+) -> bytes:
+    """One key, sorted sets may be given as a member to score dict"""
+    parts = []
     if exp is not None:
         if exp % 1000 == 0:
-            buffer += bytes([RDBOpCode.EXPIRETIME]) + struct.pack("<L", int(exp / 1000))
+            parts.append(bytes([RDBOpCode.EXPIRETIME]) + struct.pack("<L", exp // 1000))
         else:
-            buffer += bytes([RDBOpCode.EXPIRETIMEMS]) + struct.pack("<Q", exp)
+            parts.append(bytes([RDBOpCode.EXPIRETIMEMS]) + struct.pack("<Q", exp))
 
-    if isinstance(value, str):
-        buffer += bytes([RDBValue.STR])
-        buffer += encode_string(key)
-        buffer += encode_string(value)
-        return buffer
-
-    raise TypeError(f"unhandled RDB type {type(value)}")
+    match dtype:
+        case DBType.STR if isinstance(value, bytes):
+            parts += [bytes([RDBValue.STR]), encode_string(key), encode_string(value)]
+        case DBType.LIST:
+            parts += [bytes([RDBValue.LIST]), encode_string(key)]
+            parts.append(encode_length(len(value)))
+            parts.extend(map(encode_string, value))
+        case DBType.ZSET:
+            parts += [bytes([RDBValue.SORTEDSET_2]), encode_string(key)]
+            parts.append(encode_length(len(value)))
+            for member, score in value.items():
+                parts += [encode_string(member), struct.pack("<d", score)]
+        case DBType.STREAM:
+            parts += [bytes([RDBValue.STREAM_LISTPACKS]), encode_string(key)]
+            parts += write_rdb_stream(value)
+        case _:
+            raise TypeError(f"unhandled RDB type {type(value)}")
+    return b"".join(parts)
@@ -12,15 +12,20 @@ def decode_length(data: bytes) -> tuple[int, int]:
         return 1, data[0]
 
     if senc == 0b01:
-        if dlen < 3:
+        if dlen < 2:
             return 0, 0
         return 2, struct.unpack(">H", data[0:2])[0] & 0x3FFF
 
-    if senc == 0b10:
+    if data[0] == 0x80:
         if dlen < 5:
             return 0, 0
         return 5, struct.unpack(">L", data[1:5])[0]
 
+    if data[0] == 0x81:
+        if dlen < 9:
+            return 0, 0
+        return 9, struct.unpack(">Q", data[1:9])[0]
+
     raise ValueError("unhandled length decoding format")
 
 
@@ -38,17 +43,17 @@ def decode_length_special(data: bytes) -> tuple[int, int]:
     if sfmt == 0:
         if dlen < 2:
             return 0, 0
-        return 2, data[1]
+        return 2, struct.unpack("<b", data[1:2])[0]
 
     if sfmt == 1:
         if dlen < 3:
             return 0, 0
-        return 3, struct.unpack("<H", data[1:3])[0]
+        return 3, struct.unpack("<h", data[1:3])[0]
 
     if sfmt == 2:
         if dlen < 5:
             return 0, 0
-        return 5, struct.unpack("<L", data[1:5])[0]
+        return 5, struct.unpack("<l", data[1:5])[0]
 
     raise ValueError("unhandled length decoding format")
 
@@ -58,12 +63,15 @@ def encode_length(value: int) -> bytes:
         return bytes([value])
     if value < 1 << 14:
         return struct.pack(">H", 1 << 14 | value)
-    return struct.pack("B>L", 1 << 7, value)
+    if value < 1 << 32:
+        return bytes([0x80]) + struct.pack(">L", value)
+    return bytes([0x81]) + struct.pack(">Q", value)
 
 
 def encode_length_special(value: int) -> bytes:
-    if value < 1 << 8:
-        return struct.pack("BB", 0b11 << 6, value)
-    if value < 1 << 16:
-        return bytes([(0b11 << 6) | 1]) + struct.pack("<H", value)
-    return bytes([(0b11 << 6) | 2]) + struct.pack("<L", value)
+    """Signed 8, 16 or 32 bit integer encoding, as redis reads it"""
+    if -(1 << 7) <= value < 1 << 7:
+        return bytes([0b11 << 6]) + struct.pack("<b", value)
+    if -(1 << 15) <= value < 1 << 15:
+        return bytes([(0b11 << 6) | 1]) + struct.pack("<h", value)
+    return bytes([(0b11 << 6) | 2]) + struct.pack("<l", value)
@@ -0,0 +1,93 @@
+import struct
+
+LISTPACK_HEADER_SIZE = 6
+LISTPACK_END = 0xFF
+LISTPACK_UNKNOWN_COUNT = 0xFFFF
+
+
+def get_backlen_size(size: int) -> int:
+    if size <= 127:
+        return 1
+    if size < 16383:
+        return 2
+    if size < 2097151:
+        return 3
+    if size < 268435455:
+        return 4
+    return 5
+
+
+def encode_listpack_backlen(size: int) -> bytes:
+    """Element size for reverse walks, 7 bits a byte, high bits first
+
+    Every byte but the first is flagged, a backward read stops at the first.
+    """
+    count = get_backlen_size(size)
+    return bytes(
+        size >> 7 * (count - 1 - i) & 0x7F | (0x80 if i else 0) for i in range(count)
+    )
+
+
+def encode_listpack_element(value: bytes | int) -> bytes:
+    if isinstance(value, int):
+        if 0 <= value < 1 << 7:
+            element = bytes([value])
+        elif -(1 << 12) <= value < 1 << 12:
+            value &= 0x1FFF
+            element = bytes([0xC0 | value >> 8, value & 0xFF])
+        elif -(1 << 15) <= value < 1 << 15:
+            element = b"\xf1" + struct.pack("<h", value)
+        elif -(1 << 23) <= value < 1 << 23:
+            element = b"\xf2" + (value & 0xFFFFFF).to_bytes(3, "little")
+        elif -(1 << 31) <= value < 1 << 31:
+            element = b"\xf3" + struct.pack("<i", value)
+        else:
+            element = b"\xf4" + struct.pack("<q", value)
+    elif len(value) < 1 << 6:
+        element = bytes([0x80 | len(value)]) + value
+    elif len(value) < 1 << 12:
+        element = bytes([0xE0 | len(value) >> 8, len(value) & 0xFF]) + value
+    else:
+        element = b"\xf0" + struct.pack("<I", len(value)) + value
+    return element + encode_listpack_backlen(len(element))
+
+
+def encode_listpack(values: list[bytes | int]) -> bytes:
+    elements = b"".join(map(encode_listpack_element, values))
+    size = LISTPACK_HEADER_SIZE + len(elements) + 1
+    count = min(len(values), LISTPACK_UNKNOWN_COUNT)
+    return struct.pack("<IH", size, count) + elements + bytes([LISTPACK_END])
+
+
+def decode_listpack(data: bytes) -> list[bytes | int]:
+    """Elements of a whole listpack, strings as bytes and integers as int"""
+    values: list[bytes | int] = []
+    pos = LISTPACK_HEADER_SIZE
+    while data[pos] != LISTPACK_END:
+        enc = data[pos]
+        value: bytes | int
+        if enc < 0x80:
+            size, value = 1, enc
+        elif enc < 0xC0:
+            size = 1 + (enc & 0x3F)
+            value = bytes(data[pos + 1 : pos + size])
+        elif enc < 0xE0:
+            size = 2
+            value = (enc & 0x1F) << 8 | data[pos + 1]
+            if value >= 1 << 12:
+                value -= 1 << 13
+        elif enc < 0xF0:
+            size = 2 + ((enc & 0x0F) << 8 | data[pos + 1])
+            value = bytes(data[pos + 2 : pos + size])
+        elif enc == 0xF0:
+            size = 5 + struct.unpack("<I", data[pos + 1 : pos + 5])[0]
+            value = bytes(data[pos + 5 : pos + size])
+        elif enc in (0xF1, 0xF2, 0xF3, 0xF4):
+            width = {0xF1: 2, 0xF2: 3, 0xF3: 4, 0xF4: 8}[enc]
+            size = 1 + width
+            value = int.from_bytes(data[pos + 1 : pos + size], "little", signed=True)
+        else:
+            raise ValueError(f"unhandled listpack encoding {enc:#x}")
+        values.append(value)
+        pos += size + get_backlen_size(size)
+    return values
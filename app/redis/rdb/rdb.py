@@ -1,52 +1,112 @@
 import logging
+from collections.abc import Iterator
+from typing import Any
 
 from .file.checksum import read_rdb_checksum, write_rdb_checksum
+from .file.constants import RDBOpCode
 from .file.crc64 import crc64_redis
 from .file.data import read_rdb_data, write_rdb_data
 from .file.header import read_rdb_header, write_rdb_header
 from .file.metadata import read_rdb_meta, write_rdb_meta
 
+RDB_CHUNK_SIZE = 64 * 1024
+
+
+class RDBReader:
+    """Incremental RDB parser, fed the file as it arrives
+
+    Only complete records are consumed, so the caller keeps at most the
+    last partial record around instead of the whole file.
+    """
+
+    def __init__(self) -> None:
+        self.version = ""
+        self.meta: dict[str, str | int] = {}
+        self.data: dict[int, dict[bytes, dict[str, Any]]] = {}
+        self.dexp: dict[int, dict[bytes, int]] = {}
+        self.db_num: int | None = None
+        self.checksum = 0
+        self.done = False
+
+    def parse(self, buffer: bytes | bytearray, pos: int = 0) -> int:
+        """Parse the complete records from pos, returns where parsing stopped"""
+        with memoryview(buffer) as view:
+            start = pos
+            pos = self.parse_records(view, pos)
+            if not self.done:
+                self.checksum = crc64_redis(view[start:pos], self.checksum)
+                return pos
+
+            # the checksum covers the EOF opcode but not itself
+            self.checksum = crc64_redis(view[start : pos - 8], self.checksum)
+            _, db_check = read_rdb_checksum(view, pos - 9)
+            logging.info("checksum %d %d", db_check, self.checksum)
+            return pos
+
+    def parse_records(self, buffer: memoryview, pos: int) -> int:
+        if not self.version:
+            pos, self.version = read_rdb_header(buffer, pos)
+            if not self.version:
+                return pos
+            logging.info("version %s", repr(self.version))
+
+        if self.db_num is None:
+            pos, db_meta = read_rdb_meta(buffer, pos)
+            self.meta.update(db_meta)
+            if pos < len(buffer) and buffer[pos] == RDBOpCode.AUX:
+                return pos
+
+        pos, self.db_num = read_rdb_data(buffer, pos, self.data, self.dexp, self.db_num)
+        end, _ = read_rdb_checksum(buffer, pos)
+        if end > pos:
+            self.done = True
+        return end
+
 
 def read_rdb(
     buffer: bytes,
 ) -> tuple[
     dict[str, str | int],
-    dict[int, dict[str, dict[str, str]]],
-    dict[int, dict[str, int]],
+    dict[int, dict[bytes, dict[str, Any]]],
+    dict[int, dict[bytes, int]],
 ]:
-    logging.info("%s", repr(buffer))
+    reader = RDBReader()
+    reader.parse(buffer)
+    if not reader.done:
+        raise ValueError("RDB file ends before its EOF marker")
+    logging.info("meta %s", repr(reader.meta))
+    return reader.meta, reader.data, reader.dexp
 
-    db_pos, db_version = read_rdb_header(buffer)
-    logging.info("version %s", repr(db_version))
-    db_pos, db_meta = read_rdb_meta(buffer, db_pos)
-    logging.info("meta %s", repr(db_meta))
 
-    db_data = {}
-    db_dexp = {}
-    logging.info("data %s", repr(buffer[db_pos:]))
-    while True:
-        db_pos, db_num, db_num_data, db_num_exp = read_rdb_data(buffer, db_pos)
-        if db_num is None:
-            break
-        db_data[db_num] = db_num_data
-        db_dexp[db_num] = db_num_exp
+def iter_rdb(
+    meta: dict[str, str | int],
+    data: dict[int, dict[bytes, dict[str, Any]]],
+    dexp: dict[int, dict[bytes, int]],
+    checksum: bool = True,
+) -> Iterator[bytes]:
+    """Encode the RDB in chunks of about RDB_CHUNK_SIZE bytes
 
-    db_calc = crc64_redis(buffer[:db_pos])
-    db_pos, db_check = read_rdb_checksum(buffer, db_pos)
-    logging.info("checksum %d %d", db_check, db_calc)
+    Without checksum the trailer holds 0, as redis writes with rdbchecksum no.
+    """
+    crc = 0
+    chunk = bytearray(write_rdb_header() + write_rdb_meta(meta))
+    for record in write_rdb_data(data, dexp):
+        chunk += record
+        if len(chunk) >= RDB_CHUNK_SIZE:
+            if checksum:
+                crc = crc64_redis(chunk, crc)
+            yield bytes(chunk)
+            chunk.clear()
 
-    logging.info("%s", repr(db_data))
-    logging.info("%s", repr(db_dexp))
-    return db_meta, db_data, db_dexp
+    if checksum:
+        crc = crc64_redis(chunk + bytes([RDBOpCode.EOF]), crc)
+    chunk += write_rdb_checksum(crc)
+    yield bytes(chunk)
 
 
 def write_rdb(
     meta: dict[str, str | int],
-    data: dict[int, dict[str, dict[str, str]]],
-    dexp: dict[int, dict[str, int]],
+    data: dict[int, dict[bytes, dict[str, Any]]],
+    dexp: dict[int, dict[bytes, int]],
 ) -> bytes:
-    buffer = write_rdb_header()
-    buffer += write_rdb_meta(meta)
-    buffer += write_rdb_data(data, dexp)
-    buffer += write_rdb_checksum(crc64_redis(buffer))
-    return buffer
+    return b"".join(iter_rdb(meta, data, dexp))
@@ -6,22 +6,28 @@ from .length import (
 )
 
 
-def decode_string(data: bytes) -> tuple[int, str | int]:
+def decode_string(data: bytes) -> tuple[int, bytes]:
     dlen = len(data)
     if dlen < 1:
-        return 0, ""
+        return 0, b""
 
     senc = data[0] >> 6
     if senc == 0b11:
-        return decode_length_special(data)
+        # integer encoded, loaded as its digits like any other string
+        spos, value = decode_length_special(data)
+        return spos, str(value).encode() if spos else b""
 
     spos, slen = decode_length(data)
-    if spos == 0:
-        return 0, ""
-    return spos + slen, data[spos : spos + slen].decode()
+    if spos == 0 or dlen < spos + slen:
+        return 0, b""
+    return spos + slen, bytes(data[spos : spos + slen])
 
 
-def encode_string(value: str | int) -> bytes:
+def encode_string(value: bytes | str | int) -> bytes:
     if isinstance(value, int):
-        return encode_length_special(value)
-    return encode_length(len(value)) + value.encode()
+        if -(1 << 31) <= value < 1 << 31:
+            return encode_length_special(value)
+        value = str(value)
+    if isinstance(value, str):
+        value = value.encode()
+    return encode_length(len(value)) + value
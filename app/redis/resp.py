@@ -1,8 +1,9 @@
-import logging
 from decimal import Decimal
 from enum import StrEnum
 from typing import Any
 
+from .buffer import RecvBuffer
+
 REDIS_SEPARATOR = b"\r\n"
 REDIS_SEPARATOR_LENGTH = len(REDIS_SEPARATOR)
 
@@ -28,13 +29,17 @@ class IDAggregate(StrEnum):
     PUSH = ">"
 
 
+RESP_PENDING: Any = object()
+
+
 def decode_simple(recv_id: int, value: bytes) -> Any:
-    logging.debug("new simple %s %s", recv_id, value)
     match chr(recv_id):
         case IDSimple.STRING:
             return value.decode()
+        case IDSimple.ERROR:
+            return value.decode()
         case IDSimple.INTEGER:
-            return int(value.decode())
+            return int(value)
         case IDSimple.NULL:
             assert value == b""
             return None
@@ -43,112 +48,106 @@ def decode_simple(recv_id: int, value: bytes) -> Any:
             assert value in b"tf"
             return value == b"t"
         case IDSimple.DOUBLE:
-            return float(value.decode())
+            return float(value)
         case IDSimple.BIGNUM:
             return Decimal(value.decode())
         case _:
             raise ValueError("recv unhandled simple id", recv_id, value)
 
 
-def decode_redis(message: bytes, message_counter: int = 0) -> tuple[Any, int]:
-    logging.debug("new decode %s %d", repr(message), message_counter)
-    if len(message) < message_counter + 2:
-        return "", message_counter
-
-    recv_id = message[message_counter]
-
-    if chr(recv_id) in IDSimple:
-        message_next = message.find(REDIS_SEPARATOR, message_counter + 1)
-        if message_next == -1:
-            return "", message_counter
-        value_next = message[message_counter + 1 : message_next]
-        return decode_simple(recv_id, value_next), message_next + REDIS_SEPARATOR_LENGTH
-
-    match chr(recv_id):
-        case IDAggregate.BSTRING:
-            message_next = message.find(REDIS_SEPARATOR, message_counter + 1)
-            if message_next == -1:
-                return "", message_counter
-            bstr_length = int(message[message_counter + 1 : message_next])
-            value_counter = message_next + REDIS_SEPARATOR_LENGTH
-
-            message_next = message.find(REDIS_SEPARATOR, value_counter)
-            if message_next == -1:
-                return "", message_counter
-            bstr_value = message[value_counter:message_next].decode()
-            assert message_next == value_counter + bstr_length
-            logging.debug("new bstr_value %s", bstr_value)
-            return bstr_value, message_next + REDIS_SEPARATOR_LENGTH
-
-        case IDAggregate.ARRAY:
-            message_next = message.find(REDIS_SEPARATOR, message_counter + 1)
-            if message_next == -1:
-                return [], message_counter
-            array_length = int(message[message_counter + 1 : message_next])
-            message_next += REDIS_SEPARATOR_LENGTH
-
-            array_res = []
-            logging.debug(
-                "new array, length %d %d %d %s",
-                array_length,
-                len(array_res),
-                message_next,
-                message,
-            )
-            while len(array_res) < array_length:
-                array_value, message_next_val = decode_redis(message, message_next)
-                if message_next_val == message_next:
-                    return [], message_counter
-                message_next = message_next_val
-                array_res.append(array_value)
-                logging.debug(
-                    "new array_value %d %d %d %s",
-                    array_length,
-                    len(array_res),
-                    message_next,
-                    array_value,
+class RespParser:
+    """Incremental RESP decoder.
+
+    Completed elements are kept between calls, so each byte is only parsed
+    once no matter how the input is split. Nested aggregates are tracked on
+    an explicit stack and bulk strings are read by their declared length.
+    """
+
+    def __init__(self) -> None:
+        self.stack: list[tuple[int, int, list[Any]]] = []
+        self.bulk_length = -1
+        self.parsed_length = 0
+        self.length = 0
+
+    def decode(self, message: bytes, message_counter: int = 0) -> tuple[Any, int]:
+        """Return (value, position) or (RESP_PENDING, position) if incomplete."""
+        pos = message_counter
+        message_length = len(message)
+        while True:
+            if self.bulk_length >= 0:
+                value_end = pos + self.bulk_length
+                if message_length < value_end + REDIS_SEPARATOR_LENGTH:
+                    break
+                if message[value_end : value_end + REDIS_SEPARATOR_LENGTH] != (
+                    REDIS_SEPARATOR
+                ):
+                    raise ValueError("bulk string length mismatch", self.bulk_length)
+                value = bytes(message[pos:value_end])
+                pos = value_end + REDIS_SEPARATOR_LENGTH
+                self.bulk_length = -1
+            else:
+                line_end = message.find(REDIS_SEPARATOR, pos)
+                if line_end == -1:
+                    break
+                recv_id = message[pos]
+                line = message[pos + 1 : line_end]
+                pos = line_end + REDIS_SEPARATOR_LENGTH
+
+                match chr(recv_id):
+                    case IDAggregate.BSTRING:
+                        bstr_length = int(line)
+                        if bstr_length >= 0:
+                            self.bulk_length = bstr_length
+                            continue
+                        value = None
+                    case IDAggregate.ARRAY | IDAggregate.MAP:
+                        item_count = int(line)
+                        if item_count > 0:
+                            if recv_id == ord(IDAggregate.MAP):
+                                item_count *= 2
+                            self.stack.append((recv_id, item_count, []))
+                            continue
+                        value = (
+                            None
+                            if item_count < 0
+                            else {}
+                            if recv_id == ord(IDAggregate.MAP)
+                            else []
+                        )
+                    case _:
+                        value = decode_simple(recv_id, bytes(line))
+
+            while self.stack:
+                recv_id, item_count, items = self.stack[-1]
+                items.append(value)
+                if len(items) < item_count:
+                    break
+                self.stack.pop()
+                value = (
+                    dict(zip(items[::2], items[1::2], strict=True))
+                    if recv_id == ord(IDAggregate.MAP)
+                    else items
                 )
+            else:
+                self.length = self.parsed_length + pos - message_counter
+                self.parsed_length = 0
+                return value, pos
 
-            return array_res, message_next
-
-        case IDAggregate.MAP:
-            message_next = message.find(REDIS_SEPARATOR, message_counter + 1)
-            if message_next == -1:
-                return {}, message_counter
-            map_length = int(message[message_counter + 1 : message_next])
-            message_next += REDIS_SEPARATOR_LENGTH
-
-            map_res = {}
-            logging.debug(
-                "new map, length %d %d %d %s",
-                map_length,
-                len(map_res),
-                message_counter,
-                message,
-            )
-            while len(map_res) < map_length:
-                map_key, message_next_val = decode_redis(message, message_next)
-                if message_next_val == message_next:
-                    return {}, message_counter
-                message_next = message_next_val
-                map_value, message_next_val = decode_redis(message, message_next)
-                if message_next_val == message_next:
-                    return {}, message_counter
-                message_next = message_next_val
-                map_res[map_key] = map_value
-                logging.debug(
-                    "new map item, length %d %d %d %s %s",
-                    map_length,
-                    len(map_res),
-                    message_counter,
-                    map_key,
-                    map_value,
-                )
+        self.parsed_length += pos - message_counter
+        return RESP_PENDING, pos
 
-            return map_res, message_next
+    def parse(self, recv_buffer: RecvBuffer) -> Any:
+        """Decode the next value from the buffer, consuming what was parsed."""
+        value, pos = self.decode(recv_buffer.data, recv_buffer.start)
+        recv_buffer.consume(pos - recv_buffer.start)
+        return value
 
-        case _:
-            raise ValueError("unknown redis ID", recv_id)
+
+def decode_redis(message: bytes, message_counter: int = 0) -> tuple[Any, int]:
+    value, pos = RespParser().decode(message, message_counter)
+    if value is RESP_PENDING:
+        return None, message_counter
+    return value, pos
 
 
 def encode_simple(value: Any, is_error: bool = False) -> bytes:
@@ -157,7 +156,7 @@ def encode_simple(value: Any, is_error: bool = False) -> bytes:
             (IDSimple.ERROR if is_error else IDSimple.STRING) + value
         ).encode() + REDIS_SEPARATOR
     if isinstance(value, int):
-        return (IDSimple.INTEGER + str(value)).encode() + REDIS_SEPARATOR
+        return encode_integer(value)
     if value is None:
         return IDSimple.NULL.encode() + REDIS_SEPARATOR
     if isinstance(value, bool):
@@ -169,27 +168,78 @@ def encode_simple(value: Any, is_error: bool = False) -> bytes:
     raise ValueError("unhandled redis encoding type", type(value))
 
 
+REDIS_SHARED_INTEGERS = 10000
+REDIS_SHARED_HEADERS = 32
+
+SHARED_INTEGERS = tuple(
+    (IDSimple.INTEGER + str(value)).encode() + REDIS_SEPARATOR
+    for value in range(REDIS_SHARED_INTEGERS)
+)
+SHARED_BULK_HEADERS = tuple(
+    (IDAggregate.BSTRING + str(length)).encode() + REDIS_SEPARATOR
+    for length in range(REDIS_SHARED_HEADERS)
+)
+SHARED_ARRAY_HEADERS = tuple(
+    (IDAggregate.ARRAY + str(length)).encode() + REDIS_SEPARATOR
+    for length in range(REDIS_SHARED_HEADERS)
+)
+
+REPLY_OK = encode_simple("OK")
+REPLY_QUEUED = encode_simple("QUEUED")
+REPLY_PONG = encode_simple("PONG")
+REPLY_NIL = (IDAggregate.BSTRING + "-1").encode() + REDIS_SEPARATOR
+REPLY_NIL_ARRAY = (IDAggregate.ARRAY + "-1").encode() + REDIS_SEPARATOR
+REPLY_EMPTY_BULK = SHARED_BULK_HEADERS[0] + REDIS_SEPARATOR
+REPLY_EMPTY_ARRAY = SHARED_ARRAY_HEADERS[0]
+
+
+def encode_integer(value: int) -> bytes:
+    if 0 <= value < REDIS_SHARED_INTEGERS:
+        return SHARED_INTEGERS[value]
+    return (IDSimple.INTEGER + str(value)).encode() + REDIS_SEPARATOR
+
+
+def encode_bulk_header(length: int) -> bytes:
+    if length < REDIS_SHARED_HEADERS:
+        return SHARED_BULK_HEADERS[length]
+    return (IDAggregate.BSTRING + str(length)).encode() + REDIS_SEPARATOR
+
+
+def encode_array_header(length: int) -> bytes:
+    if length < REDIS_SHARED_HEADERS:
+        return SHARED_ARRAY_HEADERS[length]
+    return (IDAggregate.ARRAY + str(length)).encode() + REDIS_SEPARATOR
+
+
+def encode_bulk(value: bytes) -> bytes:
+    return b"".join([encode_bulk_header(len(value)), value, REDIS_SEPARATOR])
+
+
+def encode_bulk_array(values: list[bytes]) -> bytes:
+    """Encode a flat list of bulk strings into one buffer."""
+    parts = [encode_array_header(len(values))]
+    for value in values:
+        parts.extend((encode_bulk_header(len(value)), value, REDIS_SEPARATOR))
+    return b"".join(parts)
+
+
 def encode_redis(value: Any, nil: bool = True) -> bytes:
-    logging.debug("new encode %s", str(value))
+    value_type = type(value)
+    if value_type is bytes:
+        return encode_bulk(value)
+    if value_type is int:
+        return encode_integer(value)
     if isinstance(value, str):
+        # an empty str is the database layer's "no value" marker
         if len(value) == 0:
-            if nil:
-                return (IDAggregate.BSTRING + "-1").encode() + REDIS_SEPARATOR
-            return (
-                (IDAggregate.BSTRING + "0").encode() + REDIS_SEPARATOR + REDIS_SEPARATOR
-            )
-        return (
-            (IDAggregate.BSTRING + str(len(value))).encode()
-            + REDIS_SEPARATOR
-            + value.encode()
-            + REDIS_SEPARATOR
-        )
+            return REPLY_NIL if nil else REPLY_EMPTY_BULK
+        return encode_bulk(value.encode())
+    if isinstance(value, bytes):
+        return encode_bulk(value)
     if isinstance(value, list):
         if len(value) == 0:
-            if nil:
-                return (IDAggregate.ARRAY + "-1").encode() + REDIS_SEPARATOR
-            return (IDAggregate.ARRAY + "0").encode() + REDIS_SEPARATOR
-        header = (IDAggregate.ARRAY + str(len(value))).encode() + REDIS_SEPARATOR
+            return REPLY_NIL_ARRAY if nil else REPLY_EMPTY_ARRAY
+        header = encode_array_header(len(value))
         data = [encode_redis(array_value, nil=nil) for array_value in value]
         return b"".join([header, *data])
     if isinstance(value, dict):
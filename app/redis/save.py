@@ -0,0 +1,145 @@
+import logging
+from time import monotonic, time
+
+from lib import curio
+
+from .config import get_config, get_save_rules
+from .database import bgsave_db, save_db
+from .info import register_info
+
+SAVE_CYCLE_PERIOD = 1
+BGSAVE_RETRY_DELAY = 5
+BGSAVE_RETRY_MAX = 300
+
+# changes since the last successful save, checked against the save rules
+REDIS_DIRTY = 0
+REDIS_LASTSAVE = int(time())
+REDIS_BGSAVE_START: float | None = None
+REDIS_BGSAVE_SCHEDULED = False
+REDIS_LASTBGSAVE_TRY = 0.0
+# background saves failed in a row, 0 after a success
+REDIS_BGSAVE_FAILS = 0
+REDIS_LASTBGSAVE_TIME = -1
+
+
+def add_dirty(changes: int = 1) -> None:
+    global REDIS_DIRTY
+    REDIS_DIRTY += changes
+
+
+def get_lastsave() -> int:
+    return REDIS_LASTSAVE
+
+
+def get_db_path() -> tuple[str, str] | None:
+    dirname, dbfilename = get_config("dir"), get_config("dbfilename")
+    if not dirname or not dbfilename:
+        return None
+    return dirname, dbfilename
+
+
+def save() -> str | None:
+    """Save on the event loop, returns an error message on failure"""
+    global REDIS_DIRTY, REDIS_LASTSAVE
+    if REDIS_BGSAVE_START is not None:
+        return "ERR Background save already in progress"
+    db_path = get_db_path()
+    if db_path is None:
+        return "ERR no dir and dbfilename to save to"
+
+    try:
+        save_db(*db_path)
+    except (OSError, TypeError) as e:
+        logging.warning("Error saving DB on disk: %s", e)
+        return f"ERR Error saving DB on disk: {e}"
+    REDIS_DIRTY = 0
+    REDIS_LASTSAVE = int(time())
+    return None
+
+
+def is_bgsave_running() -> bool:
+    return REDIS_BGSAVE_START is not None
+
+
+def schedule_bgsave() -> None:
+    """Have the save cycle start a background save after the running one"""
+    global REDIS_BGSAVE_SCHEDULED
+    REDIS_BGSAVE_SCHEDULED = True
+
+
+async def start_bgsave() -> str | None:
+    """Save in a background task, returns an error message on failure"""
+    global REDIS_BGSAVE_START, REDIS_BGSAVE_SCHEDULED
+    if REDIS_BGSAVE_START is not None:
+        return "ERR Background save already in progress"
+    db_path = get_db_path()
+    if db_path is None:
+        return "ERR no dir and dbfilename to save to"
+
+    REDIS_BGSAVE_START = monotonic()
+    REDIS_BGSAVE_SCHEDULED = False
+    await curio.spawn(run_bgsave, *db_path, REDIS_DIRTY, daemon=True)
+    return None
+
+
+async def run_bgsave(dirname: str, dbfilename: str, dirty: int) -> None:
+    global REDIS_DIRTY, REDIS_LASTSAVE, REDIS_BGSAVE_START
+    global REDIS_LASTBGSAVE_TRY, REDIS_BGSAVE_FAILS, REDIS_LASTBGSAVE_TIME
+    logging.info("Background saving started")
+    REDIS_LASTBGSAVE_TRY = time()
+    try:
+        await bgsave_db(dirname, dbfilename)
+    except (OSError, TypeError) as e:
+        logging.warning("Background saving error: %s", e)
+        REDIS_BGSAVE_FAILS += 1
+    else:
+        logging.info("Background saving terminated with success")
+        REDIS_BGSAVE_FAILS = 0
+        # writes made while saving are not in the file, they stay dirty
+        REDIS_DIRTY -= dirty
+        REDIS_LASTSAVE = int(time())
+    finally:
+        if REDIS_BGSAVE_START is not None:
+            REDIS_LASTBGSAVE_TIME = round(monotonic() - REDIS_BGSAVE_START)
+        REDIS_BGSAVE_START = None
+
+
+def is_save_due() -> bool:
+    now = time()
+    if REDIS_BGSAVE_FAILS:
+        # failures back off, a save that keeps failing is not retried hot
+        delay = BGSAVE_RETRY_DELAY * 2 ** (REDIS_BGSAVE_FAILS - 1)
+        if now - REDIS_LASTBGSAVE_TRY < min(delay, BGSAVE_RETRY_MAX):
+            return False
+    return any(
+        changes <= REDIS_DIRTY and now - REDIS_LASTSAVE >= seconds
+        for seconds, changes in get_save_rules()
+    )
+
+
+async def run_save_cycle() -> None:
+    """Start a background save once a save rule is met"""
+    while True:
+        await curio.sleep(SAVE_CYCLE_PERIOD)
+        if REDIS_BGSAVE_START is not None or get_db_path() is None:
+            continue
+        if REDIS_BGSAVE_SCHEDULED or is_save_due():
+            await start_bgsave()
+
+
+def get_persistence_info() -> dict[str, str | int]:
+    bgsave_time = -1
+    if REDIS_BGSAVE_START is not None:
+        bgsave_time = round(monotonic() - REDIS_BGSAVE_START)
+    return {
+        "loading": 0,
+        "rdb_changes_since_last_save": REDIS_DIRTY,
+        "rdb_bgsave_in_progress": int(REDIS_BGSAVE_START is not None),
+        "rdb_last_save_time": REDIS_LASTSAVE,
+        "rdb_last_bgsave_status": "err" if REDIS_BGSAVE_FAILS else "ok",
+        "rdb_last_bgsave_time_sec": REDIS_LASTBGSAVE_TIME,
+        "rdb_current_bgsave_time_sec": bgsave_time,
+    }
+
+
+register_info("persistence", get_persistence_info)
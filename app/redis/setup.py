@@ -1,4 +1,7 @@
-from .config import set_config
+from secrets import token_hex
+
+from .aof import create_aof, get_aof_path, load_aof, open_aof
+from .config import get_config, set_config
 from .database import load_db
 from .info import set_info
 
@@ -7,22 +10,32 @@ async def setup_redis(
     dirname: str | None,
     dbfilename: str | None = None,
     is_slave: bool = False,
+    appendonly: str | None = None,
+    appendfsync: str | None = None,
 ) -> None:
     if dirname:
         set_config("dir", dirname)
     if dbfilename:
         set_config("dbfilename", dbfilename)
+    if appendonly:
+        set_config("appendonly", appendonly)
+    if appendfsync:
+        set_config("appendfsync", appendfsync)
 
-    if dirname and dbfilename:
+    # the AOF is the more recent of the two when it is on
+    aof_fn = get_aof_path()
+    if get_config("appendonly") == "yes" and aof_fn.is_file():
+        await load_aof(aof_fn)
+    elif dirname and dbfilename:
         load_db(dirname, dbfilename)
 
+    if get_config("appendonly") == "yes":
+        if not aof_fn.is_file():
+            create_aof(aof_fn)
+        open_aof()
+
     if is_slave:
         set_info("replication", "role", "slave")
     else:
         set_info("replication", "role", "master")
-        set_info(
-            "replication",
-            "master_replid",
-            "8371b4fb1155b71f4a04d3e1bc3e18c4a990aeeb",
-        )
-        set_info("replication", "master_repl_offset", 0)
+        set_info("replication", "master_replid", token_hex(20))
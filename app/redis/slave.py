@@ -1,12 +1,26 @@
 import logging
-
-from app.redis.database import write_db
-from app.redis.rdb.data import encode_data
-from app.redis.resp import decode_redis, encode_redis
+from collections.abc import AsyncIterator
+from secrets import token_hex
+from typing import Any
+
+from app.redis.backlog import ReplBacklog
+from app.redis.config import get_config, parse_memory
+from app.redis.connection import RedisConnection
+from app.redis.database import snapshot_db
+from app.redis.info import get_info, register_info
+from app.redis.rdb import iter_rdb
+from app.redis.rdb.data import RDB_EOF_MARK_SIZE, encode_data_header
+from app.redis.resp import RESP_PENDING, RespParser, encode_redis, encode_simple
 from lib import curio
 
+REPL_BACKLOG_MIN_SIZE = 16 * 1024
+
 REDIS_OFFSET = 0
-REDIS_SLAVES: set[curio.io.Socket] = set()
+# created with the first replica, kept for the ones that reconnect
+REDIS_BACKLOG: ReplBacklog | None = None
+# replica connection to the last offset it acknowledged
+REDIS_SLAVES: dict[RedisConnection, int] = {}
+REDIS_SLAVE_ACK = curio.Event()
 
 
 async def add_offset(offset: int) -> None:
@@ -15,67 +29,161 @@ async def add_offset(offset: int) -> None:
     logging.info("Updated offset %d", REDIS_OFFSET)
 
 
-async def register_slave(sock: curio.io.Socket) -> None:
-    logging.info("Adding slave %s", str(sock.getpeername()))
-    await sock.sendall(encode_data(write_db()))
-    REDIS_SLAVES.add(sock)
-
-
-async def get_offset(res_queue: curio.Queue, sid: int, sock: curio.io.Socket) -> None:
-    send_message = encode_redis(["REPLCONF", "GETACK", "*"])
-    await sock.sendall(send_message)
-
-    recv_message = b""
+def get_backlog() -> ReplBacklog:
+    global REDIS_BACKLOG
+    if REDIS_BACKLOG is None:
+        size = parse_memory(get_config("repl-backlog-size") or "1mb")
+        # like redis, a smaller size, 0 included, gets the minimum
+        size = max(size, REPL_BACKLOG_MIN_SIZE)
+        REDIS_BACKLOG = ReplBacklog(size, REDIS_OFFSET)
+    return REDIS_BACKLOG
+
+
+def register_slave(connection: RedisConnection, replid: str, offset: int) -> bytes:
+    """Attach a replica, returns the PSYNC reply and what it is missing
+
+    A replica asking for the next byte of our own stream, still in the
+    backlog, only gets the bytes after it. Any other gets a snapshot,
+    streamed by its writer ahead of the writes that follow.
+    """
+    if connection.sock is not None:
+        logging.info("Adding slave %s", str(connection.sock.getpeername()))
+    master_replid = str(get_info("replication", "master_replid"))
+    missing = None
+    if replid == master_replid and offset > 0:
+        missing = get_backlog().get_range(offset - 1)
+    else:
+        get_backlog()
+
+    # registered together with the snapshot, writes from now on queue up
+    # behind the reply in the replica output buffer
+    connection.client_class = "replica"
+    if missing is not None:
+        REDIS_SLAVES[connection] = offset - 1
+        return encode_simple(f"CONTINUE {master_replid}") + missing
+    REDIS_SLAVES[connection] = REDIS_OFFSET
+    connection.push_stream(
+        iter_snapshot(*snapshot_db(), eof=b"eof" in connection.replica_capa)
+    )
+    return encode_simple(f"FULLRESYNC {master_replid} {REDIS_OFFSET}")
+
+
+async def iter_snapshot(
+    meta: dict[str, str | int],
+    data: dict[int, dict[bytes, dict[str, Any]]],
+    dexp: dict[int, dict[bytes, int]],
+    eof: bool,
+) -> AsyncIterator[bytes]:
+    """RDB payload of a snapshot, encoded while it is sent
+
+    Other clients are served between chunks, also during the dry run that
+    replicas without capa eof cost to send the length first.
+    """
+    mark = token_hex(RDB_EOF_MARK_SIZE // 2).encode()
+    if eof:
+        yield encode_data_header(mark)
+    else:
+        size = 0
+        for chunk in iter_rdb(meta, data, dexp, checksum=False):
+            size += len(chunk)
+            await curio.sleep(0)
+        yield encode_data_header(size)
+
+    for chunk in iter_rdb(meta, data, dexp):
+        yield chunk
+        await curio.sleep(0)
+    if eof:
+        yield mark
+
+
+async def read_slave_acks(connection: RedisConnection) -> None:
+    sock = connection.sock
+    if sock is None:
+        return
+    recv_buffer = connection.recv_buffer
+    parser = RespParser()
     while True:
-        recv_message += await sock.recv(100)
-        command_line, parsed_length = decode_redis(recv_message)
-        if parsed_length > 0:
-            break
+        while len(recv_buffer) > 0:
+            command_line = parser.parse(recv_buffer)
+            if command_line is RESP_PENDING:
+                break
+            if (
+                len(command_line) == 3
+                and command_line[0].upper() == b"REPLCONF"
+                and command_line[1].upper() == b"ACK"
+            ):
+                REDIS_SLAVES[connection] = int(command_line[2])
+                await REDIS_SLAVE_ACK.set()
+        try:
+            if await recv_buffer.recv(sock) == 0:
+                return
+        except OSError as e:
+            logging.warning("Slave connection failed: %s", e)
+            return
+
 
-    assert command_line[0] == "REPLCONF"
-    assert command_line[1] == "ACK"
-    await res_queue.put((sid, int(command_line[2])))
+async def wait_slave_closed(connection: RedisConnection) -> None:
+    """Run the replica writer and ACK reader until either one stops"""
+    try:
+        async with curio.TaskGroup(wait=any) as group:
+            await group.spawn(connection.write_pushes)
+            await group.spawn(read_slave_acks, connection)
+    finally:
+        logging.info("Removing slave")
+        del REDIS_SLAVES[connection]
 
 
 async def send_write(send_message: bytes) -> None:
     logging.info("Replicating message %d %s...", len(send_message), repr(send_message))
     await add_offset(len(send_message))
-    closed = []
-    for sock in REDIS_SLAVES:
-        logging.info("...to %s", str(sock.getpeername()))
-        try:
-            await sock.sendall(send_message)
-        except:
-            closed.append(sock)
-    for sock in closed:
-        REDIS_SLAVES.discard(sock)
+    if REDIS_BACKLOG is not None:
+        REDIS_BACKLOG.append(send_message)
+    # each replica drains its own output buffer, a slow one only grows it
+    for connection in list(REDIS_SLAVES):
+        await connection.push(send_message)
+
 
+def get_acked_slaves(offset: int) -> int:
+    return sum(1 for acked in REDIS_SLAVES.values() if acked >= offset)
 
-async def wait_slaves(num_slaves: int, timeout_ms: int) -> int:
+
+async def wait_acked_slaves(num_slaves: int, offset: int) -> None:
+    while get_acked_slaves(offset) < num_slaves:
+        REDIS_SLAVE_ACK.clear()
+        await REDIS_SLAVE_ACK.wait()
+
+
+async def wait_slaves(num_slaves: int, timeout_ms: int, block: bool = True) -> int:
     logging.info("Checking offsets %d", REDIS_OFFSET)
     if REDIS_OFFSET == 0:
         return len(REDIS_SLAVES)
 
-    res_queue = curio.Queue()
-    slaves = dict(enumerate(REDIS_SLAVES))
-
-    try:
-        async with (
-            curio.timeout_after(float(timeout_ms) / 1000),
-            curio.TaskGroup(wait=all) as g,
-        ):
-            for sid, sock in slaves.items():
-                await g.spawn(get_offset(res_queue, sid, sock))
-    except curio.TaskTimeout:
-        pass
-
-    slave_offsets = {}
-    while not res_queue.empty():
-        sid, offset = await res_queue.get()
-        slave_offsets[sid] = offset
-    logging.info("Slave offsets %s", repr(list(slave_offsets.values())))
-    updated_slaves = len([1 for o in slave_offsets.values() if o == REDIS_OFFSET])
-
-    send_message = encode_redis(["REPLCONF", "GETACK", "*"])
-    await add_offset(len(send_message))
+    offset = REDIS_OFFSET
+    if block and get_acked_slaves(offset) < num_slaves:
+        # replicas ack the offset before this GETACK
+        await send_write(encode_redis(["REPLCONF", "GETACK", "*"]))
+        if timeout_ms > 0:
+            await curio.ignore_after(
+                timeout_ms / 1000, wait_acked_slaves(num_slaves, offset)
+            )
+        else:
+            await wait_acked_slaves(num_slaves, offset)
+
+    updated_slaves = get_acked_slaves(offset)
+    logging.info("Slave offsets %s", repr(list(REDIS_SLAVES.values())))
     return updated_slaves
+
+
+def get_replication_info() -> dict[str, str | int]:
+    info: dict[str, str | int] = {"connected_slaves": len(REDIS_SLAVES)}
+    if get_info("replication", "role") == "master":
+        info["master_repl_offset"] = REDIS_OFFSET
+    info["repl_backlog_active"] = int(REDIS_BACKLOG is not None)
+    if REDIS_BACKLOG is not None:
+        info["repl_backlog_size"] = REDIS_BACKLOG.size
+        info["repl_backlog_first_byte_offset"] = REDIS_BACKLOG.first_offset + 1
+        info["repl_backlog_histlen"] = REDIS_BACKLOG.histlen
+    return info
+
+
+register_info("replication", get_replication_info)
@@ -1,15 +1,18 @@
 import logging
 
 from app.redis import (
-    REDIS_QUIT,
-    decode_redis,
+    RESP_PENDING,
+    RedisConnection,
+    RespParser,
+    flush_aof,
     handle_redis,
-    pub_message,
-    register_slave,
-    send_write,
+    punsub_pattern,
+    run_aof_cycle,
+    run_expire_cycle,
+    run_save_cycle,
     setup_redis,
-    sub_channel,
     unsub_channel,
+    wait_slave_closed,
 )
 from lib import curio
 
@@ -22,99 +25,69 @@ REDIS_PORT = 6379
 async def client_connected_cb(client: curio.io.Socket, addr: str) -> None:
     logging.info("[%s] New connection", addr)
 
+    connection = RedisConnection(client)
+    sub_task: curio.Task | None = None
+    recv_buffer = connection.recv_buffer
+    parser = RespParser()
     connected = True
-    is_replica = False
-    multi_state = False
-    multi_commands: list[list[str]] | None = None
-    sub_mode = False
-    subbed_channels: set[str] | None = None
-    sub_queue = curio.Queue()
-    recv_message = b""
     while connected:
-        try:
-            new_data = await curio.timeout_after(0.01, client.recv, 100)
-            if new_data == b"":
-                connected = False
-            recv_message += new_data
-        except curio.TaskTimeout:
-            pass
-
-        while not sub_queue.empty():
-            logging.info("[%s] Received sub %d", addr, sub_queue.qsize())
-            await client.sendall(await sub_queue.get())
-
-        if len(recv_message) > 0:
-            logging.info("[%s] Recv %s", addr, recv_message)
-            command_line, parsed_length = decode_redis(recv_message)
-            if parsed_length == 0:
-                continue
+        if await recv_buffer.recv(client) == 0:
+            connected = False
+
+        while len(recv_buffer) > 0:
+            logging.info("[%s] Recv %d", addr, len(recv_buffer))
+            command_line = parser.parse(recv_buffer)
+            if command_line is RESP_PENDING:
+                break
             logging.info(
                 "[%s] Command line %s (%d)",
                 str(addr),
                 str(command_line),
-                parsed_length,
+                parser.length,
             )
 
-            (
-                send_message,
-                is_replica,
-                send_replica,
-                _,
-                multi_state,
-                multi_commands,
-                sub_mode,
-                new_channels,
-                send_pub,
-            ) = await handle_redis(
-                command_line,
-                0,
-                multi_state,
-                multi_commands,
-                sub_mode,
-                subbed_channels,
-            )
+            await handle_redis(connection, command_line)
 
-            recv_message = recv_message[parsed_length:]
+            if connection.sub_mode and sub_task is None:
+                sub_task = await curio.spawn(connection.write_pushes, daemon=True)
 
-            if send_message == REDIS_QUIT:
+            if connection.quit or connection.is_replica:
+                connected = False
                 break
 
-            if new_channels is not None:
-                if subbed_channels is None:
-                    subbed_channels = set()
-                added_channels = new_channels - subbed_channels
-                for ch in added_channels:
-                    subbed_channels.add(ch)
-                    await sub_channel(ch, sub_queue)
-                removed_channels = subbed_channels - new_channels
-                for ch in removed_channels:
-                    subbed_channels.discard(ch)
-                    await unsub_channel(ch, sub_queue)
-
-            if send_pub is not None:
-                await pub_message(send_pub[0], send_pub[1])
-
-            logging.info("[%s] Send %s", addr, send_message)
-            await client.sendall(send_message)
-
-            if is_replica:
-                await register_slave(client)
-                break
+        logging.info("[%s] Send %d replies", addr, len(connection.replies))
+        # commands reach the AOF before their replies reach the client
+        await flush_aof()
+        await connection.flush()
 
-            if send_replica:
-                await send_write(send_replica)
+    if sub_task is not None:
+        await sub_task.cancel()
+    for ch in connection.subbed_channels:
+        await unsub_channel(ch, connection)
+    for pattern in connection.subbed_patterns:
+        await punsub_pattern(pattern, connection)
+    for ch in connection.subbed_shard_channels:
+        await unsub_channel(ch, connection, shard=True)
 
-    while is_replica:
-        await curio.sleep(0)
+    if connection.is_replica:
+        await wait_slave_closed(connection)
 
     logging.info("[%s] Connection closed", addr)
 
 
 async def run_server(
-    dbdirname: str, dbfilename: str, port: int = REDIS_PORT, replicaof: str = ""
+    dbdirname: str,
+    dbfilename: str,
+    port: int = REDIS_PORT,
+    replicaof: str = "",
+    appendonly: str | None = None,
+    appendfsync: str | None = None,
 ) -> None:
     is_slave = replicaof is not None
-    await setup_redis(dbdirname, dbfilename, is_slave)
+    await setup_redis(dbdirname, dbfilename, is_slave, appendonly, appendfsync)
+    _ = await curio.spawn(run_expire_cycle, daemon=True)
+    _ = await curio.spawn(run_save_cycle, daemon=True)
+    _ = await curio.spawn(run_aof_cycle, daemon=True)
     if is_slave:
         _ = await curio.spawn(run_client, replicaof, port)
 
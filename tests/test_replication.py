@@ -0,0 +1,102 @@
+import socket
+import subprocess
+import sys
+import time
+import unittest
+from pathlib import Path
+from typing import Any
+
+from app.redis.resp import decode_redis, encode_redis
+
+ROOT = Path(__file__).parent.parent
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return int(sock.getsockname()[1])
+
+
+def start_server(port: int, *args: str) -> subprocess.Popen[bytes]:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "app.main", "--port", str(port), *args], cwd=ROOT
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("localhost", port)).close()
+        except OSError:
+            time.sleep(0.05)
+        else:
+            return process
+    stop_server(process)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def stop_server(process: subprocess.Popen[bytes]) -> None:
+    process.kill()
+    process.wait()
+
+
+class Client:
+    def __init__(self, port: int) -> None:
+        self.sock = socket.create_connection(("localhost", port), timeout=5)
+        self.buffer = b""
+
+    def __call__(self, *command_line: str) -> Any:
+        self.sock.sendall(encode_redis(list(command_line)))
+        while True:
+            value, pos = decode_redis(self.buffer)
+            if pos:
+                self.buffer = self.buffer[pos:]
+                return value
+            self.buffer += self.sock.recv(65536)
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class FullSyncTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.port = get_free_port()
+        self.master = start_server(self.port)
+        self.addCleanup(stop_server, self.master)
+        self.client = Client(self.port)
+        self.addCleanup(self.client.close)
+
+    def dump(self, client: Client) -> list[Any]:
+        return [
+            [client("TYPE", key) for key in ("s", "l", "z", "g", "x")],
+            client("GET", "s"),
+            client("LRANGE", "l", "0", "-1"),
+            client("ZRANGE", "z", "0", "-1", "WITHSCORES"),
+            client("GEOPOS", "g", "Palermo", "Catania"),
+            client("XRANGE", "x", "-", "+"),
+        ]
+
+    def test_every_type(self) -> None:
+        self.client("SET", "s", "value")
+        self.client("RPUSH", "l", "a", "123", "x" * 100)
+        self.client("ZADD", "z", "1.5", "one", "-2", "two", "inf", "top")
+        self.client(
+            "GEOADD", "g", "13.361389", "38.115556", "Palermo",
+            "15.087269", "37.502669", "Catania",
+        )  # fmt: skip
+        self.client("XADD", "x", "1-1", "f", "v")
+        self.client("XADD", "x", "2-1", "f", "w")
+        self.client("XADD", "x", "3-1", "other", "v")
+        expected = self.dump(self.client)
+
+        port = get_free_port()
+        replica = start_server(port, "--replicaof", f"localhost {self.port}")
+        self.addCleanup(stop_server, replica)
+        client = Client(port)
+        self.addCleanup(client.close)
+        for _ in range(100):
+            if len(client("KEYS", "*")) == 5:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.dump(client), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()